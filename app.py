@@ -16,6 +16,7 @@ from obelix.routes import init_routes
 from obelix.socketio_events import init_socketio
 from obelix.sensor_monitor import start_sensor_monitor
 from obelix.auto_control import start_sbr_controller
+from obelix.retention import start_retention_worker
 
 app = Flask(__name__, static_folder='static')
 app.config.from_object(Config)
@@ -27,4 +28,5 @@ if __name__ == '__main__':
     init_socketio(socketio)
     socketio.start_background_task(start_sensor_monitor, socketio)
     start_sbr_controller(socketio)
+    start_retention_worker()
     socketio.run(app, host='0.0.0.0', port=5001, debug=False, use_reloader=False)
\ No newline at end of file
@@ -1,11 +1,21 @@
 # obelix/auto_control.py
 
+import json
 import threading
+import time
+from collections import deque
 from flask_socketio import SocketIO
 from obelix.config import Config
-from obelix.database import get_setting, set_setting, save_relay_state, get_relay_state
-from obelix.modbus_client import get_clients, modbus_lock
+from obelix.database import (
+    get_setting, set_setting, save_relay_state, get_relay_state, save_aio_setting
+)
+from obelix.modbus_client import (
+    get_clients, write_coils, write_holding_register, poll_due, PRIO_CONTROL
+)
+from obelix.process_image import process_image
+from obelix.metrics import sbr_lateness_seconds
 from obelix.r302_manager import R302Controller
+from obelix.sbr_recipe import load_active_recipe, store_recipe
 from obelix.utils import log
 
 sbr_controller = None
@@ -17,7 +27,24 @@ class SBRController:
         self.r302_unit   = 0
         self.r302_ctrl   = R302Controller(unit_index=self.r302_unit)
         self.start_event = threading.Event()
-        self.timer       = 0
+        self._wake       = threading.Event()  # onderbreekt het wachten op een deadline
+
+        # Tijdsbasis: alles op time.monotonic(), zodat fases niet driften
+        self.phase            = None   # lopende Phase uit de transitietabel
+        self._phase_start     = None   # geplande starttijd van de huidige fase
+        self._timer_origin    = None   # begin van de timer (None = gestopt)
+        self._timer_frozen    = 0
+        self._times_changed_at = 0.0   # moment van de laatste wijziging van fasetijden
+
+        # Lateness per transitie (s): 'wake' = te laat wakker, 'applied' = relays geschakeld
+        self.lateness     = deque(maxlen=Config.SBR_LATENESS_WINDOW)
+        self.transitions  = 0
+
+        # Checkpoint in settings.db: bij transities en hooguit elke
+        # SBR_CHECKPOINT_INTERVAL seconden, zodat een herstart verder kan
+        self._cycle_recipe    = None  # recept van de lopende cycle
+        self._last_checkpoint = 0.0
+        self._resume          = None  # (fase-index, fase-elapsed, cycle-elapsed)
 
         # Lees fasetijden (minuten) uit DB, met fallback
         infl = float(get_setting('sbr_influent_time_minutes', None)
@@ -28,39 +55,170 @@ class SBRController:
         self.effluent_time = effl
         self._update_phase_secs()
 
-        # Bij inactiviteit: zet AUTO-relays uit en stuur status + tijden
+        # Recept één keer laden en compileren; een nieuw recept gaat pas in
+        # op de volgende cyclusgrens
+        self.recipe = load_active_recipe(self.influent_secs, self.effluent_secs)
+        self._pending_recipe = None
+        log(f"📋 SBR-recept '{self.recipe.name}': "
+            f"{' → '.join(p.name for p in self.recipe.phases)}")
+
+        # Bij inactiviteit: zet AUTO-relays uit en stuur status + tijden.
+        # Was de cycle actief (herstart/crash), dan direct hervatten.
         if get_setting('sbr_cycle_active', '0') == '0':
             self._set_all_auto_off()
             self._emit_status()
             self._emit_phase_times()
+        else:
+            self._resume = self._load_checkpoint(self.recipe) or (0, 0.0, 0.0)
+            self.start_event.set()
 
     def _update_phase_secs(self):
-        """Converteer minuten naar seconden."""
-        self.influent_secs = int(self.influent_time * 60)
-        self.effluent_secs = int(self.effluent_time * 60)
+        """Converteer minuten naar seconden (afgerond, zoals de UI)."""
+        self.influent_secs = max(1, round(self.influent_time * 60))
+        self.effluent_secs = max(1, round(self.effluent_time * 60))
+
+    @property
+    def timer(self):
+        """Seconden sinds het begin van de huidige cycle (of de laatste reset)."""
+        if self._timer_origin is None:
+            return self._timer_frozen
+        return max(0, round(time.monotonic() - self._timer_origin))
+
+    def _record_transition(self, phase_name, wake_late, applied_late):
+        self.transitions += 1
+        self.lateness.append((wake_late, applied_late))
+        sbr_lateness_seconds.observe(wake_late, 'wake')
+        sbr_lateness_seconds.observe(applied_late, 'applied')
+        if applied_late > 1.0:
+            log(f"⚠ SBR-transitie naar {phase_name} {applied_late:.2f}s te laat",
+                key=f'sbr_late:{phase_name}')
+        self.socketio.emit('sbr_timing', self.get_timing_stats(), namespace='/sbr')
+
+    def get_timing_stats(self):
+        """Jitter-statistiek over de laatste SBR_LATENESS_WINDOW transities (ms)."""
+        stats = {'transitions': self.transitions, 'window': len(self.lateness)}
+        for i, name in enumerate(('wake', 'applied')):
+            vals = sorted(l[i] * 1000 for l in self.lateness)
+            if not vals:
+                stats[name] = None
+                continue
+            stats[name] = {
+                'last_ms': round(self.lateness[-1][i] * 1000, 1),
+                'mean_ms': round(sum(vals) / len(vals), 1),
+                'p95_ms':  round(vals[min(len(vals) - 1, int(len(vals) * 0.95))], 1),
+                'max_ms':  round(vals[-1], 1),
+            }
+        return stats
+
+    def _checkpoint(self):
+        """Leg fase-index, verstreken tijd en wandkloktijd vast in settings.db."""
+        phase, start, recipe = self.phase, self._phase_start, self._cycle_recipe
+        if phase is None or start is None or recipe is None:
+            return
+        now = time.monotonic()
+        set_setting('sbr_checkpoint', json.dumps({
+            'recipe':        recipe.name,
+            'phase':         phase.index,
+            'phase_elapsed': round(now - start, 3),
+            'cycle_elapsed': round(now - self._timer_origin, 3) if self._timer_origin else 0.0,
+            'wall':          time.time()
+        }))
+        self._last_checkpoint = now
+
+    def _load_checkpoint(self, recipe):
+        """
+        Bepaal waar een onderbroken cycle verder moet: (fase-index,
+        fase-elapsed, cycle-elapsed), of None als er geen bruikbaar
+        checkpoint is. Met Config.SBR_RESUME_COUNT_DOWNTIME telt de tijd
+        dat het systeem uit stond mee; verlopen fases worden dan overgeslagen.
+        """
+        raw = get_setting('sbr_checkpoint', '')
+        if not raw:
+            return None
+        try:
+            cp = json.loads(raw)
+            idx, elapsed, cycle = int(cp['phase']), float(cp['phase_elapsed']), float(cp['cycle_elapsed'])
+        except (ValueError, KeyError, TypeError) as e:
+            log(f"⚠ SBR-checkpoint onleesbaar ({e}), cycle begint opnieuw")
+            return None
+        if cp.get('recipe') != recipe.name or not 0 <= idx < len(recipe.phases):
+            log(f"⚠ SBR-checkpoint hoort bij recept '{cp.get('recipe')}', cycle begint opnieuw")
+            return None
+
+        downtime = max(0.0, time.time() - float(cp.get('wall', time.time())))
+        if Config.SBR_RESUME_COUNT_DOWNTIME:
+            elapsed += downtime
+            cycle += downtime
+            for _ in range(len(recipe.phases)):
+                phase = recipe.phases[idx]
+                if elapsed < phase.duration:
+                    break
+                elapsed -= phase.duration
+                idx = phase.next
+                if idx == 0:
+                    cycle = elapsed
+            else:
+                # Langer uit dan een hele cycle: begin de bereikte fase opnieuw
+                elapsed = 0.0
+                cycle = 0.0 if idx == 0 else cycle
+        log(f"↩ SBR hervat: fase {recipe.phases[idx].name}, {elapsed:.0f}s verstreken "
+            f"(uit: {downtime:.0f}s)")
+        return idx, elapsed, cycle
+
+    def _current_state(self, coil):
+        """'ON'/'OFF' uit het procesbeeld als de tag goed is, anders de opgeslagen toestand."""
+        key = ('coil', self.r302_unit, coil)
+        if process_image.is_good(key):
+            return 'ON' if process_image.value(key) else 'OFF'
+        return get_relay_state(self.r302_unit, coil)
+
+    def _write_auto_coils(self, targets, force=False):
+        """
+        Zet de AUTO-coils uit targets ({coil: bool}) die afwijken in één
+        bustransactie (FC15). Met force worden alle AUTO-coils geschreven,
+        ongeacht de bekende toestand. Retourneert {coil: 'ON'/'OFF'} van wat
+        geschreven is.
+        """
+        changes = {
+            coil: want_on for coil, want_on in targets.items()
+            if self.r302_ctrl.get_mode(coil) == 'AUTO'
+            and (force or self._current_state(coil) != ('ON' if want_on else 'OFF'))
+        }
+        if not changes:
+            return {}
+        if not poll_due(self.r302_unit):
+            # Slave in backoff: niet op een timeout wachten
+            raise RuntimeError(f"R302-relaymodule (unit {self.r302_unit}) reageert niet (backoff)")
+        write_coils(self.r302_unit, changes, priority=PRIO_CONTROL)
+        written = {coil: 'ON' if on else 'OFF' for coil, on in changes.items()}
+        for coil, state in written.items():
+            save_relay_state(self.r302_unit, coil, state)
+        return written
 
     def _set_all_auto_off(self):
-        inst = self.clients[self.r302_unit]
-        for coil in Config.R302_RELAY_MAPPING:
-            if self.r302_ctrl.get_mode(coil) == 'AUTO' and get_relay_state(self.r302_unit, coil) != 'OFF':
-                with modbus_lock:
-                    inst.write_bit(coil, False, functioncode=5)
-                    save_relay_state(self.r302_unit, coil, 'OFF')
-                log(f"⚙ Set AUTO relay {coil} off during idle")
+        """
+        Zet alle AUTO-relays uit. Een onbereikbare relaymodule mag opstarten
+        en STOP niet blokkeren: de fout wordt gelogd en naar de UI gestuurd.
+        """
+        try:
+            written = self._write_auto_coils({coil: False for coil in Config.R302_RELAY_MAPPING})
+        except Exception as e:
+            log(f"❌ SBR: AUTO-relays uitzetten mislukt: {e}")
+            self.socketio.emit('sbr_error', {'error': f'AUTO-relays uitzetten mislukt: {e}'},
+                               namespace='/sbr')
+            written = {}
+        for coil in written:
+            log(f"⚙ Set AUTO relay {coil} off during idle")
         self.socketio.emit('r302_update', self.r302_ctrl.get_status(), namespace='/r302')
 
-    def _apply_phase(self, phase_coil):
-        inst = self.clients[self.r302_unit]
-        for coil in Config.R302_RELAY_MAPPING:
-            if self.r302_ctrl.get_mode(coil) == 'AUTO':
-                want_on = (coil == phase_coil)
-                want = 'ON' if want_on else 'OFF'
-                if get_relay_state(self.r302_unit, coil) != want:
-                    with modbus_lock:
-                        inst.write_bit(coil, want_on, functioncode=5)
-                        save_relay_state(self.r302_unit, coil, want)
-                    label = 'Influent' if coil == 0 else 'Effluent'
-                    log(f"⚙ Phase {label}: set relay {coil} to {want}")
+    def _apply_phase(self, phase, force=False):
+        written = self._write_auto_coils(phase.targets, force=force)
+        for coil, want in written.items():
+            log(f"⚙ Phase {phase.name}: set relay {coil} to {want}")
+        for ch, raw, pct in phase.aio:
+            write_holding_register(Config.AIO_IDX, ch, raw, priority=PRIO_CONTROL)
+            save_aio_setting(ch, pct)
+            log(f"⚙ Phase {phase.name}: AIO {ch} op {pct}%")
         self.socketio.emit('r302_update', self.r302_ctrl.get_status(), namespace='/r302')
 
     def set_phase_times(self, influent_min: float, effluent_min: float):
@@ -69,6 +227,15 @@ class SBRController:
         self.influent_time = influent_min
         self.effluent_time = effluent_min
         self._update_phase_secs()
+        # Fases met deze namen in het lopende (en een wachtend) recept volgen mee
+        for recipe in filter(None, (self.recipe, self._pending_recipe)):
+            recipe.set_duration('influent', self.influent_secs)
+            recipe.set_duration('effluent', self.effluent_secs)
+        store_recipe(self._pending_recipe or self.recipe)
+        # Lopende fase herberekent zijn deadline; is die al verstreken, dan
+        # geldt dit moment als geplande transitie (geen kunstmatige lateness)
+        self._times_changed_at = time.monotonic()
+        self._wake.set()
         log(f"⏱ SBRController: Influent={influent_min}m ({self.influent_secs}s), "
             f"Effluent={effluent_min}m ({self.effluent_secs}s)")
         self._emit_phase_times()
@@ -80,18 +247,39 @@ class SBRController:
             'effluent_minutes': self.effluent_time,
             'effluent_seconds': self.effluent_secs
         }, namespace='/sbr')
+        self._emit_recipe()
+
+    def set_recipe(self, recipe):
+        """Sla een gecompileerd recept op; het gaat in op de volgende cyclusgrens."""
+        store_recipe(recipe)
+        if self.start_event.is_set():
+            self._pending_recipe = recipe
+            log(f"📋 SBR-recept '{recipe.name}' opgeslagen, actief vanaf de volgende cycle")
+        else:
+            self.recipe = recipe
+            log(f"📋 SBR-recept '{recipe.name}' actief")
+        self._emit_recipe(recipe)
+
+    def _emit_recipe(self, recipe=None):
+        recipe = recipe or self._pending_recipe or self.recipe
+        self.socketio.emit('sbr_recipe', recipe.as_dict(), namespace='/sbr')
 
     def stop(self):
         self.start_event.clear()
+        self._wake.set()
         set_setting('sbr_cycle_active', '0')
+        set_setting('sbr_checkpoint', '')
         self._set_all_auto_off()
         log("⏹ SBRController: STOP gedrukt, alles AUTO-OFF")
         self._emit_status()
 
     def reset(self):
-        self.timer = 0
+        if self._timer_origin is None:
+            self._timer_frozen = 0
+        else:
+            self._timer_origin = time.monotonic()
         log("🔄 SBRController: RESET gedrukt")
-        self.socketio.emit('sbr_timer', {'timer': self.timer}, namespace='/sbr')
+        self._emit_timer()
 
     def start(self):
         self.start_event.set()
@@ -102,7 +290,23 @@ class SBRController:
     def _emit_status(self):
         active = self.start_event.is_set()
         self.socketio.emit('sbr_status', {'active': active}, namespace='/sbr')
-        self.socketio.emit('sbr_timer', {'timer': self.timer}, namespace='/sbr')
+        self._emit_timer()
+
+    def _emit_timer(self):
+        payload = {'timer': self.timer}
+        phase, phase_start = self.phase, self._phase_start
+        if phase and phase_start is not None:
+            elapsed = max(0, round(time.monotonic() - phase_start))
+            payload.update({
+                'phase': phase.name,
+                'phase_index': phase.index,
+                'phase_elapsed': elapsed,
+                # Zonder vaste duur (alleen until-conditie): geen totaal
+                'phase_duration': round(phase.duration) if phase.duration != float('inf') else None
+            })
+            if payload['phase_duration'] is not None:
+                payload['phase_elapsed'] = min(elapsed, payload['phase_duration'])
+        self.socketio.emit('sbr_timer', payload, namespace='/sbr')
 
     def run(self):
         global sbr_controller
@@ -110,40 +314,98 @@ class SBRController:
         log("▶ SBRController: Thread gestart")
         while True:
             self.start_event.wait()
-            log("🚀 SBR cycle gestart")
+            idx, offset, cycle_offset = self._resume or (0, 0.0, 0.0)
+            resumed, self._resume = self._resume is not None, None
+            log("🚀 SBR cycle hervat" if resumed else "🚀 SBR cycle gestart")
 
-            if not self.start_event.is_set():
-                continue
-            self._phase_loop(phase_coil=0)
+            # Elke fase begint op de deadline van de vorige, niet op "nu":
+            # vertraging in schrijven of emitten schuift de cycle niet op.
+            # Bij hervatten ligt het begin van de fase in het verleden.
+            now = time.monotonic()
+            t = now - offset
+            self._timer_origin = now - cycle_offset
+            recipe = self._cycle_recipe = self.recipe
+            while self.start_event.is_set():
+                phase = recipe.phases[idx]
+                t = self._phase_loop(phase, start=t, resumed=resumed)
+                resumed = False
+                if t is None:
+                    break
+                idx = phase.next
+                if idx == 0:
+                    log("✅ Volledige SBR cycle klaar")
+                    self._timer_origin = t
+                    if self._pending_recipe is not None:
+                        self.recipe, self._pending_recipe = self._pending_recipe, None
+                        log(f"📋 SBR-recept '{self.recipe.name}' actief")
+                    recipe = self._cycle_recipe = self.recipe
 
-            if not self.start_event.is_set():
-                continue
-            self._phase_loop(phase_coil=1)
+            self._timer_frozen = self.timer
+            self._timer_origin = None
+            self.phase = self._phase_start = None
 
-            self.timer = 0
-            log("✅ Volledige SBR cycle klaar")
+    def _phase_loop(self, phase, start, resumed=False):
+        """
+        Draai één fase vanaf het geplande moment start (monotonic).
+        Retourneert het geplande of door de until-conditie bepaalde
+        eindmoment, of None als de cycle gestopt is. Per tick kost dit één
+        deadline-vergelijking en hooguit één sensorconditie.
 
-    def _phase_loop(self, phase_coil):
-        phase_name = 'influent' if phase_coil == 0 else 'effluent'
-        self._apply_phase(phase_coil)
+        Bij hervatten na een herstart is de relaystand onbekend: dan worden
+        alle AUTO-uitgangen van de fase geschreven en telt de transitie
+        niet mee in de lateness-statistiek.
+        """
+        wake_late = time.monotonic() - start
+        self.phase, self._phase_start = phase, start
+        try:
+            self._apply_phase(phase, force=resumed)
+        except Exception as e:
+            # Planning loopt door; de scan-loop herstelt de relaystand
+            log(f"❌ SBR-transitie naar {phase.name} mislukt: {e}")
+            self.socketio.emit('sbr_error', {'error': f'Transitie naar {phase.name} mislukt: {e}'},
+                               namespace='/sbr')
+        if not resumed:
+            self._record_transition(phase.name, wake_late, time.monotonic() - start)
+        self._checkpoint()
+        self._emit_timer()  # faseovergang direct tonen, niet pas bij de volgende tick
 
-        elapsed = 0
         while self.start_event.is_set():
-            duration = getattr(self, f"{phase_name}_secs")
-            if elapsed >= duration:
-                break
-            self.socketio.sleep(1)
-            self.timer += 1
-            elapsed += 1
-            self.socketio.emit('sbr_timer', {
-                'timer': self.timer,
-                'phase': phase_name,
-                'phase_elapsed': elapsed,
-                'phase_duration': duration
-            }, namespace='/sbr')
+            deadline = max(start + phase.duration, self._times_changed_at)
+            now = time.monotonic()
+            if now >= deadline:
+                return deadline
+            if phase.until is not None and phase.until():
+                log(f"⏭ Fase {phase.name}: eindconditie bereikt")
+                return now
+            next_checkpoint = self._last_checkpoint + Config.SBR_CHECKPOINT_INTERVAL
+            if now >= next_checkpoint:
+                self._checkpoint()
+                next_checkpoint = now + Config.SBR_CHECKPOINT_INTERVAL
+            timeout = min(deadline, next_checkpoint) - now
+            if phase.until is not None:
+                timeout = min(timeout, Config.SBR_CONDITION_INTERVAL)
+            self._wake.wait(timeout)
+            self._wake.clear()
+        return None
+
+    def _timer_broadcast_loop(self):
+        """Stuur sbr_timer met een vaste rate, los van de fase-logica."""
+        period = 1.0 / Config.SBR_TIMER_BROADCAST_HZ
+        next_tick = time.monotonic()
+        while True:
+            if self.start_event.is_set():
+                self._emit_timer()
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Achterstand: ticks overslaan in plaats van inhalen
+                next_tick = time.monotonic()
+                delay = 0
+            self.socketio.sleep(delay)
 
 def start_sbr_controller(socketio: SocketIO):
     global sbr_controller
     sbr_controller = SBRController(socketio)
     th = threading.Thread(target=sbr_controller.run, daemon=True)
     th.start()
+    threading.Thread(target=sbr_controller._timer_broadcast_loop, daemon=True).start()
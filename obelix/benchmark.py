@@ -0,0 +1,395 @@
+# obelix/benchmark.py
+"""
+End-to-end benchmark van acquisitie, besturing, opslag en historie, tegen
+de Dummy- of simulator-backend (geen hardware nodig). Resultaten gaan als
+JSON naar --out, zodat runs vergeleken kunnen worden.
+
+Gebruik:
+    python -m obelix.benchmark generate --out bench_2y.db --years 2 [--interval 10]
+    python -m obelix.benchmark run [--backend simulator] [--duration 30]
+        [--buses 2] [--extra-analog 20] [--history-db bench_2y.db ...] [--out result.json]
+    python -m obelix.benchmark compare oud.json nieuw.json
+
+Gemeten:
+  - scan-cyclus (p50/p95/max) en bezettingsgraad per bus
+  - latency van besturingsschrijfacties (PRIO_CONTROL) tijdens de scan
+  - SBR-transitie-lateness met een recept van korte fases
+  - opslagdoorvoer van de storage worker en van save_sensor_readings
+  - get_sensor_readings, get_sensor_history en plot-rendering per venster,
+    per history-database
+  - piek-RSS na elke sectie
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from obelix.config import Config
+
+HOUR_MS = 3600 * 1000
+
+def _peak_rss_mb():
+    # Linux: ru_maxrss in KiB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+def _summary(values):
+    """p50/p95/max/gemiddelde van een lijst milliseconden."""
+    if not values:
+        return None
+    vals = sorted(values)
+    return {
+        'n':    len(vals),
+        'mean': round(statistics.fmean(vals), 2),
+        'p50':  round(vals[len(vals) // 2], 2),
+        'p95':  round(vals[min(len(vals) - 1, int(len(vals) * 0.95))], 2),
+        'max':  round(vals[-1], 2),
+    }
+
+def _timed(fn, repeat):
+    """Voer fn repeat keer uit; retourneert (laatste resultaat, lijst ms)."""
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return result, times
+
+class _NullSocketIO:
+    """Vervangt Flask-SocketIO: de benchmark heeft geen browsers."""
+    def emit(self, event, data=None, namespace=None, **kwargs):
+        pass
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+# ----- Synthetische history-database -----
+
+def generate(out, years=1.0, interval=10, series=None, chunk=200000):
+    """
+    Vul out met een synthetische tijdreeks per kanaal (dag/seizoen-sinus plus
+    ruis) over `years` jaar met een sample per `interval` seconden, en bouw
+    de rollups. Retourneert het aantal rijen.
+    """
+    import numpy as np
+    from obelix.sensor_database import init_sensor_db, rebuild_rollups, INSERT_READING_SQL
+
+    if series is None:
+        series = [(i, ch) for i, u in enumerate(Config.UNITS) if u['type'] == 'analog'
+                  for ch in range(4)]
+    Config.SENSOR_DB_FILE = out
+    init_sensor_db()
+
+    end_ms = int(time.time() // interval * interval * 1000)
+    start_ms = end_ms - int(years * 365 * 24 * HOUR_MS)
+    step_ms = interval * 1000
+    rng = np.random.default_rng(42)
+
+    # Eigen verbinding zonder journal/fsync: alleen voor het eenmalig vullen
+    conn = sqlite3.connect(out)
+    conn.execute('PRAGMA synchronous=OFF')
+    total = 0
+    t0 = time.perf_counter()
+    for n, (unit, ch) in enumerate(series):
+        for lo in range(start_ms, end_ms, chunk * step_ms):
+            ts = np.arange(lo, min(end_ms, lo + chunk * step_ms), step_ms, dtype=np.int64)
+            t_days = ts / (24 * HOUR_MS)
+            values = (50.0 + 10.0 * np.sin(2 * np.pi * t_days + n)
+                      + 5.0 * np.sin(2 * np.pi * t_days / 365.0)
+                      + rng.normal(0.0, 0.5, ts.size))
+            with conn:
+                conn.executemany(INSERT_READING_SQL, zip(
+                    [unit] * ts.size, [ch] * ts.size, ts.tolist(), values.tolist(),
+                    np.round(values * 40.0).tolist()
+                ))
+            total += ts.size
+        print(f"  {unit}:{ch} klaar ({total} rijen, {time.perf_counter() - t0:.0f}s)", file=sys.stderr)
+    conn.close()
+
+    print("  rollups bouwen...", file=sys.stderr)
+    rebuild_rollups()
+    return total
+
+# ----- Benchmarks -----
+
+def _configure(args, workdir):
+    """Config aanpassen vóór de import van modbus_client (bussen, units)."""
+    Config.DB_FILE = os.path.join(workdir, 'settings.db')
+    Config.SENSOR_DB_FILE = os.path.join(workdir, 'sensor_data.db')
+    Config.MODBUS_BACKEND = args.backend
+    Config.STORAGE_INTERVAL = args.storage_interval
+    if args.seed is not None:
+        Config.SIM_SEED = args.seed
+    units = [dict(u) for u in Config.UNITS]
+    next_id = max(u['slave_id'] for u in units) + 1
+    for k in range(args.extra_analog):
+        units.append({'slave_id': next_id + k, 'name': f'Bench Analog {k + 1}', 'type': 'analog'})
+    if args.buses > 1:
+        Config.BUSES = {
+            f'rs485_{b}': dict(Config.BUSES.get(Config.DEFAULT_BUS, {}), port=f'/dev/ttyUSB{b}')
+            for b in range(args.buses)
+        }
+        Config.DEFAULT_BUS = 'rs485_0'
+        for i, u in enumerate(units):
+            u['bus'] = f'rs485_{i % args.buses}'
+    Config.UNITS = units
+
+def bench_pipeline(args):
+    """Scan + storage worker + SBR-controller + besturingsschrijfacties, parallel."""
+    from obelix.database import init_db
+    from obelix.sensor_database import init_sensor_db
+    from obelix import modbus_client
+    from obelix.sensor_monitor import (
+        start_sensor_monitor, storage_stats, scan_stats, scan_time_hooks
+    )
+    from obelix import auto_control
+    from obelix.sbr_recipe import compile_recipe
+
+    init_db()
+    init_sensor_db()
+    modbus_client.init_modbus()
+
+    # Elke scan-cyclus zelf vastleggen; de scan_stats-emits zijn gesmoord
+    cycles, cycles_lock = [], threading.Lock()
+
+    def record_cycle(elapsed):
+        with cycles_lock:
+            cycles.append(elapsed * 1000.0)
+
+    scan_time_hooks.append(record_cycle)
+    sio = _NullSocketIO()
+    threading.Thread(target=start_sensor_monitor, args=(sio,), daemon=True).start()
+
+    auto_control.start_sbr_controller(sio)
+    ctrl = auto_control.sbr_controller
+    ctrl.set_recipe(compile_recipe('benchmark', {'phases': [
+        {'name': 'influent', 'coils': {'0': True}, 'duration_s': args.phase_seconds},
+        {'name': 'react', 'coils': {'3': True, '4': True}, 'aio': {'0': 70, '1': 70},
+         'duration_s': args.phase_seconds},
+        {'name': 'effluent', 'coils': {'1': True}, 'duration_s': args.phase_seconds},
+    ]}))
+    ctrl.start()
+
+    # Besturingsschrijfacties op een coil buiten de R302-mapping, tussen de scan door
+    write_ms = []
+    write_errors = {}  # exception-type -> aantal; telt niet mee in de latency
+    relay_idx = next(i for i, u in enumerate(Config.UNITS) if u['type'] == 'relay' and i != ctrl.r302_unit)
+    deadline = time.monotonic() + args.duration
+    state = False
+    while time.monotonic() < deadline:
+        state = not state
+        t0 = time.perf_counter()
+        try:
+            modbus_client.write_coils(relay_idx, {7: state}, priority=modbus_client.PRIO_CONTROL)
+            write_ms.append((time.perf_counter() - t0) * 1000.0)
+        except Exception as e:
+            name = type(e).__name__
+            write_errors[name] = write_errors.get(name, 0) + 1
+        time.sleep(args.write_interval)
+    ctrl.stop()
+
+    scan_time_hooks.remove(record_cycle)
+    with cycles_lock:
+        cycles = list(cycles)
+    return {
+        'scan_cycle_ms':   _summary(cycles),
+        'scan_overruns':   scan_stats['overruns'],
+        'bus_cycle_ms':    scan_stats['bus_cycle_ms'],
+        'bus':             modbus_client.get_bus_metrics(),
+        'control_write_ms': _summary(write_ms),
+        'control_write_failures': {
+            'total':   sum(write_errors.values()),
+            'by_type': write_errors,
+        },
+        'sbr_timing':      ctrl.get_timing_stats(),
+        'storage':         dict(storage_stats),
+        'peak_rss_mb':     _peak_rss_mb(),
+    }
+
+def bench_storage(db_file, batches=500, channels=16):
+    """
+    Doorvoer van save_sensor_readings met batches zoals de storage worker ze
+    maakt, in een eigen database zodat de synthetische rijen de
+    history-metingen op de pipeline-database niet beïnvloeden.
+    """
+    from obelix.sensor_database import init_sensor_db, save_sensor_readings
+    pipeline_db, Config.SENSOR_DB_FILE = Config.SENSOR_DB_FILE, db_file
+    try:
+        init_sensor_db()
+        base = datetime.utcnow().timestamp()
+        t0 = time.perf_counter()
+        for b in range(batches):
+            readings = [(90, ch, None, float(b + ch), '') for ch in range(channels)]
+            save_sensor_readings(readings, ts=datetime.utcfromtimestamp(base - b * 10))
+        dt = time.perf_counter() - t0
+    finally:
+        Config.SENSOR_DB_FILE = pipeline_db
+    rows = batches * channels
+    return {
+        'db': db_file,
+        'rows': rows,
+        'seconds': round(dt, 3),
+        'rows_per_sec': round(rows / dt, 1),
+        'batch_ms': round(dt / batches * 1000.0, 3),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def bench_history(db_file, windows_h, repeat, readings_max_h):
+    """Querytijden en plot-rendering per venster op één history-database."""
+    from obelix.db_pool import fetchone
+    from obelix.sensor_database import (
+        get_sensor_readings, get_sensor_history, from_epoch_ms
+    )
+    from obelix.sensor_plot import render_sensor_plot_png
+
+    if not os.path.exists(db_file):
+        return {'db': db_file, 'error': 'bestand bestaat niet'}
+    Config.SENSOR_DB_FILE = db_file
+    unit, ch = fetchone(db_file, 'SELECT unit_index, channel FROM sensor_samples LIMIT 1') or (None, None)
+    if unit is None:
+        return {'db': db_file, 'error': 'lege database'}
+    end_ms = fetchone(db_file, 'SELECT max(ts) FROM sensor_samples WHERE unit_index=? AND channel=?',
+                      (unit, ch))[0]
+    rows = fetchone(db_file, 'SELECT count(*) FROM sensor_samples')[0]
+    result = {
+        'db': db_file,
+        'size_mb': round(os.path.getsize(db_file) / 1e6, 1),
+        'rows': rows,
+        'series': [unit, ch],
+        'windows': [],
+    }
+    for hours in windows_h:
+        start_ms = end_ms - int(hours * HOUR_MS)
+        start, end = from_epoch_ms(start_ms).isoformat(), from_epoch_ms(end_ms).isoformat()
+        entry = {'hours': hours}
+        history, ms = _timed(lambda: get_sensor_history(unit, ch, start_ms, end_ms), repeat)
+        entry['history_ms'] = _summary(ms)
+        entry['resolution'] = history['resolution']
+        entry['points'] = len(history['ts'])
+        if hours <= readings_max_h:
+            readings, ms = _timed(lambda: get_sensor_readings(unit, ch, start, end), repeat)
+            entry['readings_ms'] = _summary(ms)
+            entry['readings_rows'] = len(readings)
+        _, ms = _timed(lambda: render_sensor_plot_png(unit, ch, start=start, end=end), repeat)
+        entry['plot_ms'] = _summary(ms)
+        entry['peak_rss_mb'] = _peak_rss_mb()
+        result['windows'].append(entry)
+        print(f"  {os.path.basename(db_file)} {hours}h: history {entry['history_ms']['p50']} ms, "
+              f"plot {entry['plot_ms']['p50']} ms", file=sys.stderr)
+    return result
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='obelix-bench-')
+    try:
+        return _run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _run(args, workdir):
+    _configure(args, workdir)
+    result = {
+        'meta': {
+            'started':  datetime.utcnow().isoformat(),
+            'python':   platform.python_version(),
+            'machine':  platform.machine(),
+            'backend':  args.backend,
+            'buses':    list(Config.BUSES),
+            'units':    len(Config.UNITS),
+            'duration': args.duration,
+        }
+    }
+    print(f"Pipeline ({args.backend}, {len(Config.UNITS)} units, {args.duration}s)...", file=sys.stderr)
+    result['pipeline'] = bench_pipeline(args)
+    writes = result['pipeline']['control_write_ms'] or {}
+    failures = result['pipeline']['control_write_failures']
+    print(f"  besturing: p50 {writes.get('p50', '—')} ms over {writes.get('n', 0)} geslaagde "
+          f"schrijfacties, {failures['total']} mislukt {failures['by_type'] or ''}", file=sys.stderr)
+    print("Opslag...", file=sys.stderr)
+    result['storage'] = bench_storage(os.path.join(workdir, 'storage_bench.db'))
+    result['history'] = []
+    for db_file in args.history_db or [Config.SENSOR_DB_FILE]:
+        print(f"Historie {db_file}...", file=sys.stderr)
+        result['history'].append(bench_history(db_file, args.windows, args.repeat, args.readings_max_hours))
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+# ----- Vergelijken -----
+
+def _flatten(obj, prefix=''):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from _flatten(v, f'{prefix}{k}.')
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            yield from _flatten(v, f'{prefix}{i}.')
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix[:-1], obj
+
+def compare(old, new):
+    """Print alle numerieke waarden die in beide runs voorkomen, met verschil."""
+    a, b = dict(_flatten(old)), dict(_flatten(new))
+    for key in (k for k in a if k in b and not k.startswith('meta.')):
+        change = f"{(b[key] - a[key]) / a[key] * 100:+.1f}%" if a[key] else ''
+        print(f"{key:60s} {a[key]:>12g} {b[key]:>12g} {change:>8s}")
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmark van de acquisitie- en besturingspipeline')
+    sub = p.add_subparsers(dest='cmd', required=True)
+
+    g = sub.add_parser('generate', help='synthetische sensor_data.db aanmaken')
+    g.add_argument('--out', required=True, help='pad naar de nieuwe database')
+    g.add_argument('--years', type=float, default=1.0)
+    g.add_argument('--interval', type=int, default=Config.STORAGE_INTERVAL, help='seconden tussen samples')
+    g.add_argument('--series', help="bijv. '4:0,4:1' (standaard alle analoge kanalen)")
+
+    r = sub.add_parser('run', help='benchmark uitvoeren')
+    r.add_argument('--backend', choices=['dummy', 'simulator'], default='simulator')
+    r.add_argument('--duration', type=float, default=30, help='seconden pipeline-belasting')
+    r.add_argument('--buses', type=int, default=1, help='units verdelen over zoveel bussen')
+    r.add_argument('--extra-analog', type=int, default=0, help='extra analoge slaves toevoegen')
+    r.add_argument('--storage-interval', type=float, default=2)
+    r.add_argument('--write-interval', type=float, default=0.2, help='s tussen besturingsschrijfacties')
+    r.add_argument('--phase-seconds', type=float, default=2, help='faseduur van het benchmark-recept')
+    r.add_argument('--seed', type=int)
+    r.add_argument('--history-db', action='append', help='history-database (herhaalbaar)')
+    r.add_argument('--windows', type=lambda s: [float(x) for x in s.split(',')],
+                   default=[1, 24, 168, 720, 8760], help='vensters in uren')
+    r.add_argument('--readings-max-hours', type=float, default=168,
+                   help='get_sensor_readings (ruwe dicts) alleen tot dit venster')
+    r.add_argument('--repeat', type=int, default=3)
+    r.add_argument('--out', help='JSON-resultaat (standaard stdout)')
+
+    c = sub.add_parser('compare', help='twee JSON-resultaten vergelijken')
+    c.add_argument('old')
+    c.add_argument('new')
+
+    args = p.parse_args(argv)
+    if args.cmd == 'generate':
+        series = None
+        if args.series:
+            series = [tuple(int(x) for x in s.split(':')) for s in args.series.split(',')]
+        n = generate(args.out, args.years, args.interval, series)
+        print(f"{n} rijen geschreven naar {args.out}")
+    elif args.cmd == 'run':
+        result = run(args)
+        text = json.dumps(result, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text)
+            print(f"Resultaat geschreven naar {args.out}", file=sys.stderr)
+        else:
+            print(text)
+    else:
+        with open(args.old) as f_old, open(args.new) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+
+if __name__ == '__main__':
+    main()
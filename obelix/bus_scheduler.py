@@ -0,0 +1,197 @@
+# obelix/bus_scheduler.py
+"""
+Bus-scheduler: één worker-thread bezit de seriële poort en voert
+bus-transacties uit in volgorde van prioriteit:
+
+  PRIO_CONTROL   veiligheid en automatische besturing (SBR)
+  PRIO_OPERATOR  operatorcommando's vanuit de UI
+  PRIO_POLL      cyclische scan
+
+Binnen één prioriteit geldt FIFO. Verzoeken met dezelfde coalesce-key
+vervangen een nog wachtend verzoek (bijv. vijf aio_set-waarden van een
+slider: alleen de laatste gaat de bus op); het vervangen verzoek eindigt
+met BusRequestSuperseded. Verzoeken met een verlopen
+deadline worden niet meer uitgevoerd.
+
+Per fysieke bus (seriële poort) bestaat één scheduler; transacties op
+verschillende bussen lopen dus parallel. De bezettingsgraad (fractie van
+de tijd dat de bus een transactie uitvoert) laat zien hoe de slaves over
+de poorten verdeeld moeten worden.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from obelix.metrics import bus_queue_wait_seconds, bus_lock_wait_seconds, bus_lock_hold_seconds
+
+PRIO_CONTROL  = 0
+PRIO_OPERATOR = 1
+PRIO_POLL     = 2
+PRIO_NAMES = {PRIO_CONTROL: 'control', PRIO_OPERATOR: 'operator', PRIO_POLL: 'poll'}
+
+class BusDeadlineExceeded(Exception):
+    pass
+
+class BusRequestSuperseded(Exception):
+    """Het verzoek is vervangen door een nieuwer verzoek met dezelfde key."""
+    pass
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'fn', 'key', 'deadline', 'enqueued', 'future', 'superseded')
+
+    def __init__(self, priority, seq, fn, key, deadline):
+        self.priority   = priority
+        self.seq        = seq
+        self.fn         = fn
+        self.key        = key
+        self.deadline   = deadline
+        self.enqueued   = time.monotonic()
+        self.future     = Future()
+        self.superseded = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class BusScheduler:
+    def __init__(self, name, lock, util_window=10.0):
+        self.name    = name
+        self.lock    = lock  # de bus-lock; wordt tijdens elke transactie vastgehouden
+        self.util_window = util_window
+        self._busy   = deque()  # (eindtijd, duur) van transacties binnen het venster
+        self._busy_lock = threading.Lock()
+        self._busy_total = 0.0
+        self._heap   = []
+        self._cond   = threading.Condition()
+        self._seq    = itertools.count()
+        self._pending_keys = {}
+        self._thread = None
+        self.metrics = {
+            'executed':        {p: 0 for p in PRIO_NAMES},
+            'coalesced':       0,
+            'deadline_misses': 0,
+            'errors':          0,
+            'max_depth':       0,
+            'wait_ms_max':     {p: 0.0 for p in PRIO_NAMES},
+            'wait_ms_avg':     {p: 0.0 for p in PRIO_NAMES},
+        }
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'bus-{self.name}', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, priority=PRIO_OPERATOR, key=None, deadline=None):
+        """
+        Zet fn() in de wachtrij. deadline is een time.monotonic()-tijdstip.
+        Retourneert een Future met het resultaat van fn.
+        """
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            req = _Request(priority, next(self._seq), fn, key, deadline)
+            if key is not None:
+                old = self._pending_keys.get(key)
+                if old is not None:
+                    # Oude waarde is achterhaald en gaat de bus niet meer op
+                    old.superseded = True
+                    req.priority = min(req.priority, old.priority)
+                    old.future.set_exception(BusRequestSuperseded(f"vervangen: {key}"))
+                    self.metrics['coalesced'] += 1
+                self._pending_keys[key] = req
+            heapq.heappush(self._heap, req)
+            self.metrics['max_depth'] = max(self.metrics['max_depth'], len(self._heap))
+            self._cond.notify()
+        return req.future
+
+    def call(self, fn, priority=PRIO_OPERATOR, key=None, deadline=None, timeout=None):
+        """Als submit, maar wacht op het resultaat (of de exception)."""
+        return self.submit(fn, priority, key, deadline).result(timeout)
+
+    def depth(self):
+        with self._cond:
+            counts = {PRIO_NAMES[p]: 0 for p in PRIO_NAMES}
+            for req in self._heap:
+                if not req.superseded:
+                    counts[PRIO_NAMES[req.priority]] += 1
+            return counts
+
+    def _record_busy(self, end, duration):
+        with self._busy_lock:
+            self._busy.append((end, duration))
+            self._busy_total += duration
+            self._prune_busy(end)
+
+    def _prune_busy(self, now):
+        horizon = now - self.util_window
+        while self._busy and self._busy[0][0] < horizon:
+            self._busy.popleft()
+
+    def utilization(self):
+        """Fractie van de laatste util_window seconden dat de bus bezet was."""
+        with self._busy_lock:
+            self._prune_busy(time.monotonic())
+            busy = sum(d for _, d in self._busy)
+        return min(1.0, busy / self.util_window)
+
+    def get_metrics(self):
+        m = self.metrics
+        return {
+            'name':            self.name,
+            'utilization':     round(self.utilization(), 3),
+            'busy_s':          round(self._busy_total, 1),
+            'queue_depth':     self.depth(),
+            'max_depth':       m['max_depth'],
+            'executed':        {PRIO_NAMES[p]: n for p, n in m['executed'].items()},
+            'coalesced':       m['coalesced'],
+            'deadline_misses': m['deadline_misses'],
+            'errors':          m['errors'],
+            'wait_ms_avg':     {PRIO_NAMES[p]: round(v, 1) for p, v in m['wait_ms_avg'].items()},
+            'wait_ms_max':     {PRIO_NAMES[p]: round(v, 1) for p, v in m['wait_ms_max'].items()},
+        }
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                req = heapq.heappop(self._heap)
+                if req.superseded:
+                    continue
+                if req.key is not None and self._pending_keys.get(req.key) is req:
+                    del self._pending_keys[req.key]
+                return req
+
+    def _run(self):
+        while True:
+            req = self._next()
+            now = time.monotonic()
+            if req.deadline is not None and now > req.deadline:
+                self.metrics['deadline_misses'] += 1
+                req.future.set_exception(BusDeadlineExceeded(
+                    f"{PRIO_NAMES[req.priority]}-verzoek verlopen na {(now - req.enqueued) * 1000:.0f} ms"))
+                continue
+            wait_ms = (now - req.enqueued) * 1000.0
+            p = req.priority
+            self.metrics['executed'][p] += 1
+            self.metrics['wait_ms_max'][p] = max(self.metrics['wait_ms_max'][p], wait_ms)
+            self.metrics['wait_ms_avg'][p] = self.metrics['wait_ms_avg'][p] * 0.9 + wait_ms * 0.1
+            bus_queue_wait_seconds.observe(wait_ms / 1000.0, self.name, PRIO_NAMES[p])
+            try:
+                with self.lock:
+                    t0 = time.monotonic()
+                    bus_lock_wait_seconds.observe(t0 - now, self.name)
+                    try:
+                        result = req.fn()
+                    finally:
+                        t1 = time.monotonic()
+                        self._record_busy(t1, t1 - t0)
+                        bus_lock_hold_seconds.observe(t1 - t0, self.name)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                req.future.set_exception(e)
+            else:
+                req.future.set_result(result)
@@ -8,17 +8,124 @@ class Config:
     STOPBITS   = 1
     BYTESIZE   = 8
     TIMEOUT    = 1
+    PROBE_TIMEOUT = 0.2  # korte timeout voor probes van slaves in backoff
+
+    # RS-485-bussen: naam -> seriële poort, eventueel met eigen baudrate,
+    # parity, stopbits, bytesize of timeout (anders gelden de waarden
+    # hierboven). Elke bus krijgt een eigen lock en worker-thread; units
+    # kiezen hun bus met de key 'bus' (zonder 'bus' geldt DEFAULT_BUS).
+    DEFAULT_BUS = 'rs485'
+    BUSES = {
+        'rs485': {'port': RS485_PORT},
+        # 'rs485b': {'port': '/dev/ttyUSB1'},
+    }
+    BUS_UTIL_WINDOW = 10  # seconden, venster voor de bezettingsgraad per bus
+
+    # Latency-histogrammen en counters voor /metrics en /status
+    # (gauges worden bij het uitlezen berekend en blijven altijd beschikbaar)
+    METRICS_ENABLED = True
+
+    # Modbus-backend: 'serial' (echte bus; zonder poort terugval naar Dummy),
+    # 'simulator' (plantmodel met realistische bus-timing, zie
+    # obelix/simulator.py) of 'dummy'
+    MODBUS_BACKEND = 'serial'
+
+    # Simulator
+    SIM_SEED       = None   # int voor reproduceerbare fouten/ruis
+    SIM_TURNAROUND = 0.005  # s tussen request en antwoord van een slave
+    SIM_NOISE      = 2.0    # standaarddeviatie ruis op analoge ingangen (ruwe counts)
+    SIM_DEFAULT_SLAVE = {
+        'timeout_rate':     0.0,  # kans dat een slave niet antwoordt
+        'error_rate':       0.0,  # kans op een CRC-fout in het antwoord
+        'dropout_every':    0,    # s; elke zoveel seconden valt de slave uit...
+        'dropout_duration': 0,    # ...gedurende zoveel seconden
+        'unsupported':      (),   # functiecodes die de slave weigert, bijv. (15,)
+    }
+    SIM_SLAVES = {
+        # slave_id: afwijkingen van SIM_DEFAULT_SLAVE, bijv.
+        # 3: {'timeout_rate': 0.05},
+        # 9: {'dropout_every': 120, 'dropout_duration': 20},
+    }
+    SIM_REACTOR = {
+        'relay_slave':   1,    # R302-relaymodule
+        'sensor_slave':  5,    # R302-sensoren, kanalen als R302_SENSOR_MAPPING
+        'aio_slave':     10,   # compressortoerental
+        'influent_coil': 0,
+        'effluent_coil': 1,
+        'compressors':   ((3, 0), (4, 1)),  # (aan/uit-coil, AIO-kanaal)
+        'inflow':        0.5,  # %/s niveaustijging met influentpomp aan
+        'outflow':       0.8,  # %/s niveaudaling met effluentpomp aan
+        'level_init':    40.0, # %
+        'do_init':       2.0,  # mg/L
+        'do_sat':        9.0,  # mg/L
+        'kla':           0.01, # 1/s per compressor op vol toerental
+        'our':           0.005,  # mg/L/s zuurstofverbruik
+        'sensor_ranges': ((0.0, 100.0), (0.0, 14.0), (0.0, 50.0), (0.0, 20.0)),
+    }
+
+    # Bus-scheduler deadlines (s): verlopen verzoeken gaan de bus niet meer op
+    BUS_POLL_DEADLINE  = 1    # scan-reads ouder dan één poll-interval zijn zinloos
+    BUS_WRITE_DEADLINE = 5    # operatorcommando's
+
+    # Slave health / backoff
+    HEALTH_FAIL_THRESHOLD = 3    # opeenvolgende fouten voordat backoff start
+    HEALTH_BACKOFF_MIN    = 2    # seconden
+    HEALTH_BACKOFF_MAX    = 60   # seconden
 
     # Database files
     DB_FILE         = 'settings.db'      # hoofd-database voor settings/calibratie/relay_states
     SENSOR_DB_FILE  = 'sensor_data.db'   # losse database voor historische sensordata
     TEMPLATES_AUTO_RELOAD = True
 
+    # SQLite-verbindingslaag
+    DB_BUSY_TIMEOUT    = 5.0       # seconden wachten op een lock
+    DB_SYNCHRONOUS     = 'NORMAL'  # in WAL-modus veilig bij crash, minder fsyncs
+    DB_STATEMENT_CACHE = 128       # prepared statements per verbinding
+    DB_POOL_SIZE       = 8         # vrije verbindingen per bestand voor request-threads
+    RELAY_STATE_FLUSH_INTERVAL = 0.5  # max. vertraging (s) voor relay-states op schijf
+
     # Polling intervals (in seconden)
     LIVE_POLL_INTERVAL  = 1    # frequentie live-update
     STORAGE_INTERVAL    = 10   # interval gemiddeld opslaan
+    SCAN_STATS_INTERVAL = 5    # s; scan_stats naar de diagnostiek-room (direct bij een overschrijding)
+    STORAGE_RETRY_MAX   = 360  # mislukte batches die bewaard blijven voor een nieuwe poging
+
+    # SBR-planner: fases lopen op monotone deadlines, de timer-broadcast apart
+    SBR_TIMER_BROADCAST_HZ = 1.0  # sbr_timer-updates per seconde naar de UI
+    SBR_LATENESS_WINDOW    = 200  # laatste N transities voor jitter-statistiek
+    SBR_CONDITION_INTERVAL = 1.0  # s tussen controles van until-condities in een recept
+    SBR_CHECKPOINT_INTERVAL = 30  # s tussen checkpoints binnen een fase (plus bij elke transitie)
+    SBR_RESUME_COUNT_DOWNTIME = True  # uit-tijd na herstart meetellen (relays houden hun stand vast)
+
+    # Procesbeeld: tags die langer dan dit (s) niet ververst zijn gelden als STALE
+    TAG_STALE_AFTER = 5
+
+    # Live-updates: alleen versturen als de waarde meer dan de deadband verschuift
+    SENSOR_DEFAULT_DEADBAND = 0.01
+    SENSOR_DEADBANDS = {
+        # (unit_index, channel): deadband in gecalibreerde eenheden
+    }
+
+    # Historie: minimaal aantal punten waarvoor een rollup nog grof genoeg is
+    HISTORY_TARGET_POINTS = 800
+    PLOT_MAX_POINTS       = 1000  # standaard max. punten na LTTB-downsampling
+    PLOT_CACHE_SIZE       = 32    # aantal gerenderde PNG's in de LRU-cache
+    API_CHUNK_POINTS      = 10000 # punten per gestreamd chunk in /api/sensor_history
+    EXPORT_BATCH_ROWS     = 20000 # rijen per batch bij export
+
+    # Retentie per resolutie in dagen (None = voor altijd bewaren)
+    RETENTION_DAYS = {
+        'raw': 14,
+        '1m':  365,
+        '1h':  None,
+        '1d':  None,
+    }
+    RETENTION_INTERVAL    = 3600  # seconden tussen retentie-runs
+    RETENTION_BATCH       = 5000  # rijen per delete-transactie
+    RETENTION_BATCH_PAUSE = 0.05  # seconden pauze tussen batches
+    RETENTION_VACUUM_PAGES = 1000 # pagina's per incremental_vacuum-stap
 
-    # Units definition
+    # Units definition ('bus' optioneel, zie BUSES)
     UNITS = [
         {'slave_id': 1,  'name': 'Relay Module 1',    'type': 'relay'},
         {'slave_id': 2,  'name': 'Relay Module 2',    'type': 'relay'},
@@ -34,7 +141,10 @@ class Config:
     AIO_IDX = next(i for i, u in enumerate(UNITS) if u['type'] == 'aio')
 
     # Logging
-    MAX_LOG = 20
+    MAX_LOG         = 500     # regels in de ringbuffer (/logs)
+    LOG_LEVEL       = 'INFO'  # DEBUG, INFO, WARNING of ERROR
+    LOG_RATE_WINDOW = 60      # s; herhaalde waarschuwingen/fouten maar één keer per venster
+    LOG_QUEUE_SIZE  = 10000   # max. regels die op de console-writer wachten
 
     # Default modes
     DEFAULT_PUMP_MODE       = 'AUTO'
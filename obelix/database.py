@@ -1,8 +1,29 @@
-import sqlite3
+import atexit
+import time
+from threading import Lock, Event, Thread
+from types import MappingProxyType
 from obelix.config import Config
+from obelix.utils import log
+from obelix.metrics import registry
+from obelix.db_pool import get_connection, fetchone, fetchall, execute, executemany
+
+# Procesbrede calibratie-cache: (unit_index, channel) -> read-only calibratie-mapping
+_cal_cache = {}
+_cal_cache_lock = Lock()
+cal_cache_stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+# Write-behind relay-states: het geheugen is leidend, de tabel relay_states
+# wordt binnen Config.RELAY_STATE_FLUSH_INTERVAL in één transactie bijgewerkt
+_relay_states = {}  # (unit_index, coil_index) -> 'ON'/'OFF'
+_relay_dirty = {}
+_relay_lock = Lock()
+_relay_flush_event = Event()
+_relay_writer = None
+
+DEFAULT_CALIBRATION = {'scale': 1.0, 'offset': 0.0, 'phys_min': 0.0, 'phys_max': 0.0, 'unit': ''}
 
 def init_db():
-    conn = sqlite3.connect(Config.DB_FILE)
+    conn = get_connection(Config.DB_FILE)
     c = conn.cursor()
     # Bestaand calibration‐schema
     c.execute('''
@@ -42,6 +63,12 @@ def init_db():
             PRIMARY KEY(unit_index, coil_index)
         )
     ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sbr_recipes (
+            name TEXT PRIMARY KEY,
+            definition TEXT NOT NULL
+        )
+    ''')
 
     # Initiele relay_states vullen
     for i, unit in enumerate(Config.UNITS):
@@ -53,36 +80,26 @@ def init_db():
                 ''', (i, coil, 'OFF'))
 
     conn.commit()
-    conn.close()
+    load_calibration_cache()
+    load_relay_states()
+    start_relay_state_writer()
 
 def get_setting(key, default=None):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT value FROM settings WHERE key=?', (key,))
-    row = c.fetchone()
-    conn.close()
+    row = fetchone(Config.DB_FILE, 'SELECT value FROM settings WHERE key=?', (key,))
     return row[0] if row else default
 
 def set_setting(key, value):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+    execute(Config.DB_FILE, '''
         INSERT INTO settings(key, value) VALUES (?, ?)
         ON CONFLICT(key) DO UPDATE SET value=excluded.value
     ''', (key, str(value)))
-    conn.commit()
-    conn.close()
 
-def get_calibration(unit_index, channel):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+def _read_calibration(unit_index, channel):
+    row = fetchone(Config.DB_FILE, '''
         SELECT scale, offset, phys_min, phys_max, unit
         FROM calibration
         WHERE unit_index=? AND channel=?
     ''', (unit_index, channel))
-    row = c.fetchone()
-    conn.close()
     if row:
         return {
             'scale':    row[0],
@@ -92,12 +109,43 @@ def get_calibration(unit_index, channel):
             'unit':     row[4] or ''
         }
     # Standaardwaarden als nog niet gekalibreerd
-    return {'scale': 1.0, 'offset': 0.0, 'phys_min': 0.0, 'phys_max': 0.0, 'unit': ''}
+    return dict(DEFAULT_CALIBRATION)
+
+def load_calibration_cache():
+    """(Her)laad de calibratie-cache volledig uit de database."""
+    payload = get_all_calibrations()
+    with _cal_cache_lock:
+        _cal_cache.clear()
+        for key, cal in payload.items():
+            u, ch = (int(x) for x in key.split('-'))
+            _cal_cache[(u, ch)] = MappingProxyType(cal)
+        cal_cache_stats['reloads'] += 1
+
+def get_calibration(unit_index, channel):
+    """
+    Calibratie uit de in-memory cache; alleen bij een miss wordt de
+    database gelezen (en het resultaat, ook de standaardwaarden, bewaard).
+    Retourneert een read-only mapping die door alle threads gedeeld wordt;
+    gebruik dict(cal) voor een bewerkbare kopie.
+    """
+    cal = _cal_cache.get((unit_index, channel))
+    if cal is not None:
+        cal_cache_stats['hits'] += 1
+        return cal
+    cal_cache_stats['misses'] += 1
+    cal = MappingProxyType(_read_calibration(unit_index, channel))
+    with _cal_cache_lock:
+        _cal_cache[(unit_index, channel)] = cal
+    return cal
+
+def get_calibration_cache_stats():
+    return dict(cal_cache_stats, entries=len(_cal_cache))
+
+registry.gauge('obelix_cal_cache', 'Calibratie-cache (hits, misses, reloads, entries)',
+               ('stat',), lambda: [((k,), v) for k, v in get_calibration_cache_stats().items()])
 
 def save_calibration(unit_index, channel, scale, offset, phys_min, phys_max, unit):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+    execute(Config.DB_FILE, '''
         INSERT INTO calibration(unit_index, channel, scale, offset, phys_min, phys_max, unit)
         VALUES(?,?,?,?,?,?,?)
         ON CONFLICT(unit_index, channel) DO UPDATE SET
@@ -107,18 +155,23 @@ def save_calibration(unit_index, channel, scale, offset, phys_min, phys_max, uni
             phys_max=excluded.phys_max,
             unit=excluded.unit
     ''', (unit_index, channel, scale, offset, phys_min, phys_max, unit))
-    conn.commit()
-    conn.close()
+    # Cache direct bijwerken zodat de volgende sample de nieuwe waarden gebruikt
+    with _cal_cache_lock:
+        _cal_cache[(unit_index, channel)] = MappingProxyType({
+            'scale':    scale,
+            'offset':   offset,
+            'phys_min': phys_min,
+            'phys_max': phys_max,
+            'unit':     unit or ''
+        })
 
 def get_all_calibrations():
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+    rows = fetchall(Config.DB_FILE, '''
         SELECT unit_index, channel, scale, offset, phys_min, phys_max, unit
         FROM calibration
     ''')
     payload = {}
-    for u, ch, sc, off, pmin, pmax, unit in c.fetchall():
+    for u, ch, sc, off, pmin, pmax, unit in rows:
         payload[f"{u}-{ch}"] = {
             'scale':    sc,
             'offset':   off,
@@ -126,43 +179,86 @@ def get_all_calibrations():
             'phys_max': pmax,
             'unit':     unit or ''
         }
-    conn.close()
     return payload
 
 def save_aio_setting(channel, percent):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+    execute(Config.DB_FILE, '''
         INSERT INTO aio_settings(channel, percent) VALUES (?, ?)
         ON CONFLICT(channel) DO UPDATE SET percent=excluded.percent
     ''', (channel, percent))
-    conn.commit()
-    conn.close()
 
 def get_aio_setting(channel):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT percent FROM aio_settings WHERE channel=?', (channel,))
-    row = c.fetchone()
-    conn.close()
+    row = fetchone(Config.DB_FILE, 'SELECT percent FROM aio_settings WHERE channel=?', (channel,))
+    return row[0] if row else None
+
+def get_sbr_recipe(name):
+    """JSON-definitie van een SBR-recept, of None."""
+    row = fetchone(Config.DB_FILE, 'SELECT definition FROM sbr_recipes WHERE name=?', (name,))
     return row[0] if row else None
 
+def save_sbr_recipe(name, definition):
+    execute(Config.DB_FILE, '''
+        INSERT INTO sbr_recipes(name, definition) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET definition=excluded.definition
+    ''', (name, definition))
+
+def get_sbr_recipe_names():
+    return [r[0] for r in fetchall(Config.DB_FILE, 'SELECT name FROM sbr_recipes ORDER BY name')]
+
+def load_relay_states():
+    """Laad de laatst bekende relay-states uit de database in het geheugen."""
+    rows = fetchall(Config.DB_FILE, 'SELECT unit_index, coil_index, state FROM relay_states')
+    with _relay_lock:
+        _relay_states.clear()
+        _relay_dirty.clear()
+        for u, coil, state in rows:
+            _relay_states[(u, coil)] = state
+
+def flush_relay_states():
+    """Schrijf alle gewijzigde relay-states in één transactie weg."""
+    with _relay_lock:
+        if not _relay_dirty:
+            return 0
+        rows = [(u, coil, state) for (u, coil), state in _relay_dirty.items()]
+        _relay_dirty.clear()
+    try:
+        executemany(Config.DB_FILE, '''
+            INSERT INTO relay_states(unit_index, coil_index, state) VALUES (?, ?, ?)
+            ON CONFLICT(unit_index, coil_index) DO UPDATE SET state=excluded.state
+        ''', rows)
+    except Exception:
+        # Niet verliezen: terugzetten tenzij er intussen een nieuwere waarde is
+        with _relay_lock:
+            for u, coil, state in rows:
+                _relay_dirty.setdefault((u, coil), state)
+        _relay_flush_event.set()
+        raise
+    return len(rows)
+
+def _relay_writer_loop():
+    while True:
+        _relay_flush_event.wait()
+        # Wijzigingen binnen het venster bundelen tot één transactie
+        time.sleep(Config.RELAY_STATE_FLUSH_INTERVAL)
+        _relay_flush_event.clear()
+        try:
+            flush_relay_states()
+        except Exception as e:
+            log(f"⚠ Relay-states wegschrijven mislukt: {e}")
+
+def start_relay_state_writer():
+    global _relay_writer
+    if _relay_writer is not None:
+        return
+    _relay_writer = Thread(target=_relay_writer_loop, daemon=True)
+    _relay_writer.start()
+    atexit.register(flush_relay_states)
+
 def save_relay_state(unit_index, coil_index, state):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO relay_states(unit_index, coil_index, state) VALUES (?, ?, ?)
-        ON CONFLICT(unit_index, coil_index) DO UPDATE SET state=excluded.state
-    ''', (unit_index, coil_index, state))
-    conn.commit()
-    conn.close()
+    with _relay_lock:
+        _relay_states[(unit_index, coil_index)] = state
+        _relay_dirty[(unit_index, coil_index)] = state
+    _relay_flush_event.set()
 
 def get_relay_state(unit_index, coil_index):
-    conn = sqlite3.connect(Config.DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT state FROM relay_states WHERE unit_index=? AND coil_index=?
-    ''', (unit_index, coil_index))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+    return _relay_states.get((unit_index, coil_index))
@@ -0,0 +1,127 @@
+# obelix/db_pool.py
+"""
+Gedeelde SQLite-verbindingslaag, in WAL-modus met busy-timeout en
+statement-cache.
+
+Elke thread leent per databasebestand één verbinding. Langlevende threads
+(scan, SBR, opslag) houden die vast; kortlevende request- en
+Socket.IO-threads geven hem aan het eind van de app-context terug
+(release_connections via teardown_appcontext), zodat de volgende request
+een al geopende verbinding met warme statement-cache hergebruikt.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from obelix.config import Config
+from obelix.metrics import db_query_seconds, db_transaction_seconds, db_commit_seconds
+
+_local = threading.local()
+
+_idle      = {}  # path -> [vrije verbindingen]
+_idle_lock = threading.Lock()
+_prepared  = set()  # bestanden waarvan de persistente PRAGMA's al gezet zijn
+
+def _open(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=Config.DB_BUSY_TIMEOUT,  # zet ook de busy-timeout
+        cached_statements=Config.DB_STATEMENT_CACHE,
+        # Een verbinding kan via de pool naar een andere thread gaan, maar
+        # wordt nooit door twee threads tegelijk gebruikt
+        check_same_thread=False
+    )
+    if path not in _prepared:
+        # Blijven in het bestand bewaard: één keer per proces volstaat.
+        # auto_vacuum werkt alleen als het vóór de eerste tabel is gezet;
+        # voor bestaande bestanden is het een no-op (zie retention/migratie: VACUUM)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        _prepared.add(path)
+    conn.execute(f'PRAGMA synchronous={Config.DB_SYNCHRONOUS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def get_connection(path):
+    """
+    Verbinding voor de huidige thread, uit de pool of nieuw geopend. Omdat
+    SQL-strings constant zijn, hergebruikt sqlite3 de prepared statements
+    uit zijn cache.
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        with _idle_lock:
+            idle = _idle.get(path)
+            conn = idle.pop() if idle else None
+        conns[path] = conn = conn or _open(path)
+    return conn
+
+def release_connections(exc=None):
+    """
+    Geef de verbindingen van de huidige thread terug aan de pool (of sluit
+    ze als de pool vol is). Voor teardown_appcontext.
+    """
+    conns = getattr(_local, 'conns', None)
+    if not conns:
+        return
+    _local.conns = {}
+    for path, conn in conns.items():
+        if conn.in_transaction:
+            conn.rollback()
+        with _idle_lock:
+            idle = _idle.setdefault(path, [])
+            if len(idle) < Config.DB_POOL_SIZE:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+def close_connection(path):
+    """Sluit de verbinding van de huidige thread (bijv. bij thread-einde)."""
+    conns = getattr(_local, 'conns', {})
+    conn = conns.pop(path, None)
+    if conn is not None:
+        conn.close()
+
+@contextmanager
+def transaction(path):
+    """Commit bij succes, rollback bij een exception."""
+    conn = get_connection(path)
+    db = os.path.basename(path)
+    t0 = time.perf_counter()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    t1 = time.perf_counter()
+    conn.commit()
+    t2 = time.perf_counter()
+    db_commit_seconds.observe(t2 - t1, db)
+    db_transaction_seconds.observe(t2 - t0, db)
+
+def _query(path, sql, params, op):
+    t0 = time.perf_counter()
+    cur = get_connection(path).execute(sql, params)
+    rows = cur.fetchone() if op == 'fetchone' else cur.fetchall()
+    db_query_seconds.observe(time.perf_counter() - t0, os.path.basename(path), op)
+    return rows
+
+def fetchone(path, sql, params=()):
+    return _query(path, sql, params, 'fetchone')
+
+def fetchall(path, sql, params=()):
+    return _query(path, sql, params, 'fetchall')
+
+def execute(path, sql, params=()):
+    with transaction(path) as conn:
+        conn.execute(sql, params)
+
+def executemany(path, sql, rows):
+    with transaction(path) as conn:
+        conn.executemany(sql, rows)
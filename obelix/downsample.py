@@ -0,0 +1,85 @@
+# obelix/downsample.py
+"""
+Largest-Triangle-Three-Buckets (LTTB) downsampling met NumPy. Houdt de
+vorm van de lijn vast met een vast aantal punten, en levert per bucket
+een min/max-omhullende zodat pieken (alarmen) zichtbaar blijven.
+"""
+
+import numpy as np
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices van de punten die LTTB kiest. Eerste en laatste punt blijven
+    altijd behouden. x en y zijn 1-D arrays van gelijke lengte.
+
+    Volledig gevectoriseerd: als ankerpunt van een bucket dient het
+    gemiddelde van de vorige bucket in plaats van het daar gekozen punt,
+    zodat alle buckets onafhankelijk zijn en in één matrixbewerking
+    (buckets x max. bucketgrootte) berekend worden. Het verschil met de
+    sequentiële variant is visueel verwaarloosbaar.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # n_out - 2 buckets tussen het eerste en laatste punt
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # Anker: het eerste punt, daarna het gemiddelde van de vorige bucket
+    prev_x = np.concatenate(([x[0]], avg_x[:-1]))
+    prev_y = np.concatenate(([y[0]], avg_y[:-1]))
+    # Het "volgende" gemiddelde van de laatste bucket is het laatste punt
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    # Kandidaten per bucket als rij; kortere buckets worden gemaskeerd
+    offsets = np.arange(counts.max())
+    cand = edges[:-1, None] + offsets[None, :]
+    valid = offsets[None, :] < counts[:, None]
+    cand = np.where(valid, cand, edges[:-1, None])
+    area = np.abs((prev_x - next_x)[:, None] * (y[cand] - prev_y[:, None]) -
+                  (prev_x[:, None] - x[cand]) * (next_y - prev_y)[:, None])
+    area[~valid] = -1.0
+    chosen = cand[np.arange(len(cand)), np.argmax(area, axis=1)]
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[1:-1] = chosen
+    out[-1] = n - 1
+    return out
+
+def downsample_history(data, max_points):
+    """
+    Downsample een kolom-dict uit get_sensor_history tot max. max_points
+    punten. 'value' volgt LTTB (plus globale min/max-punten); 'min' en
+    'max' worden de omhullende van alle onderliggende punten per bucket.
+    """
+    ts = np.asarray(data['ts'], dtype=np.int64)
+    if max_points is None or len(ts) <= max_points or max_points < 3:
+        return data
+
+    values = np.asarray(data['value'], dtype=np.float64)
+    mins = np.asarray(data['min'], dtype=np.float64)
+    maxs = np.asarray(data['max'], dtype=np.float64)
+
+    idx = lttb_indices(ts, values, max_points)
+    # Absolute extremen altijd in de lijn houden
+    idx = np.union1d(idx, [int(np.argmin(values)), int(np.argmax(values))])
+
+    # Omhullende: elke gekozen index vertegenwoordigt de punten tot de volgende
+    env_min = np.minimum.reduceat(mins, idx)
+    env_max = np.maximum.reduceat(maxs, idx)
+
+    return dict(
+        data,
+        ts=ts[idx].tolist(),
+        value=values[idx].tolist(),
+        min=env_min.tolist(),
+        max=env_max.tolist(),
+        downsampled_from=len(ts),
+    )
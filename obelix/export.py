@@ -0,0 +1,213 @@
+# obelix/export.py
+"""
+Streaming export van sensorhistorie als CSV of kolomformaat (Arrow IPC,
+Parquet) met constant geheugengebruik, ongeacht de omvang van het bereik.
+
+Rijen worden met keyset-paginatie gelezen (ts > laatste ts, LIMIT batch):
+elke batch is een korte leestransactie, zodat de storage worker en WAL-
+checkpoints nooit op een lopende export hoeven te wachten.
+
+Web:  /export/sensor?series=4:0,4:1&start=...&end=...&format=csv|arrow
+CLI:  python -m obelix.export --series 4:0 --format parquet --out r302.parquet
+"""
+
+import argparse
+import csv
+import io
+import sys
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from obelix.config import Config
+from obelix.database import get_calibration
+from obelix.db_pool import get_connection
+from obelix.history_api import parse_series, parse_window
+from obelix.sensor_database import from_epoch_ms, to_epoch_ms
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optioneel; alleen CSV beschikbaar
+    pa = None
+
+export_bp = Blueprint('export', __name__)
+
+COLUMNS = ['timestamp', 'unit_index', 'channel', 'name', 'value', 'raw', 'unit']
+
+def iter_batches(series, start_ms=None, end_ms=None, batch=None):
+    """
+    Genereer batches rijen (ts_ms, unit_index, channel, value, raw) per serie,
+    oplopend op tijd. Geheugen blijft begrensd tot één batch.
+    """
+    batch = batch or Config.EXPORT_BATCH_ROWS
+    conn = get_connection(Config.SENSOR_DB_FILE)
+    lo = start_ms if start_ms is not None else -1
+    hi = end_ms if end_ms is not None else 2**62
+    for unit_index, channel in series:
+        last = lo - 1
+        while True:
+            rows = conn.execute('''
+                SELECT ts, unit_index, channel, value, raw FROM sensor_samples
+                WHERE unit_index = ? AND channel = ? AND ts > ? AND ts <= ?
+                ORDER BY ts ASC LIMIT ?
+            ''', (unit_index, channel, last, hi, batch)).fetchall()
+            if not rows:
+                break
+            yield rows
+            last = rows[-1][0]
+            if len(rows) < batch:
+                break
+
+def _labels(series):
+    """Naam en gecalibreerde eenheid per (unit_index, channel)."""
+    out = {}
+    for u, ch in series:
+        name = Config.UNITS[u]['name'] if u < len(Config.UNITS) else f'unit {u}'
+        out[(u, ch)] = (name, get_calibration(u, ch).get('unit', ''))
+    return out
+
+def iter_csv(series, start_ms=None, end_ms=None):
+    labels = _labels(series)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for rows in iter_batches(series, start_ms, end_ms):
+        for ts, u, ch, value, raw in rows:
+            name, unit = labels[(u, ch)]
+            writer.writerow([from_epoch_ms(ts).isoformat(), u, ch, name, value, raw, unit])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    tail = buf.getvalue()
+    if tail:
+        yield tail
+
+def _arrow_schema():
+    return pa.schema([
+        ('timestamp',  pa.timestamp('ms', tz='UTC')),
+        ('unit_index', pa.int16()),
+        ('channel',    pa.int16()),
+        ('name',       pa.dictionary(pa.int8(), pa.string())),
+        ('value',      pa.float64()),
+        ('raw',        pa.float64()),
+        ('unit',       pa.dictionary(pa.int8(), pa.string())),
+    ])
+
+def _arrow_batches(series, start_ms=None, end_ms=None):
+    if pa is None:
+        raise RuntimeError("pyarrow is niet geïnstalleerd; alleen CSV-export beschikbaar")
+    labels = _labels(series)
+    schema = _arrow_schema()
+    for rows in iter_batches(series, start_ms, end_ms):
+        ts, us, chs, vals, raws = zip(*rows)
+        name, unit = labels[(us[0], chs[0])]  # een batch bevat één serie
+        yield pa.record_batch([
+            pa.array(ts, pa.int64()).cast(pa.timestamp('ms', tz='UTC')),
+            pa.array(us, pa.int16()),
+            pa.array(chs, pa.int16()),
+            pa.array([name] * len(rows)).dictionary_encode().cast(schema.field('name').type),
+            pa.array(vals, pa.float64()),
+            pa.array(raws, pa.float64()),
+            pa.array([unit] * len(rows)).dictionary_encode().cast(schema.field('unit').type),
+        ], schema=schema)
+
+class _ChunkSink(io.RawIOBase):
+    """Schrijfbaar bestand dat geschreven bytes verzamelt tot ze worden opgehaald."""
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+    def writable(self):
+        return True
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+    def tell(self):
+        return self._pos
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_arrow(series, start_ms=None, end_ms=None):
+    """Arrow IPC stream-formaat: per batch direct doorsturen."""
+    if pa is None:
+        raise RuntimeError("pyarrow is niet geïnstalleerd; alleen CSV-export beschikbaar")
+    sink = _ChunkSink()
+    with pa_ipc.new_stream(sink, _arrow_schema()) as writer:
+        for rb in _arrow_batches(series, start_ms, end_ms):
+            writer.write_batch(rb)
+            yield sink.take()
+    yield sink.take()
+
+def write_parquet(path, series, start_ms=None, end_ms=None):
+    """Schrijf een Parquet-bestand, één row group per batch."""
+    if pa is None:
+        raise RuntimeError("pyarrow is niet geïnstalleerd; Parquet-export niet beschikbaar")
+    n = 0
+    with pq.ParquetWriter(path, _arrow_schema(), compression='zstd') as writer:
+        for rb in _arrow_batches(series, start_ms, end_ms):
+            writer.write_batch(rb)
+            n += rb.num_rows
+    return n
+
+FORMATS = {
+    'csv':   (iter_csv,   'text/csv',                             'csv'),
+    'arrow': (iter_arrow, 'application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+@export_bp.route('/export/sensor')
+def export_sensor():
+    try:
+        series = parse_series(request.args.get('series'))
+        start_ms, end_ms = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Onbekend formaat: {fmt}'}), 400
+    if fmt != 'csv' and pa is None:
+        return jsonify({'error': 'pyarrow is niet geïnstalleerd; gebruik format=csv'}), 501
+    gen, mimetype, ext = FORMATS[fmt]
+    stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    return Response(
+        stream_with_context(gen(series, start_ms, end_ms)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=sensor_export_{stamp}.{ext}'}
+    )
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Exporteer sensorhistorie als CSV, Arrow of Parquet')
+    p.add_argument('--db', default=Config.SENSOR_DB_FILE, help='pad naar sensor_data.db')
+    p.add_argument('--series', required=True, help="bijv. '4:0,4:1' (unit_index:channel)")
+    p.add_argument('--start', help='ISO-starttijd (UTC)')
+    p.add_argument('--end', help='ISO-eindtijd (UTC)')
+    p.add_argument('--format', choices=['csv', 'arrow', 'parquet'], default='csv')
+    p.add_argument('--out', help='uitvoerbestand (standaard stdout, niet voor parquet)')
+    args = p.parse_args(argv)
+
+    Config.SENSOR_DB_FILE = args.db
+    series = parse_series(args.series)
+    start_ms = to_epoch_ms(args.start) if args.start else None
+    end_ms = to_epoch_ms(args.end) if args.end else None
+
+    if args.format == 'parquet':
+        if not args.out:
+            p.error('--out is verplicht voor parquet')
+        n = write_parquet(args.out, series, start_ms, end_ms)
+        print(f"{n} rijen geschreven naar {args.out}", file=sys.stderr)
+        return
+    gen = FORMATS[args.format][0](series, start_ms, end_ms)
+    if args.format == 'csv':
+        out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    else:
+        out = open(args.out, 'wb') if args.out else sys.stdout.buffer
+    try:
+        for chunk in gen:
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# obelix/history_api.py
+"""
+/api/sensor_history: kolomgewijze historie voor client-side grafieken.
+
+Query-parameters:
+  series      verplicht, komma-gescheiden 'unit_index:channel' paren, bijv. 4:0,4:1
+  start, end  optioneel ISO (UTC), of last_hours (int)
+  max_points  optioneel, LTTB-downsampling per serie
+  minmax      1 = ook min/max per bucket meesturen
+  format      'json' (standaard) of 'bin'
+
+Binair formaat (little-endian), gestreamd per serie:
+  b'OBX1'
+  per serie: uint32 header_len, header (UTF-8 JSON met unit_index, channel,
+             unit, resolution, n, fields), gevolgd door int64[n] ts (ms) en
+             float32[n] per overig veld in de volgorde van 'fields'.
+"""
+
+import json
+import struct
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import numpy as np
+from obelix.config import Config
+from obelix.database import get_calibration
+from obelix.downsample import downsample_history
+from obelix.sensor_database import get_sensor_history, to_epoch_ms
+
+api_bp = Blueprint('history_api', __name__)
+
+BIN_MAGIC = b'OBX1'
+
+def parse_series(spec):
+    """'4:0,4:1' -> [(4, 0), (4, 1)]"""
+    out = []
+    for part in (spec or '').split(','):
+        if not part.strip():
+            continue
+        u, ch = part.split(':')
+        out.append((int(u), int(ch)))
+    if not out:
+        raise ValueError("Parameter 'series' (unit_index:channel,...) is verplicht")
+    return out
+
+def parse_window(args):
+    """(start_ms, end_ms) uit start/end of last_hours; None = open grens."""
+    last_hours = args.get('last_hours', type=float)
+    if last_hours:
+        now = datetime.utcnow()
+        return to_epoch_ms(now - timedelta(hours=last_hours)), to_epoch_ms(now)
+    start, end = args.get('start'), args.get('end')
+    return (to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None)
+
+def _load(series, start_ms, end_ms, max_points):
+    for unit_index, channel in series:
+        data = get_sensor_history(unit_index, channel, start_ms, end_ms)
+        if max_points:
+            data = downsample_history(data, max_points)
+        yield unit_index, channel, data
+
+def _json_array(values, chunk):
+    """Stream een lijst als JSON-array in stukken van `chunk` elementen."""
+    yield '['
+    for i in range(0, len(values), chunk):
+        if i:
+            yield ','
+        yield json.dumps(values[i:i + chunk])[1:-1]
+    yield ']'
+
+def _stream_json(series, start_ms, end_ms, max_points, minmax):
+    chunk = Config.API_CHUNK_POINTS
+    fields = ['ts', 'value'] + (['min', 'max'] if minmax else [])
+    yield json.dumps({'start': start_ms, 'end': end_ms, 'fields': fields})[:-1]
+    yield ', "series": ['
+    for n, (unit_index, channel, data) in enumerate(_load(series, start_ms, end_ms, max_points)):
+        if n:
+            yield ','
+        header = {
+            'unit_index': unit_index,
+            'channel':    channel,
+            'unit':       get_calibration(unit_index, channel).get('unit', ''),
+            'resolution': data['resolution'],
+            'n':          len(data['ts']),
+        }
+        yield json.dumps(header)[:-1]
+        for field in fields:
+            yield f', "{field}": '
+            yield from _json_array(data[field], chunk)
+        yield '}'
+    yield ']}'
+
+def _stream_bin(series, start_ms, end_ms, max_points, minmax):
+    chunk = Config.API_CHUNK_POINTS
+    fields = ['ts', 'value'] + (['min', 'max'] if minmax else [])
+    yield BIN_MAGIC
+    for unit_index, channel, data in _load(series, start_ms, end_ms, max_points):
+        header = json.dumps({
+            'unit_index': unit_index,
+            'channel':    channel,
+            'unit':       get_calibration(unit_index, channel).get('unit', ''),
+            'resolution': data['resolution'],
+            'n':          len(data['ts']),
+            'fields':     fields,
+        }).encode()
+        yield struct.pack('<I', len(header)) + header
+        for field in fields:
+            dtype = '<i8' if field == 'ts' else '<f4'
+            arr = np.asarray(data[field], dtype=dtype)
+            for i in range(0, len(arr), chunk):
+                yield arr[i:i + chunk].tobytes()
+
+@api_bp.route('/api/sensor_history')
+def sensor_history_api():
+    try:
+        series = parse_series(request.args.get('series'))
+        start_ms, end_ms = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    max_points = request.args.get('max_points', type=int)
+    minmax = request.args.get('minmax', '0') == '1'
+    fmt = request.args.get('format', 'json')
+
+    if fmt == 'bin':
+        gen, mimetype = _stream_bin, 'application/octet-stream'
+    elif fmt == 'json':
+        gen, mimetype = _stream_json, 'application/json'
+    else:
+        return jsonify({'error': f'Onbekend formaat: {fmt}'}), 400
+    return Response(
+        stream_with_context(gen(series, start_ms, end_ms, max_points, minmax)),
+        mimetype=mimetype
+    )
@@ -0,0 +1,225 @@
+# obelix/metrics.py
+"""
+Lichtgewicht instrumentatie: histogrammen, counters en gauges met labels,
+te lezen via /metrics (Prometheus-tekstformaat) en /status.
+
+Een observatie kost een bisect over vaste buckets en een increment onder
+een lock (ordegrootte een microseconde); met Config.METRICS_ENABLED = False
+is het een no-op. Gauges worden pas bij het uitlezen berekend.
+"""
+
+import time
+from bisect import bisect_left
+from threading import Lock
+from obelix.config import Config
+
+# Seconden; van sub-milliseconde (SQLite, emits) tot seconden (bus-timeouts)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _fmt_value(v):
+    return '+Inf' if v == float('inf') else repr(float(v))
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name    = name
+        self.help    = help
+        self.labels  = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labelwaarden -> [counts per bucket (+Inf), som, aantal]
+        self._lock   = Lock()
+
+    def observe(self, value, *labels):
+        if not Config.METRICS_ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self):
+        out = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for labels, counts, total, n in sorted(series):
+            cum = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cum += c
+                le = _fmt_labels(self.labels, labels, [('le', _fmt_value(bound))])
+                out.append(f'{self.name}_bucket{le} {cum}')
+            lbl = _fmt_labels(self.labels, labels)
+            out.append(f'{self.name}_sum{lbl} {total!r}')
+            out.append(f'{self.name}_count{lbl} {n}')
+        return out
+
+    def _quantile(self, counts, n, q):
+        """Bovengrens van de bucket waarin kwantiel q valt (zoals bij Prometheus, grof)."""
+        rank, cum = q * n, 0
+        for bound, c in zip(self.buckets + (float('inf'),), counts):
+            cum += c
+            if cum >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """Per labelset: aantal, gemiddelde en geschatte p50/p95 (ms), voor /status."""
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        rows = []
+        for labels, counts, total, n in sorted(series):
+            if not n:
+                continue
+            rows.append({
+                'labels':  dict(zip(self.labels, labels)),
+                'count':   n,
+                'mean_ms': round(total / n * 1000.0, 2),
+                'p50_ms':  round(self._quantile(counts, n, 0.5) * 1000.0, 2),
+                'p95_ms':  round(self._quantile(counts, n, 0.95) * 1000.0, 2),
+            })
+        return rows
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock  = Lock()
+
+    def inc(self, *labels, amount=1):
+        if not Config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        out = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, v in values:
+            out.append(f'{self.name}{_fmt_labels(self.labels, labels)} {v}')
+        return out
+
+    def summary(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [{'labels': dict(zip(self.labels, k)), 'value': v} for k, v in values]
+
+class Gauge:
+    """Gauge waarvan de waarden bij het uitlezen door fn() worden geleverd."""
+    def __init__(self, name, help, labels, fn):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self.fn     = fn  # -> iterable van (labelwaarden-tuple, waarde)
+
+    def render(self):
+        out = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, v in self.fn():
+            out.append(f'{self.name}{_fmt_labels(self.labels, labels)} {_fmt_value(v)}')
+        return out
+
+    def summary(self):
+        return [{'labels': dict(zip(self.labels, k)), 'value': v} for k, v in self.fn()]
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self.started = time.time()
+
+    def _add(self, metric):
+        # Idempotent: modules kunnen bij herimport dezelfde metric opvragen
+        return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels, fn):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def render(self):
+        """Alle metrics in het Prometheus-tekstformaat (versie 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name}: fout bij uitlezen: {e}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """{naam: (type, help, rijen)} voor de statuspagina."""
+        out = {}
+        for name, metric in self._metrics.items():
+            try:
+                rows = metric.summary()
+            except Exception as e:
+                rows = [{'labels': {}, 'value': f'fout: {e}'}]
+            out[name] = (type(metric).__name__.lower(), metric.help, rows)
+        return out
+
+registry = Registry()
+
+# ----- Gedeelde metrics -----
+
+modbus_transaction_seconds = registry.histogram(
+    'obelix_modbus_transaction_seconds', 'Duur van een Modbus-transactie',
+    ('slave', 'fc', 'result'))
+bus_queue_wait_seconds = registry.histogram(
+    'obelix_bus_queue_wait_seconds', 'Wachttijd in de bus-scheduler', ('bus', 'priority'))
+bus_lock_wait_seconds = registry.histogram(
+    'obelix_bus_lock_wait_seconds', 'Wachttijd op de bus-lock', ('bus',))
+bus_lock_hold_seconds = registry.histogram(
+    'obelix_bus_lock_hold_seconds', 'Tijd dat de bus-lock vastgehouden wordt', ('bus',))
+db_query_seconds = registry.histogram(
+    'obelix_db_query_seconds', 'SQLite-query inclusief fetch', ('db', 'op'))
+db_transaction_seconds = registry.histogram(
+    'obelix_db_transaction_seconds', 'SQLite-transactie (statements tot commit)', ('db',))
+db_commit_seconds = registry.histogram(
+    'obelix_db_commit_seconds', 'SQLite-commit', ('db',))
+scan_cycle_seconds = registry.histogram(
+    'obelix_scan_cycle_seconds', 'Duur van een scan-cyclus')
+scan_overruns_total = registry.counter(
+    'obelix_scan_overruns_total', 'Scan-cycli langer dan LIVE_POLL_INTERVAL')
+socketio_emit_seconds = registry.histogram(
+    'obelix_socketio_emit_seconds', 'Duur van een Socket.IO-emit (fan-out naar clients)',
+    ('event',))
+sbr_lateness_seconds = registry.histogram(
+    'obelix_sbr_transition_lateness_seconds', 'Lateness van SBR-fasetransities',
+    ('kind',))
+
+def instrument_socketio(socketio):
+    """
+    Meet elke emit via deze SocketIO-instantie, ook flask_socketio.emit()
+    vanuit handlers (die loopt via dezelfde instantie).
+    """
+    if getattr(socketio, '_obelix_instrumented', False):
+        return socketio
+    emit = socketio.emit
+
+    def timed_emit(event, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return emit(event, *args, **kwargs)
+        finally:
+            socketio_emit_seconds.observe(time.perf_counter() - t0, event)
+
+    socketio.emit = timed_emit
+    socketio._obelix_instrumented = True
+    return socketio
@@ -0,0 +1,105 @@
+# obelix/migrate_sensor_db.py
+"""
+Migreer sensor_data (TEXT-timestamps, unit per rij) naar sensor_samples
+(integer epoch-ms, WITHOUT ROWID). Werkt in chunks op rowid zodat de
+storage worker tussendoor kan blijven schrijven, en is hervatbaar.
+
+Gebruik:
+    python -m obelix.migrate_sensor_db [--db sensor_data.db] [--chunk 50000] [--drop-legacy]
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from obelix.config import Config
+
+# julianday -> epoch-ms; de ISO-strings in sensor_data zijn UTC
+_TS_MS = 'CAST(round((julianday(timestamp) - 2440587.5) * 86400000.0) AS INTEGER)'
+
+_CONVERT_SQL = f'''
+    INSERT OR REPLACE INTO sensor_samples (unit_index, channel, ts, value, raw)
+    SELECT unit_index, channel, {_TS_MS}, value, raw
+    FROM sensor_data
+    WHERE rowid > ? AND rowid <= ?
+'''
+
+# Vroegste legacy-rij; ook bij hervatten dekt dit eerder gemigreerde chunks
+_MIN_TS_SQL = f'''
+    SELECT {_TS_MS} FROM sensor_data
+    WHERE timestamp = (SELECT min(timestamp) FROM sensor_data)
+    LIMIT 1
+'''
+
+def _progress(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS migration_state (key TEXT PRIMARY KEY, value INTEGER)')
+    row = conn.execute("SELECT value FROM migration_state WHERE key='sensor_data_rowid'").fetchone()
+    return row[0] if row else 0
+
+def migrate(db_file, chunk=50000, drop_legacy=False, pause=0.05):
+    """
+    Converteer alle rijen uit sensor_data. Retourneert het aantal gemigreerde rijen.
+    """
+    from obelix.sensor_database import init_sensor_db  # maakt sensor_samples aan
+    Config.SENSOR_DB_FILE = db_file
+    init_sensor_db()
+
+    conn = sqlite3.connect(db_file, timeout=Config.DB_BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    has_legacy = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sensor_data'"
+    ).fetchone()
+    if not has_legacy:
+        print("Geen sensor_data-tabel gevonden, niets te migreren.")
+        return 0
+
+    last = _progress(conn)
+    max_rowid = conn.execute('SELECT max(rowid) FROM sensor_data').fetchone()[0] or 0
+    size_before = os.path.getsize(db_file)
+    total = 0
+    t0 = time.time()
+    while last < max_rowid:
+        hi = last + chunk
+        with conn:
+            cur = conn.execute(_CONVERT_SQL, (last, hi))
+            conn.execute('''
+                INSERT INTO migration_state(key, value) VALUES ('sensor_data_rowid', ?)
+                ON CONFLICT(key) DO UPDATE SET value=excluded.value
+            ''', (hi,))
+        total += cur.rowcount
+        last = hi
+        print(f"  rowid {min(hi, max_rowid)}/{max_rowid} ({total} rijen, {time.time() - t0:.1f}s)")
+        time.sleep(pause)  # ruimte voor andere schrijvers
+
+    if total:
+        from obelix.sensor_database import rebuild_rollups
+        # Niet vanaf 0: oudere rollups zijn soms het enige dat na retentie
+        # nog over is van de ruwe data
+        start_ms = conn.execute(_MIN_TS_SQL).fetchone()[0]
+        print("Rollups opnieuw opbouwen…")
+        rebuild_rollups(start_ms)
+
+    if drop_legacy:
+        with conn:
+            conn.execute('DROP TABLE sensor_data')
+            conn.execute('DROP TABLE migration_state')
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_after = os.path.getsize(db_file)
+        print(f"sensor_data verwijderd; bestand {size_before/1e6:.1f} MB -> {size_after/1e6:.1f} MB")
+    conn.close()
+    print(f"Klaar: {total} rijen gemigreerd in {time.time() - t0:.1f}s")
+    return total
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Migreer sensor_data naar het compacte sensor_samples-formaat')
+    p.add_argument('--db', default=Config.SENSOR_DB_FILE, help='pad naar sensor_data.db')
+    p.add_argument('--chunk', type=int, default=50000, help='rowids per transactie')
+    p.add_argument('--drop-legacy', action='store_true',
+                   help='oude tabel verwijderen en VACUUM uitvoeren na migratie')
+    args = p.parse_args(argv)
+    migrate(args.db, chunk=args.chunk, drop_legacy=args.drop_legacy)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,31 @@
+import time
 import minimalmodbus
+from contextlib import contextmanager
 from threading import Lock, Event
 from obelix.config import Config
 from obelix.utils import log
 from obelix.database import get_relay_state
+from obelix.process_image import process_image
+from obelix.metrics import registry, modbus_transaction_seconds
+from obelix import simulator
+from obelix.bus_scheduler import (
+    BusScheduler, BusRequestSuperseded, BusDeadlineExceeded,
+    PRIO_CONTROL, PRIO_OPERATOR, PRIO_POLL
+)
 
-modbus_lock = Lock()
 clients = []
 fallback_mode = False
 modbus_initialized = Event()  # Voor synchronisatie
+block_read_unsupported = set()  # (slave_id, functioncode) waarvoor block reads geweigerd worden
+multi_write_unsupported = set()  # slave_ids die Write Multiple Coils (FC15) weigeren
+slave_health = {}  # unit-index -> SlaveHealth
+
+# Per bus één lock en één scheduler (worker-thread) als enige eigenaar van de poort
+bus_locks = {name: Lock() for name in Config.BUSES}
+buses = {
+    name: BusScheduler(name, bus_locks[name], util_window=Config.BUS_UTIL_WINDOW)
+    for name in Config.BUSES
+}
 
 class DummyModbusClient:
     def __init__(self, *args, **kwargs):
@@ -16,68 +34,435 @@ class DummyModbusClient:
         self._ctr += 1
         return (self._ctr % 2) == 0
     def write_bit(self, coil, state, functioncode=None): pass
+    def write_bits(self, coil, values): pass
+    def read_bits(self, coil, count, functioncode=None):
+        return [self.read_bit(coil + i, functioncode) for i in range(count)]
     def read_register(self, reg, functioncode=None):
         self._ctr += 1
         return (self._ctr * 137) % 4096
+    def read_registers(self, reg, count, functioncode=None):
+        return [self.read_register(reg + i, functioncode) for i in range(count)]
     def write_register(self, reg, value, functioncode=None): pass
 
+class _InstrumentedClient:
+    """
+    Transparante wrapper om een client: meet elke transactie per slave,
+    functiecode en resultaat. Overige attributen (bijv. serial) gaan
+    rechtstreeks naar de onderliggende client.
+    """
+    # Standaard-functiecodes van minimalmodbus als de aanroeper er geen meegeeft
+    _METHODS = {'read_bit': 2, 'read_bits': 2, 'write_bit': 5, 'write_bits': 15,
+                'read_register': 3, 'read_registers': 3, 'write_register': 16}
+
+    def __init__(self, inst, slave_id):
+        self._inst  = inst
+        self._slave = str(slave_id)
+
+    def __getattr__(self, name):
+        attr = getattr(self._inst, name)
+        default_fc = self._METHODS.get(name)
+        if default_fc is None:
+            return attr
+
+        def call(*args, **kwargs):
+            fc = str(kwargs.get('functioncode', default_fc))
+            result = 'ok'
+            t0 = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                result = type(e).__name__
+                raise
+            finally:
+                modbus_transaction_seconds.observe(time.perf_counter() - t0, self._slave, fc, result)
+        # Eenmalig opbouwen; volgende aanroepen slaan __getattr__ over
+        setattr(self, name, call)
+        return call
+
+class SlaveHealth:
+    """
+    Houdt per slave het aantal opeenvolgende fouten bij. Na
+    Config.HEALTH_FAIL_THRESHOLD fouten gaat de slave in backoff: hij wordt
+    dan alleen nog met exponentieel groeiende tussenpozen geprobed, met een
+    korte timeout, tot hij weer antwoordt.
+    """
+    def __init__(self, slave_id):
+        self.slave_id             = slave_id
+        self.consecutive_failures = 0
+        self.total_failures       = 0
+        self.backoff              = 0.0
+        self.next_probe           = 0.0
+        self.last_error           = ''
+        self.last_ok              = None
+
+    @property
+    def state(self):
+        if self.consecutive_failures == 0:
+            return 'OK'
+        if self.consecutive_failures < Config.HEALTH_FAIL_THRESHOLD:
+            return 'DEGRADED'
+        return 'BACKOFF'
+
+    def in_backoff(self):
+        return self.state == 'BACKOFF'
+
+    def poll_due(self):
+        return not self.in_backoff() or time.monotonic() >= self.next_probe
+
+    def record_success(self):
+        if self.in_backoff():
+            log(f"✓ Slave {self.slave_id} antwoordt weer, terug naar normale polling")
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        self.last_ok = time.time()
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        self.last_error = str(error)
+        if self.consecutive_failures < Config.HEALTH_FAIL_THRESHOLD:
+            return
+        if self.backoff == 0.0:
+            self.backoff = Config.HEALTH_BACKOFF_MIN
+            log(f"⚠ Slave {self.slave_id} reageert niet ({error}), backoff {self.backoff:.0f}s")
+        else:
+            self.backoff = min(self.backoff * 2, Config.HEALTH_BACKOFF_MAX)
+        self.next_probe = time.monotonic() + self.backoff
+
+    def as_dict(self):
+        return {
+            'slave_id':             self.slave_id,
+            'state':                self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'total_failures':       self.total_failures,
+            'backoff':              self.backoff,
+            'last_error':           self.last_error,
+            'last_ok':              self.last_ok,
+        }
+
+def bus_name(idx):
+    """Naam van de bus waar unit idx op zit."""
+    return Config.UNITS[idx].get('bus', Config.DEFAULT_BUS)
+
+def bus_for(idx):
+    return buses[bus_name(idx)]
+
+def units_by_bus():
+    """{bus: [unit-indices]} in Config.UNITS-volgorde, alleen bussen met units."""
+    groups = {}
+    for idx in range(len(Config.UNITS)):
+        groups.setdefault(bus_name(idx), []).append(idx)
+    return groups
+
+def get_bus_metrics():
+    """Scheduler-metrics (wachtrij, wachttijden, bezettingsgraad) per bus."""
+    return [b.get_metrics() for b in buses.values()]
+
+def _serial_settings(name):
+    """Seriële instellingen van een bus: eigen waarden, anders de globale."""
+    cfg = Config.BUSES[name]
+    return {
+        'port':     cfg.get('port', Config.RS485_PORT),
+        'baudrate': cfg.get('baudrate', Config.BAUDRATE),
+        'parity':   cfg.get('parity', Config.PARITY),
+        'stopbits': cfg.get('stopbits', Config.STOPBITS),
+        'bytesize': cfg.get('bytesize', Config.BYTESIZE),
+        'timeout':  cfg.get('timeout', Config.TIMEOUT),
+    }
+
+def _health(idx):
+    h = slave_health.get(idx)
+    if h is None:
+        h = slave_health[idx] = SlaveHealth(Config.UNITS[idx]['slave_id'])
+    return h
+
+def poll_due(idx):
+    """True als unit idx in deze cyclus gepolld mag worden."""
+    return _health(idx).poll_due()
+
+def get_slave_health():
+    """Health-status van alle units, voor de UI."""
+    return [
+        dict(_health(i).as_dict(), idx=i, name=unit['name'], bus=bus_name(i))
+        for i, unit in enumerate(Config.UNITS)
+    ]
+
+_HEALTH_CODES = {'OK': 0, 'DEGRADED': 1, 'BACKOFF': 2}
+
+registry.gauge('obelix_bus_utilization', 'Bezettingsgraad van de bus over BUS_UTIL_WINDOW',
+               ('bus',), lambda: [((b.name,), b.utilization()) for b in buses.values()])
+registry.gauge('obelix_bus_queue_depth', 'Wachtende verzoeken in de bus-scheduler',
+               ('bus', 'priority'), lambda: [
+                   ((b.name, prio), n) for b in buses.values() for prio, n in b.depth().items()
+               ])
+registry.gauge('obelix_slave_health_state', 'Health per slave (0=OK, 1=DEGRADED, 2=BACKOFF)',
+               ('slave', 'bus'), lambda: [
+                   ((h['slave_id'], h['bus']), _HEALTH_CODES[h['state']]) for h in get_slave_health()
+               ])
+registry.gauge('obelix_slave_failures', 'Totaal aantal mislukte transacties per slave',
+               ('slave', 'bus'), lambda: [
+                   ((h['slave_id'], h['bus']), h['total_failures']) for h in get_slave_health()
+               ])
+
+@contextmanager
+def _probe_timeout(idx, inst):
+    """Gebruik tijdens een probe van een slave in backoff de korte timeout."""
+    serial = getattr(inst, 'serial', None)
+    if serial is None or not _health(idx).in_backoff():
+        yield
+        return
+    serial.timeout = Config.PROBE_TIMEOUT
+    try:
+        yield
+    finally:
+        serial.timeout = _serial_settings(bus_name(idx))['timeout']
+
+def _serial_instrument(slave_id, ser):
+    inst = minimalmodbus.Instrument(ser['port'], slave_id, mode=minimalmodbus.MODE_RTU)
+    inst.serial.baudrate = ser['baudrate']
+    inst.serial.parity = ser['parity']
+    inst.serial.stopbits = ser['stopbits']
+    inst.serial.bytesize = ser['bytesize']
+    inst.serial.timeout = ser['timeout']
+    inst.clear_buffers_before_each_transaction = True
+    return inst
+
 def init_modbus():
     global clients, fallback_mode
     clients = []
+    slave_health.clear()
     log(f"Initialiseren van Modbus voor {len(Config.UNITS)} units")
     if not Config.UNITS:
         log("⚠️ Config.UNITS is leeg! Geen Modbus-clients worden geïnitialiseerd.")
         fallback_mode = True
         modbus_initialized.set()
         return
+    unknown = {bus_name(i) for i in range(len(Config.UNITS))} - set(Config.BUSES)
+    if unknown:
+        raise ValueError(f"Units verwijzen naar onbekende bus(sen): {sorted(unknown)}")
+    backend = Config.MODBUS_BACKEND
+    if backend == 'dummy':
+        log("Modbus-backend 'dummy' geconfigureerd")
+        clients = [DummyModbusClient() for _ in Config.UNITS]
+        fallback_mode = True
+        modbus_initialized.set()
+        return
+    if backend not in ('serial', 'simulator'):
+        raise ValueError(f"Onbekende MODBUS_BACKEND: {backend!r}")
+    # De simulator gedraagt zich als echte hardware (timing, fouten, health)
+    make_client = simulator.create_client if backend == 'simulator' else _serial_instrument
     try:
-        for unit in Config.UNITS:
-            inst = minimalmodbus.Instrument(Config.RS485_PORT, unit['slave_id'], mode=minimalmodbus.MODE_RTU)
-            inst.serial.baudrate = Config.BAUDRATE
-            inst.serial.parity = Config.PARITY
-            inst.serial.stopbits = Config.STOPBITS
-            inst.serial.bytesize = Config.BYTESIZE
-            inst.serial.timeout = Config.TIMEOUT
-            inst.clear_buffers_before_each_transaction = True
-
-            with modbus_lock:
-                if unit['type'] == 'relay':
-                    inst.read_bit(0, functioncode=1)
-                else:
-                    inst.read_register(0, functioncode=4)
-
-            clients.append(inst)
-            log(f"Modbus OK voor {unit['name']} (ID {unit['slave_id']})")
+        for idx, unit in enumerate(Config.UNITS):
+            name = bus_name(idx)
+            inst = make_client(unit['slave_id'], _serial_settings(name))
+
+            # Een enkele niet-reagerende slave schakelt niet de hele bus naar
+            # Dummy-modus; hij start in backoff en wordt later opnieuw geprobed.
+            try:
+                with bus_locks[name]:
+                    if unit['type'] == 'relay':
+                        inst.read_bit(0, functioncode=1)
+                    else:
+                        inst.read_register(0, functioncode=4)
+                log(f"Modbus OK voor {unit['name']} (ID {unit['slave_id']}, bus {name})")
+            except minimalmodbus.ModbusException as e:
+                h = _health(idx)
+                for _ in range(Config.HEALTH_FAIL_THRESHOLD):
+                    h.record_failure(e)
+                log(f"⚠ {unit['name']} (ID {unit['slave_id']}) reageert niet: {e}")
+
+            clients.append(_InstrumentedClient(inst, unit['slave_id']))
         fallback_mode = False
     except Exception as e:
         log(f"Modbus niet gevonden ({e}), overschakelen naar Dummy‐modus.")
         clients = [DummyModbusClient() for _ in Config.UNITS]
         fallback_mode = True
-    log(f"Modbus-initialisatie voltooid: {len(clients)} clients geïnitialiseerd")
+    log(f"Modbus-initialisatie voltooid ({backend}): {len(clients)} clients geïnitialiseerd")
     modbus_initialized.set()  # Signaleer dat initialisatie voltooid is
 
 def get_clients():
     return clients
 
-def read_relay_states(idx):
-    if idx >= len(clients):
-        log(f"⚠️ Ongeldige unit-index {idx}, geen client beschikbaar")
-        return [False] * 8
+def _read_coil_bits(idx, count):
+    inst = clients[idx]
+    slave_id = Config.UNITS[idx]['slave_id']
+    if (slave_id, 1) not in block_read_unsupported:
+        try:
+            return [bool(b) for b in inst.read_bits(0, count, functioncode=1)]
+        except minimalmodbus.IllegalRequestError as e:
+            block_read_unsupported.add((slave_id, 1))
+            log(f"Slave {slave_id} ondersteunt geen block read ({e}), terugval naar losse reads")
+    bits = []
+    for coil in range(count):
+        try:
+            bits.append(bool(inst.read_bit(coil, functioncode=1)))
+        except minimalmodbus.IllegalRequestError:
+            bits.append(False)
+    return bits
+
+def _read_coils_tx(idx, count):
+    health = _health(idx)
+    keys = [('coil', idx, coil) for coil in range(count)]
+    with _probe_timeout(idx, clients[idx]):
+        try:
+            bits = _read_coil_bits(idx, count)
+        except Exception as e:
+            health.record_failure(e)
+            process_image.mark_bad(keys)
+            raise
+    health.record_success()
+    # Nog binnen de bustransactie: een latere write_coils kan dit niet
+    # meer met een oudere leeswaarde overschrijven
+    process_image.set_many(zip(keys, bits))
+    return bits
+
+def _poll_deadline():
+    return time.monotonic() + Config.BUS_POLL_DEADLINE
+
+def read_coils(idx, count=8, priority=PRIO_POLL):
+    """
+    Lees `count` coils (FC1) van unit idx van de bus en werk het procesbeeld
+    bij. Gooit een exception als de slave niet antwoordt; de health-tracker
+    wordt bijgewerkt en de tags gaan naar BAD.
+    """
+    deadline = _poll_deadline() if priority == PRIO_POLL else None
+    return bus_for(idx).call(lambda: _read_coils_tx(idx, count), priority, deadline=deadline)
+
+def relay_states_from_image(idx, count=8):
+    """
+    Relay-toestand uit het procesbeeld, zonder bustoegang. Voor coils
+    zonder tag (nog niet gescand) geldt de opgeslagen toestand.
+    """
+    states = []
+    for coil in range(count):
+        value = process_image.value(('coil', idx, coil))
+        if value is None:
+            value = get_relay_state(idx, coil) == 'ON'
+        states.append(bool(value))
+    return states
+
+def _read_registers_tx(idx, count, functioncode):
+    inst = clients[idx]
+    slave_id = Config.UNITS[idx]['slave_id']
+    health = _health(idx)
+    with _probe_timeout(idx, inst):
+        if (slave_id, functioncode) not in block_read_unsupported:
+            try:
+                values = inst.read_registers(0, count, functioncode=functioncode)
+                health.record_success()
+                return values
+            except minimalmodbus.IllegalRequestError as e:
+                block_read_unsupported.add((slave_id, functioncode))
+                log(f"Slave {slave_id} ondersteunt geen block read ({e}), terugval naar losse reads")
+            except Exception as e:
+                health.record_failure(e)
+                raise
+        values = []
+        for ch in range(count):
+            try:
+                values.append(inst.read_register(ch, functioncode=functioncode))
+            except minimalmodbus.IllegalRequestError as e:
+                log(f"⚠ Error reading slave {slave_id} ch{ch}: {e}")
+                values.append(None)
+            except Exception as e:
+                # Geen antwoord: de overige kanalen niet ook laten timen
+                health.record_failure(e)
+                raise
+        health.record_success()
+        return values
+
+def _read_registers(idx, count, functioncode, priority=PRIO_POLL):
+    deadline = _poll_deadline() if priority == PRIO_POLL else None
+    return bus_for(idx).call(lambda: _read_registers_tx(idx, count, functioncode), priority, deadline=deadline)
+
+def read_input_registers(idx, count=4):
+    """
+    Lees `count` input-registers (FC4) van unit idx met één block read.
+    Slaves die de block read weigeren (IllegalRequestError) worden onthouden
+    en daarna per register uitgelezen. Retourneert een lijst met waarden;
+    een kanaal dat niet gelezen kon worden is None.
+    Fouten worden bijgehouden in de health-tracker van de slave.
+    """
+    return _read_registers(idx, count, 4)
+
+def read_holding_registers(idx, count=4):
+    """Als read_input_registers, maar voor holding-registers (FC3)."""
+    return _read_registers(idx, count, 3)
+
+def _write_deadline(priority):
+    # Besturingscommando's moeten altijd uitgevoerd worden
+    return None if priority == PRIO_CONTROL else time.monotonic() + Config.BUS_WRITE_DEADLINE
+
+def _coil_known(idx, coil):
+    """Mag de huidige waarde van deze coil uit het procesbeeld mee in een FC15-vector?"""
+    return fallback_mode or process_image.is_good(('coil', idx, coil))
+
+def _write_coils_tx(idx, states):
+    # Schrijffouten tellen mee in de health-tracker, net als leesfouten
+    health = _health(idx)
+    try:
+        _write_coil_states(idx, states)
+    except Exception as e:
+        health.record_failure(e)
+        raise
+    health.record_success()
+
+def _write_coil_states(idx, states):
+    inst = clients[idx]
+    slave_id = Config.UNITS[idx]['slave_id']
+    lo, hi = min(states), max(states)
+    # Vector pas hier opbouwen, zodat eerder uitgevoerde schrijfacties meetellen
+    vector = [
+        bool(states[c]) if c in states else bool(process_image.value(('coil', idx, c), False))
+        for c in range(lo, hi + 1)
+    ]
+    use_fc15 = (
+        hi > lo and slave_id not in multi_write_unsupported and
+        all(c in states or _coil_known(idx, c) for c in range(lo, hi + 1))
+    )
+    if use_fc15:
+        try:
+            inst.write_bits(lo, [int(v) for v in vector])
+            process_image.set_many(
+                (('coil', idx, c), v) for c, v in zip(range(lo, hi + 1), vector)
+            )
+            return
+        except minimalmodbus.IllegalRequestError as e:
+            multi_write_unsupported.add(slave_id)
+            log(f"Slave {slave_id} ondersteunt geen FC15 ({e}), terugval naar FC5 per coil")
+    for coil, state in sorted(states.items()):
+        inst.write_bit(coil, bool(state), functioncode=5)
+        process_image.set(('coil', idx, coil), bool(state))
+
+def write_coils(idx, states, priority=PRIO_OPERATOR):
+    """
+    Schrijf meerdere coils van unit idx in één transactie.
+      - states: {coil_index: bool}
+    De doelvector loopt van de laagste tot de hoogste gewijzigde coil;
+    tussenliggende coils houden hun waarde uit het procesbeeld. Alles gaat
+    met één Write Multiple Coils (FC15), zodat de relays geen tussentoestanden
+    doorlopen. Bij één coil, een onbekende tussenliggende coil of een module
+    zonder FC15 wordt per coil met FC5 geschreven.
+    """
+    if not states:
+        return
+    bus_for(idx).call(lambda: _write_coils_tx(idx, dict(states)), priority,
+             deadline=_write_deadline(priority))
+
+def write_holding_register(idx, reg, value, priority=PRIO_OPERATOR):
+    """
+    Schrijf één holding-register (FC6) via de bus-scheduler en werk het
+    procesbeeld bij. Een nog wachtende schrijfactie naar hetzelfde register
+    wordt vervangen.
+    """
     inst = clients[idx]
-    if fallback_mode:
-        states = []
-        for coil in range(8):
-            saved_state = get_relay_state(idx, coil)
-            states.append(saved_state == 'ON' if saved_state else False)
-        return states
-    with modbus_lock:
+    def tx():
+        health = _health(idx)
         try:
-            bits = inst.read_bits(0, 8, functioncode=1)
-        except Exception:
-            bits = []
-            for coil in range(8):
-                try:
-                    bits.append(inst.read_bit(coil, functioncode=1))
-                except:
-                    bits.append(False)
-        return bits
\ No newline at end of file
+            inst.write_register(reg, value, functioncode=6)
+        except Exception as e:
+            health.record_failure(e)
+            raise
+        health.record_success()
+        process_image.set(('ao', idx, reg), value)
+    bus_for(idx).call(tx, priority, key=('ao', idx, reg), deadline=_write_deadline(priority))
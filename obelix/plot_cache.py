@@ -0,0 +1,48 @@
+# obelix/plot_cache.py
+"""
+LRU-cache voor gerenderde plot-PNG's. Elke entry draagt de watermark
+(laatste opgeslagen ts van het kanaal binnen het venster); een entry is
+pas verouderd als er nieuwe data binnen dat venster is geland.
+"""
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from obelix.config import Config
+
+class PlotCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (watermark, etag, png)
+        self._lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_etag(key, watermark):
+        return hashlib.sha1(repr((key, watermark)).encode()).hexdigest()[:20]
+
+    def get(self, key, watermark):
+        """PNG-bytes als er een verse entry is, anders None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != watermark:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def put(self, key, watermark, png):
+        with self._lock:
+            self._entries[key] = (watermark, self.make_etag(key, watermark), png)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries),
+                        bytes=sum(len(e[2]) for e in self._entries.values()))
+
+plot_cache = PlotCache(Config.PLOT_CACHE_SIZE)
@@ -0,0 +1,83 @@
+# obelix/process_image.py
+"""
+Centraal procesbeeld (tag-database). De scan-engine in sensor_monitor
+werkt het met vaste frequentie bij; SBR-besturing, Socket.IO-handlers en
+R302-status lezen alleen hieruit en wachten dus nooit op een bus-lock.
+
+Tag-keys:
+  ('coil', unit_index, coil)   relay-uitgang (bool)
+  ('ai',   unit_index, channel) analoge ingang, ruwe registerwaarde
+  ('ao',   unit_index, channel) analoge uitgang, ruwe registerwaarde
+"""
+
+import time
+from threading import Lock
+from obelix.config import Config
+
+GOOD      = 'GOOD'       # recent en succesvol gelezen/geschreven
+BAD       = 'BAD'        # laatste lees-/schrijfpoging mislukt; waarde is de laatst bekende
+STALE     = 'STALE'      # al langer dan Config.TAG_STALE_AFTER niet ververst
+UNCERTAIN = 'UNCERTAIN'  # nog nooit van de bus gelezen (bijv. uit settings.db)
+
+class Tag:
+    __slots__ = ('value', 'ts', 'quality')
+
+    def __init__(self, value, ts, quality):
+        self.value   = value
+        self.ts      = ts
+        self.quality = quality
+
+    def effective_quality(self, now=None):
+        if self.quality == GOOD and (now or time.time()) - self.ts > Config.TAG_STALE_AFTER:
+            return STALE
+        return self.quality
+
+    def as_dict(self, now=None):
+        return {'value': self.value, 'ts': self.ts, 'quality': self.effective_quality(now)}
+
+class ProcessImage:
+    def __init__(self):
+        self._tags = {}
+        self._lock = Lock()  # alleen voor schrijvers; lezen van één tag is atomair
+
+    def set(self, key, value, quality=GOOD, ts=None):
+        self._tags[key] = Tag(value, ts or time.time(), quality)
+
+    def set_many(self, items, quality=GOOD, ts=None):
+        """items: iterable van (key, value); één gezamenlijke timestamp."""
+        ts = ts or time.time()
+        with self._lock:
+            for key, value in items:
+                self._tags[key] = Tag(value, ts, quality)
+
+    def mark_bad(self, keys):
+        """Zet de kwaliteit op BAD en behoud de laatst bekende waarde."""
+        with self._lock:
+            for key in keys:
+                tag = self._tags.get(key)
+                self._tags[key] = Tag(tag.value if tag else None,
+                                      tag.ts if tag else time.time(), BAD)
+
+    def get(self, key):
+        return self._tags.get(key)
+
+    def value(self, key, default=None):
+        tag = self._tags.get(key)
+        return default if tag is None or tag.value is None else tag.value
+
+    def is_good(self, key):
+        tag = self._tags.get(key)
+        return tag is not None and tag.effective_quality() == GOOD
+
+    def coils(self, unit_index, count=8):
+        return [bool(self.value(('coil', unit_index, c), False)) for c in range(count)]
+
+    def snapshot(self):
+        """Alle tags als {'kind:unit:n': {...}} voor de UI/API."""
+        now = time.time()
+        return {
+            ':'.join(str(k) for k in key): tag.as_dict(now)
+            for key, tag in list(self._tags.items())
+        }
+
+process_image = ProcessImage()
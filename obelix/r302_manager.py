@@ -2,7 +2,7 @@
 
 from obelix.config import Config
 from obelix.database import get_setting, set_setting
-from obelix.modbus_client import read_relay_states
+from obelix.modbus_client import relay_states_from_image
 
 class R302Controller:
     def __init__(self, unit_index=0):
@@ -27,8 +27,9 @@ class R302Controller:
         Retourneert dict:
           { coil_index: { 'mode': <AUTO|MANUAL_ON|MANUAL_OFF>,
                           'physical': <bool> } }
+        De fysieke toestand komt uit het procesbeeld (geen bustoegang).
         """
-        physical_states = read_relay_states(self.unit)
+        physical_states = relay_states_from_image(self.unit)
         status = {}
         for coil in Config.R302_RELAY_MAPPING:
             physical = physical_states[coil]
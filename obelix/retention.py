@@ -0,0 +1,135 @@
+# obelix/retention.py
+"""
+Retentiebeleid voor sensor_data.db: verwijdert per resolutie data ouder
+dan Config.RETENTION_DAYS, in kleine batches per kanaal zodat de storage
+worker nooit lang op de schrijflock wacht, en geeft vrije pagina's terug
+met incremental_vacuum.
+
+Gebruik als CLI (eenmalige run):
+    python -m obelix.retention
+"""
+
+import threading
+import time
+from datetime import datetime
+from obelix.config import Config
+from obelix.db_pool import get_connection, transaction
+from obelix.sensor_database import ROLLUPS, to_epoch_ms
+from obelix.utils import log
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+retention_stats = {
+    'runs':          0,
+    'last_run':      None,
+    'last_pruned':   {},
+    'last_freed':    0,
+    'total_pruned':  0,
+    'total_freed':   0,
+}
+
+def _tables():
+    """(resolutie, tabel, tijdkolom) voor alle tijdreeks-tabellen."""
+    yield 'raw', 'sensor_samples', 'ts'
+    for name, _ in ROLLUPS:
+        yield name, f'sensor_rollup_{name}', 'bucket'
+
+def _db_bytes(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_size, pages * page_size, free
+
+def _prune_channel(table, col, unit_index, channel, cutoff):
+    """Verwijder oude rijen van één kanaal in batches; retourneert het aantal."""
+    conn = get_connection(Config.SENSOR_DB_FILE)
+    pruned = 0
+    while True:
+        # Bovengrens van deze batch via een index-seek op (unit_index, channel, ts)
+        row = conn.execute(f'''
+            SELECT {col} FROM {table}
+            WHERE unit_index = ? AND channel = ? AND {col} < ?
+            ORDER BY {col} ASC LIMIT 1 OFFSET ?
+        ''', (unit_index, channel, cutoff, Config.RETENTION_BATCH - 1)).fetchone()
+        upper = row[0] + 1 if row else cutoff
+        with transaction(Config.SENSOR_DB_FILE) as tx:
+            cur = tx.execute(f'''
+                DELETE FROM {table}
+                WHERE unit_index = ? AND channel = ? AND {col} < ?
+            ''', (unit_index, channel, upper))
+        pruned += cur.rowcount
+        if row is None or cur.rowcount == 0:
+            return pruned
+        time.sleep(Config.RETENTION_BATCH_PAUSE)
+
+def incremental_vacuum():
+    """Geef vrije pagina's in kleine stappen terug; retourneert vrijgemaakte bytes."""
+    conn = get_connection(Config.SENSOR_DB_FILE)
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        log("⚠ sensor_data.db heeft geen auto_vacuum=INCREMENTAL; "
+            "ruimte komt pas vrij na een VACUUM (zie migrate_sensor_db --drop-legacy)")
+        return 0
+    page_size, size_before, free = _db_bytes(conn)
+    while free > 0:
+        # executescript stapt de pragma volledig af; execute() geeft maar één pagina vrij
+        conn.executescript(f'PRAGMA incremental_vacuum({Config.RETENTION_VACUUM_PAGES});')
+        _, _, free_after = _db_bytes(conn)
+        if free_after >= free:
+            break
+        free = free_after
+        time.sleep(Config.RETENTION_BATCH_PAUSE)
+    _, size_after, _ = _db_bytes(conn)
+    return max(0, size_before - size_after)
+
+def run_retention(now=None):
+    """
+    Voer één retentie-run uit. Retourneert (pruned_per_resolutie, bytes_vrij).
+    """
+    now_ms = to_epoch_ms(now or datetime.utcnow())
+    conn = get_connection(Config.SENSOR_DB_FILE)
+    # Kanalen uit de (kleine) dag-rollup in plaats van een scan over de ruwe data
+    channels = conn.execute(
+        f'SELECT DISTINCT unit_index, channel FROM sensor_rollup_{ROLLUPS[-1][0]}'
+    ).fetchall()
+
+    pruned = {}
+    for resolution, table, col in _tables():
+        days = Config.RETENTION_DAYS.get(resolution)
+        if days is None:
+            continue
+        cutoff = now_ms - int(days * DAY_MS)
+        pruned[resolution] = sum(
+            _prune_channel(table, col, u, ch, cutoff) for u, ch in channels
+        )
+
+    freed = incremental_vacuum() if any(pruned.values()) else 0
+
+    retention_stats['runs'] += 1
+    retention_stats['last_run'] = datetime.utcnow().isoformat()
+    retention_stats['last_pruned'] = pruned
+    retention_stats['last_freed'] = freed
+    retention_stats['total_pruned'] += sum(pruned.values())
+    retention_stats['total_freed'] += freed
+    log(f"🧹 Retentie: {sum(pruned.values())} rijen verwijderd {pruned}, "
+        f"{freed / 1e6:.1f} MB vrijgegeven")
+    return pruned, freed
+
+def _retention_worker():
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            log(f"⚠ Retentie-run mislukt: {e}")
+        time.sleep(Config.RETENTION_INTERVAL)
+
+def start_retention_worker():
+    th = threading.Thread(target=_retention_worker, daemon=True)
+    th.start()
+    return th
+
+if __name__ == '__main__':
+    from obelix.database import init_db
+    from obelix.sensor_database import init_sensor_db
+    init_db()
+    init_sensor_db()
+    run_retention()
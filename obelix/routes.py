@@ -1,18 +1,27 @@
 # obelix/routes.py
 from flask import (
     render_template, request, send_file,
-    Blueprint, url_for
+    Blueprint, url_for, jsonify, make_response
 )
 from io import BytesIO
+import time
 from obelix.config import Config
-from obelix.modbus_client import fallback_mode
+from obelix import auto_control
+from obelix.modbus_client import fallback_mode, get_slave_health, get_bus_metrics
+from obelix.process_image import process_image
+from obelix.metrics import registry
+from obelix.db_pool import release_connections
 from obelix.database import (
     get_setting, set_setting, get_all_calibrations,
     get_relay_state, save_relay_state,
     get_calibration, save_calibration,
     get_aio_setting, save_aio_setting
 )
-from obelix.sensor_plot import plot_sensor_history
+from obelix.sensor_plot import render_sensor_plot_png
+from obelix.sensor_database import get_latest_ts, to_epoch_ms
+from obelix.plot_cache import plot_cache
+from obelix.history_api import api_bp
+from obelix.export import export_bp
 
 plot_bp = Blueprint('plot', __name__)
 
@@ -21,33 +30,68 @@ def sensor_plot_png():
     """
     PNG-endpoint:
       Verplich: unit_index, channel
-      Optioneel: start, end (ISO), last_hours (int)
+      Optioneel: start, end (ISO), last_hours (int), max_points (int)
     """
     unit       = request.args.get('unit_index', type=int)
     channel    = request.args.get('channel',    type=int)
     last_hours = request.args.get('last_hours', type=int)
     start      = request.args.get('start')
     end        = request.args.get('end')
+    max_points = request.args.get('max_points', type=int)
 
     if last_hours:
         from datetime import datetime, timedelta
         now = datetime.utcnow()
         end = now.isoformat()
         start = (now - timedelta(hours=last_hours)).isoformat()
+        window = ('last', last_hours)
+    else:
+        window = ('range', start, end)
 
-    fig = plot_sensor_history(
-        unit_index=unit,
-        channel=channel,
-        start=start,
-        end=end
-    )
-    buf = BytesIO()
-    fig.savefig(buf, bbox_inches='tight')
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png',
-                     download_name='sensor_plot.png')
+    if unit is None or channel is None:
+        return jsonify({'error': "Parameters 'unit_index' en 'channel' zijn verplicht"}), 400
+    # Venster vooraf parsen (zoals history_api.parse_window): ongeldige
+    # invoer is een 400, geen 500 halverwege de render
+    try:
+        if start:
+            to_epoch_ms(start)
+        end_ms = to_epoch_ms(end) if end else None
+    except ValueError as e:
+        return jsonify({'error': f"Ongeldige start/end: {e}"}), 400
+
+    # Watermark: laatste opgeslagen ts binnen het venster. Zolang die niet
+    # verandert is de gerenderde PNG (en dus de ETag) nog geldig.
+    key = (unit, channel, window, max_points)
+    watermark = get_latest_ts(unit, channel, end_ms)
+    etag = plot_cache.make_etag(key, watermark)
+    if etag in request.if_none_match:
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        return resp
+
+    png = plot_cache.get(key, watermark)
+    if png is None:
+        try:
+            png = render_sensor_plot_png(
+                unit_index=unit,
+                channel=channel,
+                start=start,
+                end=end,
+                max_points=max_points
+            )
+        except ValueError as e:
+            # Geen data in het venster
+            return jsonify({'error': str(e)}), 404
+        plot_cache.put(key, watermark, png)
+    resp = send_file(BytesIO(png), mimetype='image/png',
+                     download_name='sensor_plot.png', etag=etag)
+    resp.cache_control.no_cache = True  # browser moet altijd revalideren
+    return resp
 
 def init_routes(app):
+    # Request- en Socket.IO-threads geven hun SQLite-verbindingen terug aan de pool
+    app.teardown_appcontext(release_connections)
+
     @app.route('/')
     def index():
         return render_template('dashboard.html', fallback_mode=fallback_mode)
@@ -69,6 +113,53 @@ def init_routes(app):
     def sensors():
         return render_template('sensors.html')
 
+    @app.route('/api/bus_health')
+    def bus_health():
+        return jsonify(get_slave_health())
+
+    @app.route('/api/bus_metrics')
+    def bus_metrics():
+        return jsonify(get_bus_metrics())
+
+    @app.route('/api/process_image')
+    def process_image_api():
+        return jsonify(process_image.snapshot())
+
+    @app.route('/api/sbr_timing')
+    def sbr_timing():
+        ctrl = auto_control.sbr_controller
+        if ctrl is None:
+            return jsonify({'error': 'No SBR controller'}), 503
+        return jsonify(ctrl.get_timing_stats())
+
+    @app.route('/api/sbr_recipe')
+    def sbr_recipe():
+        ctrl = auto_control.sbr_controller
+        if ctrl is None:
+            return jsonify({'error': 'No SBR controller'}), 503
+        return jsonify(ctrl.recipe.as_dict())
+
+    @app.route('/metrics')
+    def metrics():
+        resp = make_response(registry.render())
+        resp.mimetype = 'text/plain'
+        resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return resp
+
+    @app.route('/status')
+    def status():
+        uptime = int(time.time() - registry.started)
+        return render_template(
+            'status.html',
+            summary=registry.summary(),
+            enabled=Config.METRICS_ENABLED,
+            uptime=f"{uptime // 3600}u {uptime % 3600 // 60}m {uptime % 60}s"
+        )
+
+    @app.route('/logs')
+    def logs():
+        return render_template('logs.html')
+
     @app.route('/calibrate')
     def calibrate():
         return render_template('calibrate.html', units=Config.UNITS)
@@ -99,6 +190,9 @@ def init_routes(app):
         cycle_time_minutes = float(get_setting('sbr_cycle_time_minutes', '1.66667'))
         return render_template('sbr.html', 
                              cycle_active=cycle_active,
-                             cycle_time_minutes=cycle_time_minutes)
+                             cycle_time_minutes=cycle_time_minutes,
+                             relay_labels=Config.R302_RELAY_MAPPING)
     
-    app.register_blueprint(plot_bp)
\ No newline at end of file
+    app.register_blueprint(plot_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(export_bp)
\ No newline at end of file
@@ -0,0 +1,172 @@
+# obelix/sbr_recipe.py
+"""
+SBR-recepten: een geordende lijst fases, opgeslagen als JSON in settings.db
+(tabel sbr_recipes) en bij het laden gecompileerd tot een transitietabel.
+
+Voorbeeld:
+  {"phases": [
+     {"name": "influent", "coils": {"0": true}, "duration_s": 100},
+     {"name": "react",    "coils": {"3": true, "4": true},
+      "aio": {"0": 60, "1": 60}, "duration_s": 3600},
+     {"name": "settle",   "duration_s": 1800},
+     {"name": "effluent", "coils": {"1": true}, "duration_s": 600,
+      "until": {"sensor": [4, 0], "op": "<=", "value": 0.2}}
+  ]}
+
+  - coils:      R302-coil -> aan/uit; niet genoemde coils gaan uit (alleen AUTO)
+  - aio:        AIO-kanaal -> setpoint in procent (4-20 mA)
+  - duration_s: duur in seconden; met een until-conditie de maximale duur
+  - until:      fase eindigt zodra de gecalibreerde sensorwaarde voldoet
+"""
+
+import json
+import operator
+from obelix.config import Config
+from obelix.database import (
+    get_setting, set_setting, get_calibration,
+    get_sbr_recipe, save_sbr_recipe
+)
+from obelix.process_image import process_image
+
+DEFAULT_RECIPE = 'default'
+
+_OPS = {'>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+
+def aio_percent_to_raw(percent):
+    """Procent -> ruwe DAC-waarde (4-20 mA op een 0-20 mA / 12-bit schaal)."""
+    mA = 4.0 + percent / 100.0 * 16.0
+    return int(mA / 20.0 * 4095)
+
+class SensorCondition:
+    """Vergelijking op de gecalibreerde waarde van één analoge ingang."""
+    __slots__ = ('key', 'unit', 'channel', 'op', 'op_name', 'threshold')
+
+    def __init__(self, unit, channel, op, threshold):
+        self.key       = ('ai', unit, channel)
+        self.unit      = unit
+        self.channel   = channel
+        self.op        = _OPS[op]
+        self.op_name   = op
+        self.threshold = threshold
+
+    def __call__(self):
+        # Alleen verse metingen mogen een fase beëindigen
+        if not process_image.is_good(self.key):
+            return False
+        cal = get_calibration(self.unit, self.channel)
+        value = process_image.value(self.key) * cal['scale'] + cal['offset']
+        return self.op(value, self.threshold)
+
+class Phase:
+    """Eén regel van de transitietabel; alles voorberekend bij het compileren."""
+    __slots__ = ('index', 'name', 'targets', 'aio', 'duration', 'until', 'next')
+
+    def __init__(self, index, name, targets, aio, duration, until, next_index):
+        self.index    = index
+        self.name     = name
+        self.targets  = targets   # {coil: bool} voor alle R302-coils
+        self.aio      = aio       # ((kanaal, raw, procent), ...)
+        self.duration = duration  # seconden
+        self.until    = until     # SensorCondition of None
+        self.next     = next_index
+
+class Recipe:
+    def __init__(self, name, definition, phases):
+        self.name       = name
+        self.definition = definition  # genormaliseerde dict, zoals opgeslagen
+        self.phases     = phases      # tuple van Phase
+
+    def set_duration(self, phase_name, seconds):
+        """Pas de duur van een fase ter plekke aan (ook de lopende fase)."""
+        for phase, spec in zip(self.phases, self.definition['phases']):
+            if phase.name == phase_name:
+                phase.duration = seconds
+                spec['duration_s'] = seconds
+
+    def as_dict(self):
+        return {'name': self.name, **self.definition}
+
+def compile_recipe(name, definition):
+    """
+    Valideer een receptdefinitie (dict of JSON-tekst) en bouw de
+    transitietabel. Gooit ValueError bij een ongeldig recept.
+    """
+    if isinstance(definition, str):
+        definition = json.loads(definition)
+    specs = definition.get('phases') or []
+    if not specs:
+        raise ValueError("Recept bevat geen fases")
+
+    phases, normalized = [], []
+    for i, spec in enumerate(specs):
+        pname = str(spec.get('name') or f'fase {i + 1}')
+        coils = {int(c): bool(v) for c, v in (spec.get('coils') or {}).items()}
+        unknown = set(coils) - set(Config.R302_RELAY_MAPPING)
+        if unknown:
+            raise ValueError(f"Fase {pname}: onbekende coil(s) {sorted(unknown)}")
+        aio = {int(ch): float(p) for ch, p in (spec.get('aio') or {}).items()}
+        for ch, pct in aio.items():
+            if not 0 <= ch < 4 or not 0 <= pct <= 100:
+                raise ValueError(f"Fase {pname}: ongeldig AIO-setpoint {ch}={pct}")
+
+        until = None
+        cond = spec.get('until')
+        if cond:
+            unit, channel = (int(x) for x in cond['sensor'])
+            if cond.get('op') not in _OPS:
+                raise ValueError(f"Fase {pname}: onbekende operator {cond.get('op')!r}")
+            until = SensorCondition(unit, channel, cond['op'], float(cond['value']))
+
+        duration = spec.get('duration_s')
+        if duration is None and until is None:
+            raise ValueError(f"Fase {pname}: duration_s of until is verplicht")
+        duration = float(duration) if duration is not None else float('inf')
+        if duration <= 0:
+            raise ValueError(f"Fase {pname}: duur moet groter dan 0 zijn")
+
+        phases.append(Phase(
+            index=i,
+            name=pname,
+            targets={coil: coils.get(coil, False) for coil in Config.R302_RELAY_MAPPING},
+            aio=tuple((ch, aio_percent_to_raw(pct), pct) for ch, pct in sorted(aio.items())),
+            duration=duration,
+            until=until,
+            next_index=(i + 1) % len(specs)
+        ))
+        entry = {'name': pname, 'coils': {str(c): v for c, v in coils.items()}}
+        if aio:
+            entry['aio'] = {str(ch): p for ch, p in aio.items()}
+        if spec.get('duration_s') is not None:
+            entry['duration_s'] = duration
+        if until:
+            entry['until'] = {'sensor': [until.unit, until.channel],
+                              'op': until.op_name, 'value': until.threshold}
+        normalized.append(entry)
+
+    return Recipe(name, {'phases': normalized}, tuple(phases))
+
+def legacy_recipe_definition(influent_secs, effluent_secs):
+    """Het oorspronkelijke twee-fasen-programma: influent (coil 0), effluent (coil 1)."""
+    return {'phases': [
+        {'name': 'influent', 'coils': {'0': True}, 'duration_s': influent_secs},
+        {'name': 'effluent', 'coils': {'1': True}, 'duration_s': effluent_secs},
+    ]}
+
+def load_active_recipe(influent_secs, effluent_secs):
+    """
+    Laad het actieve recept (setting sbr_active_recipe) uit settings.db.
+    Zonder opgeslagen recept wordt het twee-fasen-programma aangemaakt
+    uit de bestaande fasetijden.
+    """
+    name = get_setting('sbr_active_recipe', DEFAULT_RECIPE)
+    stored = get_sbr_recipe(name)
+    if stored is None:
+        recipe = compile_recipe(name, legacy_recipe_definition(influent_secs, effluent_secs))
+        store_recipe(recipe)
+        return recipe
+    return compile_recipe(name, stored)
+
+def store_recipe(recipe, activate=True):
+    save_sbr_recipe(recipe.name, json.dumps(recipe.definition))
+    if activate:
+        set_setting('sbr_active_recipe', recipe.name)
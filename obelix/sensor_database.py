@@ -1,41 +1,213 @@
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 from obelix.config import Config
+from obelix.db_pool import get_connection, transaction, fetchall, fetchone
+from obelix.database import get_calibration
+from obelix.utils import log
+
+# Rollup-resoluties (naam, bucketgrootte in ms), van fijn naar grof
+ROLLUPS = (
+    ('1m', 60 * 1000),
+    ('1h', 60 * 60 * 1000),
+    ('1d', 24 * 60 * 60 * 1000),
+)
 
 def init_sensor_db():
     """
-    Initialiseer de losse sensor-database met tabel sensor_data.
+    Initialiseer de losse sensor-database met tabel sensor_samples.
+    Tijdstempels zijn integer epoch-milliseconden (UTC); de sleutel
+    (unit_index, channel, ts) maakt elke tijdreeks een aaneengesloten
+    index-range. De eenheid komt uit de calibration-tabel in settings.db.
     """
-    conn = sqlite3.connect(Config.SENSOR_DB_FILE)
+    conn = get_connection(Config.SENSOR_DB_FILE)
     c = conn.cursor()
     c.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            timestamp   TEXT    NOT NULL,
+        CREATE TABLE IF NOT EXISTS sensor_samples (
             unit_index  INTEGER NOT NULL,
             channel     INTEGER NOT NULL,
-            raw         REAL,
+            ts          INTEGER NOT NULL,
             value       REAL    NOT NULL,
-            unit        TEXT,
-            PRIMARY KEY(timestamp, unit_index, channel)
-        )
+            raw         REAL,
+            PRIMARY KEY(unit_index, channel, ts)
+        ) WITHOUT ROWID
     ''')
+    # Rollups: min/max/som/aantal per bucket, incrementeel bijgewerkt
+    for name, _ in ROLLUPS:
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS sensor_rollup_{name} (
+                unit_index  INTEGER NOT NULL,
+                channel     INTEGER NOT NULL,
+                bucket      INTEGER NOT NULL,
+                vmin        REAL    NOT NULL,
+                vmax        REAL    NOT NULL,
+                vsum        REAL    NOT NULL,
+                n           INTEGER NOT NULL,
+                PRIMARY KEY(unit_index, channel, bucket)
+            ) WITHOUT ROWID
+        ''')
     conn.commit()
-    conn.close()
+
+    # Oud formaat (TEXT-timestamps) nog aanwezig? Dan moet het gemigreerd worden.
+    legacy = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sensor_data'"
+    ).fetchone()
+    if legacy and c.execute('SELECT 1 FROM sensor_data LIMIT 1').fetchone():
+        log("⚠ sensor_data in oud formaat gevonden; migreer met: python -m obelix.migrate_sensor_db")
+
+def to_epoch_ms(value):
+    """ISO-string of datetime (naief = UTC) naar epoch-milliseconden."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def from_epoch_ms(ms):
+    """Epoch-milliseconden naar naieve UTC datetime."""
+    return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).replace(tzinfo=None)
+
+INSERT_READING_SQL = '''
+    INSERT OR REPLACE INTO sensor_samples (unit_index, channel, ts, value, raw)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+_ROLLUP_UPSERT_SQL = {
+    name: f'''
+        INSERT INTO sensor_rollup_{name} (unit_index, channel, bucket, vmin, vmax, vsum, n)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(unit_index, channel, bucket) DO UPDATE SET
+            vmin = min(vmin, excluded.vmin),
+            vmax = max(vmax, excluded.vmax),
+            vsum = vsum + excluded.vsum,
+            n    = n + 1
+    '''
+    for name, _ in ROLLUPS
+}
+
+def _update_rollups(conn, rows, extremes=None):
+    """
+    Werk alle rollup-tabellen bij voor rows (unit_index, channel, ts, value, raw).
+    extremes: optioneel {(unit_index, channel): (min, max)} van de onderliggende
+    samples, zodat pieken binnen een opslaginterval zichtbaar blijven.
+    """
+    extremes = extremes or {}
+    for name, size in ROLLUPS:
+        conn.executemany(_ROLLUP_UPSERT_SQL[name], [
+            (u, ch, ts - ts % size,
+             extremes.get((u, ch), (val, val))[0],
+             extremes.get((u, ch), (val, val))[1],
+             val)
+            for u, ch, ts, val, _raw in rows
+        ])
+
+def rebuild_rollups(start_ms=0):
+    """
+    Herbereken alle rollups vanaf start_ms uit sensor_samples (bijv. na een
+    migratie). Alleen buckets met ruwe rijen worden overschreven; buckets
+    waarvan de ruwe data al door retentie is opgeruimd blijven staan.
+    """
+    with transaction(Config.SENSOR_DB_FILE) as conn:
+        for name, size in ROLLUPS:
+            first_bucket = start_ms - start_ms % size
+            conn.execute(f'''
+                INSERT OR REPLACE INTO sensor_rollup_{name} (unit_index, channel, bucket, vmin, vmax, vsum, n)
+                SELECT unit_index, channel, ts - ts % ?, min(value), max(value), sum(value), count(*)
+                FROM sensor_samples
+                WHERE ts >= ?
+                GROUP BY unit_index, channel, ts - ts % ?
+            ''', (size, first_bucket, size))
 
 def save_sensor_reading(unit_index, channel, raw, value, unit_str=''):
     """
-    Sla een sensorlezing op (raw mag None zijn).
+    Sla een sensorlezing op (raw mag None zijn). unit_str wordt niet meer
+    per rij bewaard; de eenheid komt uit de calibratie.
     """
-    conn = sqlite3.connect(Config.SENSOR_DB_FILE)
-    c = conn.cursor()
-    ts = datetime.utcnow().isoformat()
-    c.execute('''
-        INSERT OR REPLACE INTO sensor_data
-            (timestamp, unit_index, channel, raw, value, unit)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (ts, unit_index, channel, raw, value, unit_str))
-    conn.commit()
-    conn.close()
+    save_sensor_readings([(unit_index, channel, raw, value, unit_str)])
+
+def save_sensor_readings(readings, ts=None, extremes=None):
+    """
+    Sla een hele batch lezingen op in één transactie met één timestamp,
+    inclusief de bijbehorende rollup-buckets.
+      - readings: iterable van (unit_index, channel, raw, value, unit_str)
+      - ts:       optionele datetime; standaard utcnow()
+      - extremes: optioneel {(unit_index, channel): (min, max)}
+    Retourneert het aantal weggeschreven rijen.
+    """
+    ts = to_epoch_ms(ts or datetime.utcnow())
+    rows = [(u, ch, ts, val, raw) for u, ch, raw, val, _unit in readings]
+    if rows:
+        with transaction(Config.SENSOR_DB_FILE) as conn:
+            conn.executemany(INSERT_READING_SQL, rows)
+            _update_rollups(conn, rows, extremes)
+    return len(rows)
+
+def get_sensor_series(unit_index, channel, start_ms=None, end_ms=None):
+    """
+    Ruwe tijdreeks als lijst (ts_ms, value, raw), gesorteerd op ts.
+    Altijd een index-seek op (unit_index, channel, ts).
+    """
+    return fetchall(Config.SENSOR_DB_FILE, '''
+        SELECT ts, value, raw FROM sensor_samples
+        WHERE unit_index = ? AND channel = ? AND ts BETWEEN ? AND ?
+        ORDER BY ts ASC
+    ''', (unit_index, channel,
+          start_ms if start_ms is not None else 0,
+          end_ms if end_ms is not None else 2**62))
+
+def _choose_resolution(span_ms, target_points):
+    """Grofste resolutie die nog minstens target_points buckets oplevert."""
+    for name, size in reversed(ROLLUPS):
+        if span_ms / size >= target_points:
+            return name, size
+    return 'raw', None
+
+def get_sensor_history(unit_index, channel, start_ms=None, end_ms=None, target_points=None):
+    """
+    Tijdreeks voor grafieken, automatisch uit de grofste rollup die nog
+    genoeg punten geeft. Retourneert een kolom-dict:
+      {'resolution': 'raw'|'1m'|'1h'|'1d',
+       'ts': [...ms], 'value': [...], 'min': [...], 'max': [...]}
+    Voor 'raw' zijn min en max gelijk aan value.
+    """
+    target_points = target_points or Config.HISTORY_TARGET_POINTS
+    if end_ms is None:
+        end_ms = to_epoch_ms(datetime.utcnow())
+    if start_ms is None:
+        row = fetchone(Config.SENSOR_DB_FILE, '''
+            SELECT min(ts) FROM sensor_samples WHERE unit_index = ? AND channel = ?
+        ''', (unit_index, channel))
+        start_ms = row[0] if row and row[0] is not None else end_ms
+
+    resolution, size = _choose_resolution(end_ms - start_ms, target_points)
+    if size is None:
+        rows = get_sensor_series(unit_index, channel, start_ms, end_ms)
+        values = [r[1] for r in rows]
+        return {
+            'resolution': 'raw',
+            'ts':    [r[0] for r in rows],
+            'value': values,
+            'min':   values,
+            'max':   values,
+        }
+    rows = fetchall(Config.SENSOR_DB_FILE, f'''
+        SELECT bucket, vsum / n, vmin, vmax FROM sensor_rollup_{resolution}
+        WHERE unit_index = ? AND channel = ? AND bucket BETWEEN ? AND ?
+        ORDER BY bucket ASC
+    ''', (unit_index, channel, start_ms - start_ms % size, end_ms))
+    return {
+        'resolution': resolution,
+        'ts':    [r[0] for r in rows],
+        'value': [r[1] for r in rows],
+        'min':   [r[2] for r in rows],
+        'max':   [r[3] for r in rows],
+    }
+
+def get_latest_ts(unit_index, channel, until_ms=None):
+    """Laatste opgeslagen ts (ms) voor een kanaal, optioneel t/m until_ms, of None."""
+    row = fetchone(Config.SENSOR_DB_FILE, '''
+        SELECT max(ts) FROM sensor_samples
+        WHERE unit_index = ? AND channel = ? AND ts <= ?
+    ''', (unit_index, channel, until_ms if until_ms is not None else 2**62))
+    return row[0] if row else None
 
 def get_sensor_readings(unit_index, channel, start=None, end=None):
     """
@@ -46,35 +218,20 @@ def get_sensor_readings(unit_index, channel, start=None, end=None):
       - end:         optionele ISO timestamp string
     Retourneert lijst dicts gesorteerd op timestamp ASC.
     """
-    conn = sqlite3.connect(Config.SENSOR_DB_FILE)
-    c = conn.cursor()
-
-    query = 'SELECT timestamp, unit_index, channel, raw, value, unit FROM sensor_data'
-    clauses = []
-    params = []
-
-    clauses.append('unit_index = ?'); params.append(unit_index)
-    clauses.append('channel    = ?'); params.append(channel)
-    if start:
-        clauses.append('timestamp >= ?'); params.append(start)
-    if end:
-        clauses.append('timestamp <= ?'); params.append(end)
-
-    query += ' WHERE ' + ' AND '.join(clauses)
-    query += ' ORDER BY timestamp ASC'
-
-    c.execute(query, params)
-    rows = c.fetchall()
-    conn.close()
-
+    rows = get_sensor_series(
+        unit_index, channel,
+        to_epoch_ms(start) if start else None,
+        to_epoch_ms(end) if end else None
+    )
+    unit_str = get_calibration(unit_index, channel).get('unit', '')
     return [
         {
-            'timestamp': ts,
-            'unit_index': ui,
-            'channel': ch,
+            'timestamp': from_epoch_ms(ts).isoformat(),
+            'unit_index': unit_index,
+            'channel': channel,
             'raw': raw,
             'value': val,
-            'unit': u
+            'unit': unit_str
         }
-        for ts, ui, ch, raw, val, u in rows
+        for ts, val, raw in rows
     ]
@@ -1,58 +1,288 @@
 import time
 import threading
-from collections import defaultdict
+from collections import defaultdict, deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from obelix.config import Config
-from obelix.database import get_calibration
-from obelix.sensor_database import save_sensor_reading
-from obelix.modbus_client import get_clients, modbus_lock, modbus_initialized
+from obelix.database import get_calibration, get_relay_state, save_relay_state
+from obelix.sensor_database import save_sensor_readings
+from obelix import modbus_client
+from obelix.modbus_client import (
+    get_clients, modbus_initialized, read_input_registers,
+    read_holding_registers, read_coils, poll_due, get_slave_health,
+    units_by_bus, get_bus_metrics
+)
+from obelix.process_image import process_image, UNCERTAIN
+from obelix.metrics import scan_cycle_seconds, scan_overruns_total
+from obelix.sensor_publisher import sensor_publisher
 from obelix.utils import log
 
+ANALOG_CHANNELS = 4
+
+# Socket.IO-room in /sensors voor clients die scan-/bus-statistiek tonen
+DIAGNOSTICS_ROOM = 'diagnostics'
+
+# Duur van de laatste scan-cycli (ms), voor monitoring
+scan_stats = {
+    'cycles':        0,
+    'last_cycle_ms': 0.0,
+    'max_cycle_ms':  0.0,
+    'avg_cycle_ms':  0.0,
+    'overruns':      0,
+    'bus_cycle_ms':  {},  # scanduur per bus; de cyclus duurt zo lang als de traagste
+}
+
+# Doorvoer van de history-writer
+storage_stats = {
+    'flushes':      0,
+    'rows_total':   0,
+    'last_rows':    0,
+    'last_flush_ms': 0.0,
+    'rows_per_sec': 0.0,
+    'failures':     0,   # mislukte flush-pogingen
+    'pending':      0,   # batches die op een nieuwe poging wachten
+    'dropped':      0,   # batches opgegeven na STORAGE_RETRY_MAX
+}
+
+class SampleBuffer:
+    """
+    Thread-safe buffer met samples per (unit_index, channel). drain() wisselt
+    de buffer atomair om, zodat samples die tijdens een flush binnenkomen
+    in de volgende batch belanden in plaats van verloren te gaan.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = defaultdict(list)
+
+    def append(self, key, value):
+        with self._lock:
+            self._data[key].append(value)
+
+    def drain(self):
+        with self._lock:
+            data, self._data = self._data, defaultdict(list)
+        return data
+
+# Callbacks fn(elapsed_s) per scan-cyclus, bijv. voor de benchmark
+scan_time_hooks = []
+
+def _record_scan_time(elapsed):
+    for hook in scan_time_hooks:
+        hook(elapsed)
+    ms = elapsed * 1000.0
+    scan_stats['cycles'] += 1
+    scan_stats['last_cycle_ms'] = round(ms, 1)
+    scan_stats['max_cycle_ms'] = round(max(scan_stats['max_cycle_ms'], ms), 1)
+    # Exponentieel voortschrijdend gemiddelde
+    prev = scan_stats['avg_cycle_ms'] or ms
+    scan_stats['avg_cycle_ms'] = round(prev * 0.9 + ms * 0.1, 1)
+    scan_cycle_seconds.observe(elapsed)
+    if elapsed > Config.LIVE_POLL_INTERVAL:
+        scan_stats['overruns'] += 1
+        scan_overruns_total.inc()
+        log(f"⚠ Scan-cyclus duurde {ms:.0f} ms (> {Config.LIVE_POLL_INTERVAL}s interval)",
+            key='scan_overrun')
+
+def scan_stats_payload():
+    """scan_stats met opslag- en busmetrics, voor de diagnostiek-room."""
+    return dict(scan_stats, storage=storage_stats, bus=get_bus_metrics())
+
+def _unit_indices(units):
+    return range(len(Config.UNITS)) if units is None else units
+
+def scan_analog_units(clients, buffer, units=None):
+    """
+    Lees alle analoge units (of alleen de indices in units) met één block
+    read per unit, kalibreer en buffer de waarden. Retourneert de lijst
+    voor de live-update.
+    """
+    data = []
+    for i in _unit_indices(units):
+        unit = Config.UNITS[i]
+        if unit['type'] != 'analog' or i >= len(clients):
+            continue
+        if not poll_due(i):
+            continue  # slave in backoff, niet op de bus wachten
+        try:
+            raws = read_input_registers(i, ANALOG_CHANNELS)
+        except Exception as e:
+            log(f"⚠ Error reading {unit['name']}: {e}")
+            process_image.mark_bad([('ai', i, ch) for ch in range(ANALOG_CHANNELS)])
+            continue
+        process_image.set_many((('ai', i, ch), raw) for ch, raw in enumerate(raws) if raw is not None)
+        process_image.mark_bad([('ai', i, ch) for ch, raw in enumerate(raws) if raw is None])
+        for ch, raw in enumerate(raws):
+            if raw is None:
+                continue
+            cal = get_calibration(i, ch)
+            val = raw * cal['scale'] + cal['offset']
+            buffer.append((i, ch), val)
+            data.append({
+                'unit_index': i,
+                'name': unit['name'],
+                'slave_id': unit['slave_id'],
+                'channel': ch,
+                'raw': raw,
+                'value': round(val, 2),
+                'unit': cal.get('unit','')
+            })
+    return data
+
+def scan_relay_units(clients, units=None):
+    """
+    Lees de coils van alle relay-units in het procesbeeld. In Dummy-modus
+    komt de toestand uit settings.db (kwaliteit UNCERTAIN).
+    """
+    for i in _unit_indices(units):
+        unit = Config.UNITS[i]
+        if unit['type'] != 'relay' or i >= len(clients):
+            continue
+        keys = [('coil', i, coil) for coil in range(8)]
+        if modbus_client.fallback_mode:
+            process_image.set_many(
+                zip(keys, (get_relay_state(i, coil) == 'ON' for coil in range(8))),
+                quality=UNCERTAIN
+            )
+            continue
+        if not poll_due(i):
+            continue
+        try:
+            # read_coils werkt het procesbeeld binnen de bustransactie bij
+            read_coils(i)
+        except Exception as e:
+            log(f"⚠ Error reading {unit['name']}: {e}")
+            continue
+        # settings.db bijhouden met de werkelijke toestand (write-behind,
+        # goedkoop). Uit het procesbeeld en niet uit de leeswaarde: een
+        # write_coils die intussen is uitgevoerd, is nieuwer.
+        for coil, key in enumerate(keys):
+            if not process_image.is_good(key):
+                continue
+            state_str = 'ON' if process_image.value(key) else 'OFF'
+            if get_relay_state(i, coil) != state_str:
+                save_relay_state(i, coil, state_str)
+
+def scan_aio_units(clients, units=None):
+    """Lees de analoge uitgangen (holding-registers) in het procesbeeld."""
+    for i in _unit_indices(units):
+        unit = Config.UNITS[i]
+        if unit['type'] != 'aio' or i >= len(clients) or not poll_due(i):
+            continue
+        try:
+            raws = read_holding_registers(i, ANALOG_CHANNELS)
+        except Exception as e:
+            log(f"⚠ Error reading {unit['name']}: {e}")
+            process_image.mark_bad([('ao', i, ch) for ch in range(ANALOG_CHANNELS)])
+            continue
+        process_image.set_many((('ao', i, ch), raw) for ch, raw in enumerate(raws) if raw is not None)
+
+def scan_bus(clients, buffer, units):
+    """Scan alle units op één bus; retourneert (analoge data, duur in s)."""
+    t0 = time.monotonic()
+    data = scan_analog_units(clients, buffer, units)
+    scan_relay_units(clients, units)
+    scan_aio_units(clients, units)
+    return data, time.monotonic() - t0
+
+def scan_all(clients, buffer, executor=None):
+    """
+    Scan alle bussen. Met meerdere bussen en een executor loopt elke bus in
+    een eigen thread, zodat de cyclus zo lang duurt als de traagste bus.
+    """
+    groups = units_by_bus()
+    if executor is None or len(groups) == 1:
+        results = [scan_bus(clients, buffer, units) for units in groups.values()]
+    else:
+        futures = [executor.submit(scan_bus, clients, buffer, units) for units in groups.values()]
+        results = [f.result() for f in futures]
+    scan_stats['bus_cycle_ms'] = {
+        name: round(dt * 1000.0, 1) for name, (_, dt) in zip(groups, results)
+    }
+    data = [row for rows, _ in results for row in rows]
+    data.sort(key=lambda row: (row['unit_index'], row['channel']))
+    return data
+
 def start_sensor_monitor(socketio):
     modbus_initialized.wait()
     log(f"Sensor_monitor gestart: live={Config.LIVE_POLL_INTERVAL}s, store={Config.STORAGE_INTERVAL}s")
 
-    buffer = defaultdict(list)
+    buffer = SampleBuffer()
     stop_event = threading.Event()
 
     def storage_worker():
+        # Batches (ts, readings, extremes) die nog weggeschreven moeten worden.
+        # Een mislukte flush (bijv. "database is locked") blijft met zijn
+        # eigen timestamp staan en wordt bij de volgende tick opnieuw geprobeerd.
+        pending = deque()
         while not stop_event.is_set():
             time.sleep(Config.STORAGE_INTERVAL)
-            for (i, ch), vals in list(buffer.items()):
-                if vals:
-                    avg = sum(vals) / len(vals)
-                    save_sensor_reading(i, ch, None, avg, '')
-            buffer.clear()
-            log("✓ Sensor data opgeslagen (gepoold gemiddelde)")
+            batch = buffer.drain()
+            readings = [
+                (i, ch, None, sum(vals) / len(vals), '')
+                for (i, ch), vals in batch.items() if vals
+            ]
+            extremes = {key: (min(vals), max(vals)) for key, vals in batch.items() if vals}
+            if readings:
+                pending.append((datetime.utcnow(), readings, extremes))
+            while len(pending) > Config.STORAGE_RETRY_MAX:
+                pending.popleft()
+                storage_stats['dropped'] += 1
+            n = 0
+            t0 = time.perf_counter()
+            try:
+                while pending:
+                    ts, readings, extremes = pending[0]
+                    n += save_sensor_readings(readings, ts=ts, extremes=extremes)
+                    pending.popleft()
+            except Exception as e:
+                storage_stats['failures'] += 1
+                log(f"⚠ Sensor data opslaan mislukt, {len(pending)} batch(es) wachten: {e}",
+                    key='storage_failed')
+            storage_stats['pending'] = len(pending)
+            if not n:
+                continue
+            dt = time.perf_counter() - t0
+            storage_stats['flushes'] += 1
+            storage_stats['rows_total'] += n
+            storage_stats['last_rows'] = n
+            storage_stats['last_flush_ms'] = round(dt * 1000.0, 1)
+            storage_stats['rows_per_sec'] = round(n / dt, 1) if dt > 0 else 0.0
+            log(f"✓ Sensor data opgeslagen: {n} rijen in {dt * 1000.0:.1f} ms "
+                f"({storage_stats['rows_per_sec']:.0f} rijen/s)")
 
     threading.Thread(target=storage_worker, daemon=True).start()
+    executor = ThreadPoolExecutor(max_workers=len(Config.BUSES), thread_name_prefix='scan')
 
+    last_health = None
+    last_overruns = 0
+    next_stats = 0.0
     while True:
-        start = time.time()
+        start = time.monotonic()
         data = []
         clients = get_clients()
         if not clients:
             log("⚠ Geen Modbus-clients, overslaan live-update")
         else:
-            for i, unit in enumerate(Config.UNITS):
-                if unit['type']=='analog' and i < len(clients):
-                    inst = clients[i]
-                    for ch in range(4):
-                        try:
-                            with modbus_lock:
-                                raw = inst.read_register(ch, functioncode=4)
-                            cal = get_calibration(i, ch)
-                            val = raw * cal['scale'] + cal['offset']
-                            buffer[(i, ch)].append(val)
-                            data.append({
-                                'name': unit['name'],
-                                'slave_id': unit['slave_id'],
-                                'channel': ch,
-                                'raw': raw,
-                                'value': round(val, 2),
-                                'unit': cal.get('unit','')
-                            })
-                        except Exception as e:
-                            log(f"⚠ Error reading {unit['name']} ch{ch}: {e}")
-        socketio.emit('sensor_update', data, namespace='/sensors')
-        elapsed = time.time() - start
+            # Eén scan-engine voor het hele procesbeeld; andere subsystemen
+            # lezen daaruit in plaats van zelf de bus op te gaan
+            data = scan_all(clients, buffer, executor)
+        elapsed = time.monotonic() - start
+        _record_scan_time(elapsed)
+        meta_changes, delta = sensor_publisher.update(data)
+        if meta_changes:
+            socketio.emit('sensor_meta', meta_changes, namespace='/sensors')
+        if delta:
+            socketio.emit('sensor_delta', delta, namespace='/sensors')
+        # Statistiek alleen naar clients die erom vragen, en niet elke tick
+        if start >= next_stats or scan_stats['overruns'] != last_overruns:
+            socketio.emit('scan_stats', scan_stats_payload(),
+                          namespace='/sensors', to=DIAGNOSTICS_ROOM)
+            last_overruns = scan_stats['overruns']
+            next_stats = start + Config.SCAN_STATS_INTERVAL
+        health = get_slave_health()
+        # last_ok verandert bij elke geslaagde poll; alleen echte wijzigingen sturen
+        health_key = [{k: v for k, v in h.items() if k != 'last_ok'} for h in health]
+        if health_key != last_health:
+            socketio.emit('bus_health', health, namespace='/sensors')
+            last_health = health_key
         time.sleep(max(0, Config.LIVE_POLL_INTERVAL - elapsed))
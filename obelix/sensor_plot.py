@@ -1,28 +1,50 @@
-import datetime
 import matplotlib
 matplotlib.use('Agg')  # geen GUI
 import matplotlib.pyplot as plt
-from obelix.sensor_database import get_sensor_readings
+import numpy as np
+from io import BytesIO
+from obelix.config import Config
+from obelix.downsample import downsample_history
+from obelix.sensor_database import get_sensor_history, to_epoch_ms
 
-def plot_sensor_history(unit_index, channel, start=None, end=None, limit=None):
+def plot_sensor_history(unit_index, channel, start=None, end=None, limit=None, max_points=None):
     """
     Genereer een matplotlib Figure met tijdreeks:
       - unit_index: int
       - channel:     int
       - start/end:   optioneel ISO-strings
       - limit:       niet meer gebruikt
+      - max_points:  max. aantal punten na LTTB-downsampling
+    Lange vensters komen uit de rollup-tabellen (gemiddelde + min/max-band).
     """
-    data = get_sensor_readings(unit_index, channel, start=start, end=end)
-    if not data:
+    data = get_sensor_history(
+        unit_index, channel,
+        start_ms=to_epoch_ms(start) if start else None,
+        end_ms=to_epoch_ms(end) if end else None
+    )
+    if not data['ts']:
         raise ValueError("Geen sensordata gevonden voor deze filters.")
 
-    times  = [datetime.datetime.fromisoformat(d['timestamp']) for d in data]
-    values = [d['value'] for d in data]
+    data = downsample_history(data, max_points or Config.PLOT_MAX_POINTS)
+    times = np.asarray(data['ts'], dtype='datetime64[ms]')
 
     fig, ax = plt.subplots()
-    ax.plot(times, values)
+    if data['resolution'] != 'raw' or 'downsampled_from' in data:
+        # Min/max-band zodat pieken binnen een bucket zichtbaar blijven
+        ax.fill_between(times, data['min'], data['max'], alpha=0.3, linewidth=0)
+    ax.plot(times, data['value'])
     ax.set_title(f"Sensorunit {unit_index} Kanaal {channel} geschiedenis")
     ax.set_xlabel("Tijd")
     ax.set_ylabel("Gecalibreerde waarde")
     fig.autofmt_xdate()
     return fig
+
+def render_sensor_plot_png(unit_index, channel, start=None, end=None, max_points=None):
+    """Render de plot naar PNG-bytes en sluit de figure direct weer."""
+    fig = plot_sensor_history(unit_index, channel, start=start, end=end, max_points=max_points)
+    try:
+        buf = BytesIO()
+        fig.savefig(buf, bbox_inches='tight')
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
@@ -0,0 +1,71 @@
+# obelix/sensor_publisher.py
+"""
+Publicatielaag voor live sensorwaarden op /sensors. Nieuwe clients krijgen
+één snapshot (metadata + waarden); daarna gaan alleen kanalen over de
+lijn waarvan de waarde meer dan de deadband van dat kanaal is verschoven.
+Statische metadata (naam, slave, eenheid) wordt alleen bij wijziging
+opnieuw verstuurd.
+"""
+
+from threading import Lock
+from obelix.config import Config
+
+def channel_key(unit_index, channel):
+    return f"{unit_index}-{channel}"
+
+def deadband(unit_index, channel):
+    return Config.SENSOR_DEADBANDS.get((unit_index, channel), Config.SENSOR_DEFAULT_DEADBAND)
+
+class SensorPublisher:
+    def __init__(self):
+        self._lock = Lock()
+        self._meta = {}       # key -> {'name', 'slave_id', 'channel', 'unit'}
+        self._values = {}     # key -> [raw, value] (laatst gelezen)
+        self._published = {}  # key -> value zoals laatst verstuurd
+        self.stats = {'updates': 0, 'deltas_sent': 0, 'channels_sent': 0, 'channels_suppressed': 0}
+
+    def update(self, readings):
+        """
+        Verwerk de lezingen van één scan-cyclus.
+        Retourneert (meta_changes, delta): beide dicts key -> ..., leeg als
+        er niets te versturen is.
+        """
+        meta_changes = {}
+        delta = {}
+        with self._lock:
+            self.stats['updates'] += 1
+            for r in readings:
+                key = channel_key(r['unit_index'], r['channel'])
+                meta = {
+                    'name':     r['name'],
+                    'slave_id': r['slave_id'],
+                    'channel':  r['channel'],
+                    'unit':     r['unit'],
+                }
+                if self._meta.get(key) != meta:
+                    self._meta[key] = meta
+                    meta_changes[key] = meta
+
+                value = r['value']
+                self._values[key] = [r['raw'], value]
+                last = self._published.get(key)
+                if (last is None or key in meta_changes or
+                        abs(value - last) > deadband(r['unit_index'], r['channel'])):
+                    self._published[key] = value
+                    delta[key] = [r['raw'], value]
+                else:
+                    self.stats['channels_suppressed'] += 1
+            if delta:
+                self.stats['deltas_sent'] += 1
+                self.stats['channels_sent'] += len(delta)
+        return meta_changes, delta
+
+    def snapshot(self):
+        """Volledige toestand voor een nieuw verbonden client."""
+        with self._lock:
+            return {
+                'meta':   dict(self._meta),
+                'values': {k: list(v) for k, v in self._values.items()},
+            }
+
+sensor_publisher = SensorPublisher()
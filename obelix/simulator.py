@@ -0,0 +1,204 @@
+# obelix/simulator.py
+"""
+Simulator-backend voor Modbus RTU: dezelfde client-interface als
+minimalmodbus.Instrument (read_bit(s), write_bit(s), read_register(s),
+write_register), maar tegen een plantmodel in het geheugen.
+
+Per transactie wordt de draadtijd gesimuleerd uit baudrate en
+framegrootte (RTU: 3.5 tekens stilte per frame, start/parity/stop-bits per
+teken) plus de antwoordtijd van de slave. Per slave zijn timeouts,
+CRC-fouten, uitval-vensters en ontbrekende functiecodes in te stellen
+(Config.SIM_SLAVES), zodat timingproblemen uit productie zonder hardware
+na te bootsen zijn.
+
+Het reactormodel (Config.SIM_REACTOR): het niveau stijgt zolang de
+influentpomp aan staat en daalt met de effluentpomp; zuurstof (DO) volgt
+het compressortoerental.
+
+Activeren met Config.MODBUS_BACKEND = 'simulator'.
+"""
+
+import math
+import random
+import threading
+import time
+import minimalmodbus
+from obelix.config import Config
+
+N_COILS     = 16
+N_REGISTERS = 16
+
+def _char_time(settings):
+    """Duur van één teken op de draad (s)."""
+    bits = 1 + settings['bytesize'] + (settings['parity'] != 'N') + settings['stopbits']
+    return bits / settings['baudrate']
+
+def wire_time(request_bytes, response_bytes, settings):
+    """Draadtijd van één RTU-transactie, inclusief 2 x 3.5 tekens frame-stilte."""
+    return (request_bytes + response_bytes + 7) * _char_time(settings) + Config.SIM_TURNAROUND
+
+class Reactor:
+    """Eenvoudig R302-model, lui geïntegreerd bij elke sensor-read."""
+    def __init__(self, plant):
+        self.plant = plant
+        cfg = Config.SIM_REACTOR
+        self.cfg   = cfg
+        self.level = cfg['level_init']
+        self.do    = cfg['do_init']
+        self.t     = time.monotonic()
+
+    def _coil(self, coil):
+        return self.plant.coils[self.cfg['relay_slave']][coil]
+
+    def _speed(self, channel):
+        """Compressortoerental 0..1 uit de AIO-uitgang (4-20 mA)."""
+        raw = self.plant.holding[self.cfg['aio_slave']][channel]
+        mA = raw / 4095 * 20.0
+        return min(1.0, max(0.0, (mA - 4.0) / 16.0))
+
+    def step(self):
+        now = time.monotonic()
+        dt, self.t = now - self.t, now
+        cfg = self.cfg
+        flow = cfg['inflow'] * self._coil(cfg['influent_coil']) \
+            - cfg['outflow'] * self._coil(cfg['effluent_coil'])
+        self.level = min(100.0, max(0.0, self.level + flow * dt))
+
+        aeration = sum(
+            self._speed(ch) for coil, ch in cfg['compressors'] if self._coil(coil)
+        )
+        # Eerste orde naar verzadiging, minus zuurstofverbruik
+        d_do = cfg['kla'] * aeration * (cfg['do_sat'] - self.do) - cfg['our']
+        self.do = min(cfg['do_sat'], max(0.0, self.do + d_do * dt))
+
+    def values(self):
+        """Fysische waarden per sensorkanaal (zie Config.R302_SENSOR_MAPPING)."""
+        self.step()
+        t = time.monotonic()
+        return [
+            self.level,
+            7.2 + 0.1 * math.sin(t / 300.0),
+            20.0 + 0.5 * math.sin(t / 1800.0),
+            self.do,
+        ]
+
+class Plant:
+    """Registers van alle gesimuleerde slaves plus het reactormodel."""
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.coils   = {}
+        self.holding = {}
+        self.rng     = random.Random(Config.SIM_SEED)
+        self.reactor = Reactor(self)
+
+    def ensure(self, slave_id):
+        self.coils.setdefault(slave_id, [False] * N_COILS)
+        self.holding.setdefault(slave_id, [0] * N_REGISTERS)
+
+    def input_registers(self, slave_id):
+        """Ruwe 4-20 mA-waarden (0..4095 over 0..20 mA) van een analoge slave."""
+        if slave_id == Config.SIM_REACTOR['sensor_slave']:
+            ranges = Config.SIM_REACTOR['sensor_ranges']
+            phys = self.reactor.values()
+        else:
+            ranges = [(0.0, 100.0)] * 4
+            phys = [50.0 + 10.0 * math.sin(time.monotonic() / 60.0 + ch) for ch in range(4)]
+        raws = []
+        for (lo, hi), value in zip(ranges, phys):
+            frac = min(1.0, max(0.0, (value - lo) / (hi - lo)))
+            noise = self.rng.gauss(0.0, Config.SIM_NOISE)
+            raws.append(int(min(4095, max(0, (4.0 + 16.0 * frac) / 20.0 * 4095 + noise))))
+        return raws + [0] * (N_REGISTERS - len(raws))
+
+plant = Plant()
+
+class _SerialSettings:
+    """Stand-in voor inst.serial: alleen de timeout wordt gebruikt (probes)."""
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+class SimulatedModbusClient:
+    def __init__(self, slave_id, settings):
+        self.slave_id = slave_id
+        self.settings = settings
+        self.serial   = _SerialSettings(settings['timeout'])
+        self.profile  = dict(Config.SIM_DEFAULT_SLAVE, **Config.SIM_SLAVES.get(slave_id, {}))
+        self.rng      = random.Random(None if Config.SIM_SEED is None else Config.SIM_SEED + slave_id)
+        # Fase van het uitvalvenster per slave spreiden
+        self._dropout_phase = self.rng.uniform(0, self.profile['dropout_every'] or 1)
+        self.stats = {'transactions': 0, 'timeouts': 0, 'crc_errors': 0, 'wire_s': 0.0}
+        plant.ensure(slave_id)
+
+    def _offline(self):
+        every, duration = self.profile['dropout_every'], self.profile['dropout_duration']
+        if not every or not duration:
+            return False
+        return (time.monotonic() + self._dropout_phase) % every < duration
+
+    def _transact(self, functioncode, request_bytes, response_bytes):
+        """Simuleer de draadtijd en eventuele fouten van één transactie."""
+        self.stats['transactions'] += 1
+        char = _char_time(self.settings)
+        if functioncode in self.profile['unsupported']:
+            # Exception-antwoord (5 bytes) met "illegal function"
+            time.sleep(wire_time(request_bytes, 5, self.settings))
+            raise minimalmodbus.IllegalRequestError(
+                f"Slave reported illegal function (simulator, FC{functioncode})")
+        if self._offline() or self.rng.random() < self.profile['timeout_rate']:
+            self.stats['timeouts'] += 1
+            time.sleep((request_bytes + 3.5) * char + self.serial.timeout)
+            raise minimalmodbus.NoResponseError("No communication with the instrument (no answer)")
+        duration = wire_time(request_bytes, response_bytes, self.settings)
+        self.stats['wire_s'] += duration
+        time.sleep(duration)
+        if self.rng.random() < self.profile['error_rate']:
+            self.stats['crc_errors'] += 1
+            raise minimalmodbus.InvalidResponseError("CRC does not match (simulator)")
+
+    # --- Coils ---
+    def read_bits(self, coil, count, functioncode=1):
+        self._transact(functioncode, 8, 5 + math.ceil(count / 8))
+        with plant.lock:
+            return [int(b) for b in plant.coils[self.slave_id][coil:coil + count]]
+
+    def read_bit(self, coil, functioncode=1):
+        return self.read_bits(coil, 1, functioncode)[0]
+
+    def write_bit(self, coil, state, functioncode=5):
+        self._transact(functioncode, 8, 8)
+        with plant.lock:
+            plant.coils[self.slave_id][coil] = bool(state)
+
+    def write_bits(self, coil, values):
+        self._transact(15, 9 + math.ceil(len(values) / 8), 8)
+        with plant.lock:
+            plant.coils[self.slave_id][coil:coil + len(values)] = [bool(v) for v in values]
+
+    # --- Registers ---
+    def read_registers(self, reg, count, functioncode=3):
+        self._transact(functioncode, 8, 5 + 2 * count)
+        with plant.lock:
+            if functioncode == 4:
+                values = plant.input_registers(self.slave_id)
+            else:
+                values = plant.holding[self.slave_id]
+            return list(values[reg:reg + count])
+
+    def read_register(self, reg, functioncode=3):
+        return self.read_registers(reg, 1, functioncode)[0]
+
+    def write_register(self, reg, value, functioncode=16):
+        self._transact(functioncode, 8 if functioncode == 6 else 11, 8)
+        with plant.lock:
+            plant.holding[self.slave_id][reg] = int(value)
+
+def create_client(slave_id, settings):
+    """Client voor init_modbus; settings zoals modbus_client._serial_settings."""
+    return SimulatedModbusClient(slave_id, settings)
+
+def get_simulator_stats():
+    """Reactortoestand, voor debugging en benchmarks."""
+    with plant.lock:
+        reactor = plant.reactor
+        reactor.step()
+        return {'level': round(reactor.level, 2), 'do': round(reactor.do, 2)}
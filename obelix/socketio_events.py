@@ -1,6 +1,6 @@
 # obelix/socketio_events.py
 
-from flask_socketio import emit
+from flask_socketio import emit, join_room
 from obelix.config import Config
 from obelix.database import (
     get_calibration, save_calibration,
@@ -9,47 +9,49 @@ from obelix.database import (
     get_setting, set_setting, get_all_calibrations
 )
 from obelix.modbus_client import (
-    get_clients, fallback_mode, read_relay_states, modbus_lock
+    relay_states_from_image, write_coils, write_holding_register,
+    get_slave_health, BusRequestSuperseded
 )
-from obelix.utils import log
+from obelix.process_image import process_image
+from obelix.metrics import instrument_socketio
+from obelix.utils import log, attach_socketio, recent_logs
+from obelix.sensor_publisher import sensor_publisher
 from obelix.r302_manager import R302Controller
 from obelix import auto_control
+from obelix.sbr_recipe import compile_recipe
+from obelix.sensor_monitor import DIAGNOSTICS_ROOM, scan_stats_payload
 
 r302_ctrl = R302Controller(unit_index=0)
 
 def init_socketio(socketio):
+    instrument_socketio(socketio)
+    attach_socketio(socketio)
+
+    # ----- Logs namespace -----
+    @socketio.on('connect', namespace='/logs')
+    def ws_logs_connect(auth):
+        emit('log_init', recent_logs(), namespace='/logs')
+
     # ----- Relays namespace -----
     @socketio.on('connect', namespace='/relays')
     def ws_relays_connect(auth):
         log("SocketIO: /relays connected")
         out = []
-        clients = get_clients()
         for i, unit in enumerate(Config.UNITS):
             if unit['type'] == 'relay':
-                try:
-                    states = read_relay_states(i)
-                    for coil, actual in enumerate(states):
-                        if not fallback_mode:
-                            saved = get_relay_state(i, coil)
-                            state_str = 'ON' if actual else 'OFF'
-                            if saved != state_str:
-                                save_relay_state(i, coil, state_str)
-                    item = {'idx': i, 'name': unit['name'], 'states': states}
-                    if i == r302_ctrl.unit:
-                        item['modes'] = [r302_ctrl.get_mode(c) for c in range(len(states))]
-                    out.append(item)
-                except Exception as e:
-                    log(f"Error relays unit {i}: {e}")
-                    out.append({'idx': i, 'name': unit['name'], 'states': [False]*8})
+                # Uit het procesbeeld: geen busverkeer per verbindende browser
+                states = relay_states_from_image(i)
+                item = {'idx': i, 'name': unit['name'], 'states': states}
+                if i == r302_ctrl.unit:
+                    item['modes'] = [r302_ctrl.get_mode(c) for c in range(len(states))]
+                out.append(item)
         emit('init_relays', out, namespace='/relays')
 
     @socketio.on('toggle_relay', namespace='/relays')
     def ws_toggle_relay(msg):
         try:
             idx, coil, want = msg['unit_idx'], msg['coil_idx'], msg['state']
-            inst = get_clients()[idx]
-            with modbus_lock:
-                inst.write_bit(coil, want=='ON', functioncode=5)
+            write_coils(idx, {coil: want=='ON'})
             save_relay_state(idx, coil, want)
             emit('relay_toggled', {'unit_idx': idx, 'coil_idx': coil, 'state': want},
                  namespace='/relays', broadcast=True)
@@ -60,6 +62,13 @@ def init_socketio(socketio):
     @socketio.on('connect', namespace='/sensors')
     def ws_sensors_connect(auth):
         log("SocketIO: /sensors connected")
+        emit('sensor_snapshot', sensor_publisher.snapshot(), namespace='/sensors')
+        emit('bus_health', get_slave_health(), namespace='/sensors')
+
+    @socketio.on('join_diagnostics', namespace='/sensors')
+    def ws_sensors_join_diagnostics(_data=None):
+        join_room(DIAGNOSTICS_ROOM)
+        emit('scan_stats', scan_stats_payload(), namespace='/sensors')
 
     # ----- Calibration namespace -----
     @socketio.on('connect', namespace='/cal')
@@ -92,22 +101,13 @@ def init_socketio(socketio):
     def ws_aio_connect(auth):
         log("SocketIO: /aio connected")
         rows = []
-        inst = get_clients()[Config.AIO_IDX]
         for ch in range(4):
-            try:
-                with modbus_lock:
-                    raw_out = inst.read_register(ch, functioncode=3)
-                phys_out = round((raw_out / 4095) * 20.0, 2)
-                pct = get_aio_setting(ch)
-                rows.append({
-                    'channel': ch, 'raw_out': raw_out,
-                    'phys_out': phys_out, 'percent_out': pct
-                })
-            except Exception as e:
-                rows.append({
-                    'channel': ch, 'raw_out': 0,
-                    'phys_out': 0.0, 'percent_out': get_aio_setting(ch)
-                })
+            raw_out = process_image.value(('ao', Config.AIO_IDX, ch), 0)
+            rows.append({
+                'channel': ch, 'raw_out': raw_out,
+                'phys_out': round((raw_out / 4095) * 20.0, 2),
+                'percent_out': get_aio_setting(ch)
+            })
         emit('aio_init', rows, namespace='/aio')
 
     @socketio.on('aio_set', namespace='/aio')
@@ -116,14 +116,14 @@ def init_socketio(socketio):
             ch, pct = msg['channel'], float(msg['percent'])
             mA = 4.0 + pct/100.0 * 16.0
             raw = int(mA/20.0 * 4095)
-            inst = get_clients()[Config.AIO_IDX]
-            with modbus_lock:
-                inst.write_register(ch, raw, functioncode=6)
+            write_holding_register(Config.AIO_IDX, ch, raw)
             save_aio_setting(ch, pct)
             emit('aio_updated', {
                 'channel': ch, 'raw_out': raw,
                 'phys_out': round(mA,2), 'percent_out': pct
             }, namespace='/aio')
+        except BusRequestSuperseded:
+            pass  # alleen de laatste sliderwaarde gaat de bus op
         except Exception as e:
             emit('aio_error', {'error': str(e)}, namespace='/aio')
 
@@ -148,6 +148,7 @@ def init_socketio(socketio):
             return
         emit('sbr_status', {'active': ctrl.start_event.is_set()}, namespace='/sbr')
         emit('sbr_timer', {'timer': ctrl.timer}, namespace='/sbr')
+        emit('sbr_timing', ctrl.get_timing_stats(), namespace='/sbr')
         ctrl._emit_phase_times()  # direct de opgeslagen tijden
 
     @socketio.on('sbr_control', namespace='/sbr')
@@ -179,6 +180,18 @@ def init_socketio(socketio):
         except Exception as e:
             emit('sbr_error', {'error': str(e)}, namespace='/sbr')
 
+    @socketio.on('sbr_save_recipe', namespace='/sbr')
+    def ws_sbr_save_recipe(msg):
+        ctrl = auto_control.sbr_controller
+        if not ctrl:
+            emit('sbr_error', {'error': 'No SBR controller'}, namespace='/sbr')
+            return
+        try:
+            name = (msg.get('name') or ctrl.recipe.name).strip()
+            ctrl.set_recipe(compile_recipe(name, msg['definition']))
+        except Exception as e:
+            emit('sbr_error', {'error': f'Ongeldig recept: {e}'}, namespace='/sbr')
+
     @socketio.on('sbr_get_phase_times', namespace='/sbr')
     def ws_sbr_get_phase_times():
         """Verzend de laatst opgeslagen fasetijden naar de client."""
@@ -1,12 +1,162 @@
+# obelix/utils.py
+"""
+Logging voor de control-threads.
+
+log() doet aan de aanroeperkant alleen het hoognodige: levelfilter,
+rate-limiting van herhaalde meldingen, een append aan de ringbuffer en
+een put in de schrijfwachtrij. Timestamps formatteren, naar de console
+schrijven en de /logs-stream naar browsers gebeurt in een aparte
+writer-thread, zodat een trage console of journald geen control-thread
+ophoudt.
+
+Herhaalde waarschuwingen en fouten (zelfde tekst), en meldingen met
+dezelfde key=, worden binnen Config.LOG_RATE_WINDOW maar één keer
+doorgelaten; het aantal onderdrukte herhalingen volgt bij de volgende
+doorgelaten melding of aan het eind van het venster. Gewone INFO-meldingen
+zonder key (bedieningshandelingen, fasewissels) gaan altijd door.
+"""
+
+import atexit
+import queue
+import sys
+import threading
 import time
+from collections import deque
 from obelix.config import Config
 
-log_messages = []
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+_LEVELS = {name: lvl for lvl, name in LEVEL_NAMES.items()}
+
+# Bestaande meldingen dragen hun ernst in het eerste teken
+_PREFIX_LEVELS = {'⚠': WARNING, '❌': ERROR}
+
+# Laatste Config.MAX_LOG records (ts, level, msg); deque.append is thread-safe
+log_messages = deque(maxlen=Config.MAX_LOG)
+
+_min_level = _LEVELS.get(Config.LOG_LEVEL, INFO)
+_pending   = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+_limiter   = {}  # key -> [venster-start (monotonic), onderdrukt, level, msg]
+_limit_lock = threading.Lock()
+_write_lock = threading.Lock()
+_socketio  = None
+_writer    = None
+_start_lock = threading.Lock()
+
+log_stats = {'written': 0, 'suppressed': 0, 'dropped': 0}
+
+def log(msg, level=None, key=None):
+    """
+    Log een melding. Zonder level volgt het uit het voorvoegsel (⚠ / ❌),
+    anders INFO. key zet rate-limiting aan en groepeert meldingen met
+    wisselende tekst (bijv. een gemeten duur in de tekst); WARNING en
+    ERROR worden zonder key op hun tekst gegroepeerd.
+    """
+    if level is None:
+        level = _PREFIX_LEVELS.get(msg[:1], INFO)
+    if level < _min_level:
+        return
+    if key is None:
+        if level < WARNING:
+            _enqueue((time.time(), level, msg))
+            return
+        key = msg
+    now = time.monotonic()
+    with _limit_lock:
+        entry = _limiter.get(key)
+        if entry is not None and now - entry[0] < Config.LOG_RATE_WINDOW:
+            entry[1] += 1
+            log_stats['suppressed'] += 1
+            return
+        _limiter[key] = [now, 0, level, msg]
+    if entry is not None and entry[1]:
+        msg = f"{msg} (+{entry[1]}× herhaald)"
+    _enqueue((time.time(), level, msg))
+
+def _enqueue(record):
+    log_messages.append(record)
+    if _writer is None:
+        _start_writer()
+    try:
+        _pending.put_nowait(record)
+    except queue.Full:
+        # Console loopt achter: liever een regel kwijt dan een control-thread die wacht
+        log_stats['dropped'] += 1
+
+def record_dict(record):
+    ts, level, msg = record
+    return {'ts': ts, 'level': LEVEL_NAMES[level], 'msg': msg}
+
+def _format(record):
+    ts, level, msg = record
+    return f"[{time.strftime('%H:%M:%S', time.localtime(ts))}] {msg}"
+
+def _sweep_limiter():
+    """Meld onderdrukte herhalingen van verlopen vensters en ruim ze op."""
+    now = time.monotonic()
+    expired = []
+    with _limit_lock:
+        for key, (start, n, level, msg) in list(_limiter.items()):
+            if now - start >= Config.LOG_RATE_WINDOW:
+                del _limiter[key]
+                if n:
+                    expired.append((time.time(), level, f"↻ {n}× herhaald: {msg}"))
+    for record in expired:
+        _enqueue(record)
+
+def _write(records):
+    with _write_lock:
+        sys.stdout.write(''.join(_format(r) + '\n' for r in records))
+        sys.stdout.flush()
+        log_stats['written'] += len(records)
+    if _socketio is not None:
+        try:
+            _socketio.emit('log_entries', [record_dict(r) for r in records], namespace='/logs')
+        except Exception as e:
+            sys.stderr.write(f"Log-stream mislukt: {e}\n")
+
+def _drain(first=None):
+    records = [] if first is None else [first]
+    while True:
+        try:
+            records.append(_pending.get_nowait())
+        except queue.Empty:
+            return records
+
+def _writer_loop():
+    next_sweep = time.monotonic() + Config.LOG_RATE_WINDOW
+    while True:
+        try:
+            first = _pending.get(timeout=max(0.0, next_sweep - time.monotonic()))
+        except queue.Empty:
+            first = None
+        if time.monotonic() >= next_sweep:
+            _sweep_limiter()
+            next_sweep = time.monotonic() + Config.LOG_RATE_WINDOW
+        records = _drain(first)
+        if records:
+            _write(records)
+
+def _start_writer():
+    global _writer
+    with _start_lock:
+        if _writer is None:
+            th = threading.Thread(target=_writer_loop, name='log-writer', daemon=True)
+            th.start()
+            _writer = th
+
+@atexit.register
+def flush_log():
+    """Schrijf wat nog in de wachtrij staat (bij afsluiten, of vanuit CLI's)."""
+    records = _drain()
+    if records:
+        _write(records)
+
+def attach_socketio(socketio):
+    """Stuur vanaf nu elke batch logregels ook naar namespace /logs."""
+    global _socketio
+    _socketio = socketio
 
-def log(msg):
-    ts = time.strftime('%H:%M:%S')
-    entry = f'[{ts}] {msg}'
-    log_messages.append(entry)
-    if len(log_messages) > Config.MAX_LOG:
-        del log_messages[:-Config.MAX_LOG]
-    print(entry)
\ No newline at end of file
+def recent_logs():
+    """Inhoud van de ringbuffer, oudste eerst, voor de /logs-stream."""
+    return [record_dict(r) for r in list(log_messages)]
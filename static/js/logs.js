@@ -0,0 +1,58 @@
+const socket = io('/logs');
+const tbody  = document.getElementById('logBody');
+const filter = document.getElementById('levelFilter');
+
+// Nieuwste bovenaan; niet meer rijen dan de ringbuffer op de server
+const MAX_ROWS = 500;
+const LEVELS = {DEBUG: 10, INFO: 20, WARNING: 30, ERROR: 40};
+let entries = [];
+
+function visible(e) {
+  return LEVELS[e.level] >= LEVELS[filter.value];
+}
+
+function makeRow(e) {
+  const tr = document.createElement('tr');
+  const ts = new Date(e.ts * 1000).toLocaleTimeString('nl-NL');
+  [ts, e.level, e.msg].forEach(txt => {
+    const td = document.createElement('td');
+    td.textContent = txt;
+    tr.appendChild(td);
+  });
+  if (LEVELS[e.level] >= LEVELS.WARNING) tr.classList.add('feedback', 'error');
+  return tr;
+}
+
+function render() {
+  const shown = entries.filter(visible);
+  tbody.innerHTML = '';
+  if (!shown.length) {
+    tbody.innerHTML = '<tr><td colspan="3" class="no-data">Geen meldingen</td></tr>';
+    return;
+  }
+  shown.slice().reverse().forEach(e => tbody.appendChild(makeRow(e)));
+}
+
+function append(batch) {
+  entries = entries.concat(batch).slice(-MAX_ROWS);
+  const shown = batch.filter(visible);
+  if (!shown.length) return;
+  if (tbody.querySelector('.no-data')) tbody.innerHTML = '';
+  shown.forEach(e => tbody.insertBefore(makeRow(e), tbody.firstChild));
+  while (tbody.children.length > MAX_ROWS) tbody.removeChild(tbody.lastChild);
+}
+
+socket.on('connect', () => console.log('✅ WebSocket verbonden op /logs'));
+
+socket.on('log_init', batch => {
+  entries = batch.slice(-MAX_ROWS);
+  render();
+});
+
+socket.on('log_entries', append);
+
+filter.addEventListener('change', render);
+
+socket.on('disconnect', () => {
+  console.warn('❌ WebSocket verbinding verbroken');
+});
@@ -1,33 +1,101 @@
 const socket = io('/sensors');
 const tbody  = document.getElementById('sensorBody');
 
+// Rijen per kanaal-key ('unit-channel'); metadata komt één keer, waarden als delta
+const rows = {};
+const meta = {};
+
+function renderEmpty(text) {
+  tbody.innerHTML = `<tr><td colspan="6" class="no-data">${text}</td></tr>`;
+  Object.keys(rows).forEach(k => delete rows[k]);
+}
+
+function ensureRow(key) {
+  if (rows[key]) return rows[key];
+  if (!Object.keys(rows).length) tbody.innerHTML = '';
+  const tr = document.createElement('tr');
+  const cells = {};
+  ['name','slave_id','channel','raw','value','unit'].forEach(col => {
+    const td = document.createElement('td');
+    td.textContent = '—';
+    cells[col] = td;
+    tr.appendChild(td);
+  });
+  // Sorteer op unit/kanaal zodat de volgorde stabiel blijft
+  const [u, ch] = key.split('-').map(Number);
+  tr.dataset.order = u * 100 + ch;
+  const next = Array.from(tbody.children).find(r => Number(r.dataset.order) > u * 100 + ch);
+  tbody.insertBefore(tr, next || null);
+  rows[key] = cells;
+  return cells;
+}
+
+function applyMeta(changes) {
+  Object.entries(changes).forEach(([key, m]) => {
+    meta[key] = m;
+    const cells = ensureRow(key);
+    cells.name.textContent     = m.name;
+    cells.slave_id.textContent = m.slave_id;
+    cells.channel.textContent  = m.channel;
+    cells.unit.textContent     = m.unit || '—';
+  });
+}
+
+function applyValues(values) {
+  Object.entries(values).forEach(([key, [raw, value]]) => {
+    const cells = ensureRow(key);
+    cells.raw.textContent   = (raw !== null && raw !== undefined) ? raw : '—';
+    cells.value.textContent = value.toFixed(2);
+  });
+}
+
 socket.on('connect', () => {
   console.log('✅ WebSocket verbonden op /sensors');
-  tbody.innerHTML = '<tr><td colspan="6" class="no-data">Verbonden – wachten op sensor_update…</td></tr>';
+  socket.emit('join_diagnostics');  // scan-/busstatistiek voor de statusregel
+  // Tabel hier niet leegmaken: de server stuurt sensor_snapshot al tijdens
+  // de handshake, dus die kan vóór dit event binnen zijn
 });
 
-socket.on('sensor_update', readings => {
-  console.log('🔔 sensor_update ontvangen:', readings);
-  if (!readings || readings.length === 0) {
-    tbody.innerHTML = '<tr><td colspan="6" class="no-data">Geen sensoren gevonden.</td></tr>';
+socket.on('sensor_snapshot', snap => {
+  if (!snap || !Object.keys(snap.meta).length) {
+    renderEmpty('Wachten op eerste scan…');
     return;
   }
-
   tbody.innerHTML = '';
-  readings.forEach(r => {
+  Object.keys(rows).forEach(k => delete rows[k]);
+  applyMeta(snap.meta);
+  applyValues(snap.values);
+});
+
+socket.on('sensor_meta', applyMeta);
+socket.on('sensor_delta', applyValues);
+
+socket.on('scan_stats', stats => {
+  document.getElementById('scanStats').textContent =
+    `Scan-cyclus: ${stats.last_cycle_ms} ms (gem. ${stats.avg_cycle_ms} ms, max ${stats.max_cycle_ms} ms, overschrijdingen: ${stats.overruns})` +
+    (stats.storage ? ` – opslag: ${stats.storage.last_rows} rijen in ${stats.storage.last_flush_ms} ms` +
+      (stats.storage.pending ? ` (${stats.storage.pending} batch(es) wachten op opslag)` : '') : '') +
+    (stats.bus || []).map(b =>
+      ` – bus ${b.name}: ${Math.round(b.utilization * 100)}% bezet, ${(stats.bus_cycle_ms || {})[b.name] ?? '—'} ms`
+    ).join('');
+});
+
+socket.on('bus_health', units => {
+  const body = document.getElementById('healthBody');
+  body.innerHTML = '';
+  units.forEach(u => {
     const tr = document.createElement('tr');
-    ['name','slave_id','channel','raw','value','unit'].forEach(key => {
+    [u.name, u.slave_id, u.bus, u.state, u.consecutive_failures, u.backoff, u.last_error || '—'].forEach(txt => {
       const td = document.createElement('td');
-      let txt = (r[key] !== null && r[key] !== undefined) ? r[key] : '—';
-      if (key === 'value') txt = r.value.toFixed(2);
       td.textContent = txt;
       tr.appendChild(td);
     });
-    tbody.appendChild(tr);
+    if (u.state !== 'OK') tr.classList.add('feedback', 'error');
+    body.appendChild(tr);
   });
 });
 
 socket.on('disconnect', () => {
   console.warn('❌ WebSocket verbinding verbroken');
-  tbody.innerHTML = '<tr><td colspan="6" class="no-data">Verbinding verbroken.</td></tr>';
+  renderEmpty('Verbinding verbroken.');
 });
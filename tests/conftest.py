@@ -0,0 +1,22 @@
+# tests/conftest.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from obelix.config import Config  # noqa: E402
+
+
+@pytest.fixture
+def tmp_dbs(tmp_path, monkeypatch):
+    """settings.db en sensor_data.db in een tijdelijke map, met schema."""
+    from obelix import db_pool
+    from obelix.database import init_db
+    monkeypatch.setattr(Config, 'DB_FILE', str(tmp_path / 'settings.db'))
+    monkeypatch.setattr(Config, 'SENSOR_DB_FILE', str(tmp_path / 'sensor_data.db'))
+    init_db()
+    yield tmp_path
+    db_pool.close_connection(Config.DB_FILE)
+    db_pool.close_connection(Config.SENSOR_DB_FILE)
@@ -0,0 +1,97 @@
+# tests/test_bus_scheduler.py
+import threading
+import time
+
+import pytest
+
+from obelix.bus_scheduler import (
+    BusScheduler, BusDeadlineExceeded, BusRequestSuperseded,
+    PRIO_CONTROL, PRIO_OPERATOR, PRIO_POLL
+)
+
+
+@pytest.fixture
+def bus():
+    """Scheduler met een geblokkeerde worker: verzoeken blijven wachten tot release()."""
+    sched = BusScheduler('test', threading.Lock(), util_window=1.0)
+    started, gate = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        gate.wait(5)
+
+    blocked = sched.submit(blocker, PRIO_POLL)
+    assert started.wait(5)
+    sched.release = lambda: (gate.set(), blocked.result(5))
+    yield sched
+    gate.set()
+
+
+def _recorder(order, name):
+    def fn():
+        order.append(name)
+        return name
+    return fn
+
+
+def test_superseded_request_raises_and_never_runs(bus):
+    order = []
+    old = bus.submit(_recorder(order, 'old'), PRIO_OPERATOR, key=('ao', 0, 0))
+    new = bus.submit(_recorder(order, 'new'), PRIO_OPERATOR, key=('ao', 0, 0))
+    bus.release()
+
+    with pytest.raises(BusRequestSuperseded):
+        old.result(5)
+    assert new.result(5) == 'new'
+    assert order == ['new']
+    assert bus.metrics['coalesced'] == 1
+
+
+def test_control_runs_ahead_of_poll(bus):
+    order = []
+    futures = [
+        bus.submit(_recorder(order, 'poll-1'), PRIO_POLL),
+        bus.submit(_recorder(order, 'operator'), PRIO_OPERATOR),
+        bus.submit(_recorder(order, 'poll-2'), PRIO_POLL),
+        bus.submit(_recorder(order, 'control'), PRIO_CONTROL),
+    ]
+    bus.release()
+    for f in futures:
+        f.result(5)
+    assert order == ['control', 'operator', 'poll-1', 'poll-2']
+
+
+def test_coalesced_request_inherits_priority(bus):
+    order = []
+    bus.submit(_recorder(order, 'stale'), PRIO_CONTROL, key='k')
+    other = bus.submit(_recorder(order, 'operator'), PRIO_OPERATOR)
+    newer = bus.submit(_recorder(order, 'newer'), PRIO_POLL, key='k')
+    bus.release()
+    newer.result(5)
+    other.result(5)
+    assert order == ['newer', 'operator']
+
+
+def test_expired_deadline_raises(bus):
+    order = []
+    late = bus.submit(_recorder(order, 'late'), PRIO_POLL, deadline=time.monotonic() + 0.01)
+    ok = bus.submit(_recorder(order, 'ok'), PRIO_POLL, deadline=time.monotonic() + 30)
+    time.sleep(0.05)
+    bus.release()
+
+    with pytest.raises(BusDeadlineExceeded):
+        late.result(5)
+    assert ok.result(5) == 'ok'
+    assert order == ['ok']
+    assert bus.metrics['deadline_misses'] == 1
+
+
+def test_exception_from_fn_reaches_caller():
+    sched = BusScheduler('test', threading.Lock())
+
+    def fail():
+        raise IOError('geen antwoord')
+
+    with pytest.raises(IOError):
+        sched.call(fail, PRIO_OPERATOR, timeout=5)
+    assert sched.metrics['errors'] == 1
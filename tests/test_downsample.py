@@ -0,0 +1,61 @@
+# tests/test_downsample.py
+import numpy as np
+import pytest
+
+from obelix.downsample import lttb_indices, downsample_history
+
+
+def _history(values):
+    values = list(values)
+    return {
+        'ts':    list(range(0, 1000 * len(values), 1000)),
+        'value': values,
+        'min':   values,
+        'max':   values,
+    }
+
+
+@pytest.mark.parametrize('n, n_out', [(10, 3), (100, 7), (1000, 50), (1001, 1000)])
+def test_lttb_keeps_first_and_last(n, n_out):
+    rng = np.random.default_rng(1)
+    idx = lttb_indices(np.arange(n), rng.random(n), n_out)
+    assert len(idx) == n_out
+    assert idx[0] == 0
+    assert idx[-1] == n - 1
+    assert np.all(np.diff(idx) > 0)
+
+
+@pytest.mark.parametrize('n, n_out', [(0, 5), (1, 5), (2, 5), (5, 5), (5, 10), (10, 2)])
+def test_lttb_returns_all_points_when_nothing_to_reduce(n, n_out):
+    idx = lttb_indices(np.arange(n), np.zeros(n), n_out)
+    assert idx.tolist() == list(range(n))
+
+
+def test_lttb_picks_spike():
+    y = np.zeros(300)
+    y[150] = 10.0
+    idx = lttb_indices(np.arange(300), y, 20)
+    assert 150 in idx
+
+
+def test_downsample_history_small_input_unchanged():
+    data = _history([1.0, 2.0, 3.0])
+    assert downsample_history(data, 10) is data
+    assert downsample_history(data, None) is data
+
+
+def test_downsample_history_keeps_global_extremes():
+    rng = np.random.default_rng(7)
+    values = rng.normal(0.0, 1.0, 5000)
+    values[1234] = -50.0
+    values[4321] = 75.0
+    out = downsample_history(_history(values), 100)
+
+    assert out['downsampled_from'] == 5000
+    assert len(out['ts']) <= 102
+    assert min(out['value']) == -50.0
+    assert max(out['value']) == 75.0
+    # Omhullende dekt alle onderliggende punten
+    assert min(out['min']) == -50.0
+    assert max(out['max']) == 75.0
+    assert out['ts'][0] == 0 and out['ts'][-1] == 4999 * 1000
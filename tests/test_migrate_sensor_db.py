@@ -0,0 +1,51 @@
+# tests/test_migrate_sensor_db.py
+import sqlite3
+
+from obelix.config import Config
+from obelix.db_pool import fetchall, transaction
+from obelix.migrate_sensor_db import migrate
+from obelix.sensor_database import init_sensor_db
+
+DAY_MS = 24 * 60 * 60 * 1000
+# 2024-01-10T00:00:00Z
+JAN_10_MS = 1704844800000
+
+
+def _legacy_rows(db_file, rows):
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+        CREATE TABLE sensor_data (
+            timestamp TEXT, unit_index INTEGER, channel INTEGER,
+            value REAL, raw REAL, unit TEXT
+        )
+    ''')
+    conn.executemany('INSERT INTO sensor_data VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def test_migration_keeps_rollups_without_raw_rows(tmp_dbs):
+    db_file = Config.SENSOR_DB_FILE
+    init_sensor_db()
+    # Dag waarvan de ruwe rijen al door retentie zijn opgeruimd
+    pruned_day = JAN_10_MS - 5 * DAY_MS
+    with transaction(db_file) as conn:
+        conn.execute('''
+            INSERT INTO sensor_rollup_1d (unit_index, channel, bucket, vmin, vmax, vsum, n)
+            VALUES (4, 0, ?, 1.0, 3.0, 20.0, 10)
+        ''', (pruned_day,))
+    _legacy_rows(db_file, [
+        ('2024-01-10T00:00:00', 4, 0, 2.0, 200, ''),
+        ('2024-01-10T00:00:30', 4, 0, 4.0, 400, ''),
+    ])
+
+    assert migrate(db_file, pause=0) == 2
+
+    rows = fetchall(db_file, '''
+        SELECT bucket, vmin, vmax, vsum, n FROM sensor_rollup_1d
+        WHERE unit_index = 4 AND channel = 0 ORDER BY bucket
+    ''')
+    assert [tuple(r) for r in rows] == [
+        (pruned_day, 1.0, 3.0, 20.0, 10),
+        (JAN_10_MS, 2.0, 4.0, 6.0, 2),
+    ]
@@ -0,0 +1,158 @@
+# tests/test_sbr_recipe.py
+import json
+import time
+
+import pytest
+
+from obelix.config import Config
+from obelix.database import get_setting, set_setting
+from obelix.sbr_recipe import (
+    compile_recipe, legacy_recipe_definition, load_active_recipe, aio_percent_to_raw
+)
+
+
+@pytest.mark.parametrize('definition', [
+    {},
+    {'phases': []},
+    {'phases': [{'name': 'x', 'coils': {'99': True}, 'duration_s': 10}]},
+    {'phases': [{'name': 'x', 'aio': {'4': 50}, 'duration_s': 10}]},
+    {'phases': [{'name': 'x', 'aio': {'0': 150}, 'duration_s': 10}]},
+    {'phases': [{'name': 'x', 'aio': {'0': -1}, 'duration_s': 10}]},
+    {'phases': [{'name': 'x'}]},
+    {'phases': [{'name': 'x', 'duration_s': 0}]},
+    {'phases': [{'name': 'x', 'duration_s': -5}]},
+    {'phases': [{'name': 'x', 'until': {'sensor': [4, 0], 'op': '==', 'value': 1}}]},
+], ids=['empty', 'no-phases', 'unknown-coil', 'aio-channel', 'aio-over-100',
+        'aio-negative', 'no-duration-or-until', 'zero-duration', 'negative-duration',
+        'unknown-op'])
+def test_invalid_recipes_are_rejected(definition):
+    with pytest.raises(ValueError):
+        compile_recipe('bad', definition)
+
+
+def test_recipe_from_json_text_builds_transition_table():
+    recipe = compile_recipe('r', json.dumps({'phases': [
+        {'name': 'fill', 'coils': {'0': True}, 'duration_s': 10},
+        {'name': 'react', 'coils': {'3': True}, 'aio': {'0': 50}, 'duration_s': 20},
+        {'name': 'drain', 'coils': {'1': True}, 'duration_s': 30,
+         'until': {'sensor': [4, 0], 'op': '<=', 'value': 0.2}},
+    ]}))
+    assert [p.next for p in recipe.phases] == [1, 2, 0]
+    react = recipe.phases[1]
+    assert react.targets == {c: c == 3 for c in Config.R302_RELAY_MAPPING}
+    assert react.aio == ((0, aio_percent_to_raw(50), 50.0),)
+    assert recipe.phases[2].until is not None
+    assert recipe.phases[2].duration == 30.0
+
+
+def test_until_without_duration_is_unbounded():
+    recipe = compile_recipe('r', {'phases': [
+        {'name': 'drain', 'until': {'sensor': [4, 0], 'op': '<', 'value': 1}},
+    ]})
+    assert recipe.phases[0].duration == float('inf')
+    assert 'duration_s' not in recipe.definition['phases'][0]
+
+
+def test_legacy_recipe_matches_two_phase_program():
+    recipe = compile_recipe('default', legacy_recipe_definition(100, 60))
+    influent, effluent = recipe.phases
+    assert (influent.name, influent.duration, influent.next) == ('influent', 100.0, 1)
+    assert (effluent.name, effluent.duration, effluent.next) == ('effluent', 60.0, 0)
+    # Alleen de eigen pomp aan, alle andere R302-coils uit
+    assert influent.targets == {c: c == 0 for c in Config.R302_RELAY_MAPPING}
+    assert effluent.targets == {c: c == 1 for c in Config.R302_RELAY_MAPPING}
+    assert influent.aio == () and effluent.aio == ()
+    assert influent.until is None and effluent.until is None
+
+
+def test_load_active_recipe_creates_and_reloads_legacy(tmp_dbs):
+    created = load_active_recipe(100, 60)
+    assert get_setting('sbr_active_recipe') == created.name
+    reloaded = load_active_recipe(1, 1)  # opgeslagen recept wint van de fasetijden
+    assert reloaded.definition == created.definition
+    assert [p.duration for p in reloaded.phases] == [100.0, 60.0]
+
+
+# ----- Hervatten na een herstart (SBRController._load_checkpoint) -----
+
+def _controller():
+    # _load_checkpoint gebruikt alleen settings.db en het recept; zonder
+    # __init__ is er geen Modbus of Socket.IO nodig
+    from obelix.auto_control import SBRController
+    return SBRController.__new__(SBRController)
+
+
+@pytest.fixture
+def recipe():
+    return compile_recipe('r', {'phases': [
+        {'name': 'a', 'duration_s': 100},
+        {'name': 'b', 'duration_s': 200},
+        {'name': 'c', 'duration_s': 300},
+    ]})
+
+
+def _checkpoint(phase, phase_elapsed, cycle_elapsed, downtime, name='r'):
+    set_setting('sbr_checkpoint', json.dumps({
+        'recipe': name, 'phase': phase, 'phase_elapsed': phase_elapsed,
+        'cycle_elapsed': cycle_elapsed, 'wall': time.time() - downtime,
+    }))
+
+
+def _resume(recipe):
+    return _controller()._load_checkpoint(recipe)
+
+
+def test_resume_mid_phase(tmp_dbs, recipe, monkeypatch):
+    monkeypatch.setattr(Config, 'SBR_RESUME_COUNT_DOWNTIME', True)
+    _checkpoint(1, 50.0, 150.0, downtime=20)
+    idx, elapsed, cycle = _resume(recipe)
+    assert idx == 1
+    assert elapsed == pytest.approx(70.0, abs=0.5)
+    assert cycle == pytest.approx(170.0, abs=0.5)
+
+
+def test_resume_without_counting_downtime(tmp_dbs, recipe, monkeypatch):
+    monkeypatch.setattr(Config, 'SBR_RESUME_COUNT_DOWNTIME', False)
+    _checkpoint(1, 50.0, 150.0, downtime=1000)
+    assert _resume(recipe) == (1, 50.0, 150.0)
+
+
+def test_downtime_skips_expired_phase(tmp_dbs, recipe, monkeypatch):
+    monkeypatch.setattr(Config, 'SBR_RESUME_COUNT_DOWNTIME', True)
+    _checkpoint(1, 50.0, 150.0, downtime=200)
+    idx, elapsed, cycle = _resume(recipe)
+    assert idx == 2
+    assert elapsed == pytest.approx(50.0, abs=0.5)
+    assert cycle == pytest.approx(350.0, abs=0.5)
+
+
+def test_downtime_wraps_past_last_phase(tmp_dbs, recipe, monkeypatch):
+    monkeypatch.setattr(Config, 'SBR_RESUME_COUNT_DOWNTIME', True)
+    _checkpoint(2, 250.0, 550.0, downtime=100)
+    idx, elapsed, cycle = _resume(recipe)
+    assert idx == 0
+    # Nieuwe cycle: de cycle-timer begint bij de verstreken tijd in fase a
+    assert elapsed == pytest.approx(50.0, abs=0.5)
+    assert cycle == pytest.approx(50.0, abs=0.5)
+
+
+def test_downtime_longer_than_cycle_restarts_reached_phase(tmp_dbs, recipe, monkeypatch):
+    monkeypatch.setattr(Config, 'SBR_RESUME_COUNT_DOWNTIME', True)
+    _checkpoint(0, 10.0, 10.0, downtime=10_000)
+    assert _resume(recipe) == (0, 0.0, 0.0)
+
+
+@pytest.mark.parametrize('raw', ['', 'geen json', json.dumps({'phase': 1})])
+def test_missing_or_corrupt_checkpoint(tmp_dbs, recipe, raw):
+    set_setting('sbr_checkpoint', raw)
+    assert _resume(recipe) is None
+
+
+def test_checkpoint_of_other_recipe_is_ignored(tmp_dbs, recipe):
+    _checkpoint(1, 50.0, 150.0, downtime=0, name='ander')
+    assert _resume(recipe) is None
+
+
+def test_checkpoint_phase_out_of_range_is_ignored(tmp_dbs, recipe):
+    _checkpoint(7, 0.0, 0.0, downtime=0)
+    assert _resume(recipe) is None